@@ -5,13 +5,34 @@ import json
 import shutil
 from datetime import datetime
 from fpdf import FPDF
+from fpdf.ttfonts import TTFontFile
 from docx import Document
 from docx.shared import Inches, Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, Listbox, Toplevel
 import base64
 from PIL import Image, ImageTk
 import re
+import sqlite3
+import threading
+import queue
+import time
+import glob
+import bisect
+import zlib
+import struct
+import atexit
+import hashlib
+import csv
+import itertools
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager, nullcontext, ExitStack
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
 
 # --- CONFIGURATION ---
 # Get the correct base path for both development and frozen (EXE) environments
@@ -32,8 +53,43 @@ else:
 # File paths
 LOGOS_FOLDER = os.path.join(DB_FOLDER, "logos")
 HISTORY_FILE = os.path.join(DB_FOLDER, "history.json")
+HISTORY_DB_FILE = os.path.join(DB_FOLDER, "history.db")  # SQLite history store
+HISTORY_JOURNAL_FILE = os.path.join(DB_FOLDER, "history.journal")  # Old single-file journal
+HISTORY_SHARD_FOLDER = os.path.join(DB_FOLDER, "history")  # Per-business journal shards
+SEARCH_INDEX_FILE = os.path.join(DB_FOLDER, "search_index.db")  # Trigram index for history search
+CLIENTS_FILE = os.path.join(DB_FOLDER, "clients.db")  # Client directory for autocomplete
+ITEM_CATALOG_FILE = os.path.join(DB_FOLDER, "catalog.db")  # Item catalog for autocomplete
+ARCHIVE_FOLDER = os.path.join(DB_FOLDER, "archive")  # Compressed yearly archives of old invoices
+LOGO_CACHE_FOLDER = os.path.join(DB_FOLDER, "cache", "logos")  # PDF-ready copies of business logos
+FONT_CACHE_FOLDER = os.path.join(DB_FOLDER, "cache", "fonts")  # Parsed metrics of the PDF fonts
 PROFILES_FILE = os.path.join(DB_FOLDER, "profiles.json")
 LICENSE_FILE = os.path.join(DB_FOLDER, "license.json")  # New license file
+DB_LOCK_FILE = os.path.join(DB_FOLDER, "db.lock")  # Held by whichever app instance is writing to DB_FOLDER
+
+# History backend: "sqlite" (full database) or "journal" (per-business snapshot + append-only journal)
+HISTORY_BACKEND = "sqlite"
+HISTORY_ROW_HEIGHT = 112  # Height of one invoice card in the history sidebar (before DPI scaling)
+JOURNAL_COMPACT_BYTES = 2 * 1024 * 1024  # Fold the journal into the snapshot past this size
+ARCHIVE_KEEP_FINANCIAL_YEARS = 1  # Financial years (April-March) kept live, counting the current one
+ARCHIVE_AUTOMATICALLY = False  # Archive older invoices on load/import without asking (else: "Archive Old Invoices" button)
+ARCHIVE_BLOCK_SIZE = 64  # Invoices per compressed block in an archive file
+SUMMARY_INDEX_VERSION = 4  # Bump when invoice_summary gains fields so .idx caches get rebuilt
+HISTORY_SCHEMA_VERSION = 4  # Version of stored invoice records; see HISTORY_MIGRATIONS
+SEARCH_DEBOUNCE_MS = 250  # Wait for a pause in typing before searching history
+SEARCH_POLL_MS = 30  # How often the UI picks up finished searches
+WRITE_BATCH_MS = 400  # Saves of the same settings file closer together than this are written once
+LOCK_TIMEOUT_S = 15  # Give up waiting for another instance's DB lock after this long
+SHARED_POLL_MS = 2000  # How often to pick up changes saved by other instances sharing DB_FOLDER
+CHANGE_LOG_KEEP = 5000  # History changes kept for other instances to catch up on (SQLite backend)
+LOGO_MAX_PIXELS = 600  # Longest side of a cached PDF logo: ~300 dpi at the widest logo (50mm)
+PDF_FONT_FACES = {'': "DejaVuSans.ttf", 'B': "DejaVuSans-Bold.ttf"}  # Unicode PDF font per style, in RESOURCE_DIR
+FONT_METRICS_VERSION = 1  # Bump when the cached font metrics change shape so they get re-parsed
+FONT_SUBSET_CACHE_SIZE = 32  # Embedded font subsets kept in memory for reuse by later PDFs
+EXPORT_PROGRESS_EVERY = 250  # Invoices written between progress updates of a CSV export
+IMPORT_BATCH_ROWS = 500  # CSV rows validated (and invoice items looked up) together during an import
+RENDER_WORKERS = None  # Processes that batch-render PDFs; None uses one per CPU core
+RENDER_BATCH_INVOICES = 25  # Invoices handed to a render worker at a time
+IMPORT_TOTAL_TOLERANCE = 0.05  # Rounding difference (Rs) accepted between imported and recomputed amounts
 
 # Ensure directories exist
 os.makedirs(DB_FOLDER, exist_ok=True)
@@ -96,6 +152,3670 @@ DEFAULT_PROFILES = {
 }
 
 
+# --- PERSISTENCE ---
+# Every DB file is replaced atomically: written in full to a uniquely named "<file>.<random>.tmp"
+# and fsynced, then a "<temp file>.pending" write-ahead marker naming <file> is written before the
+# rename. A crash leaves either the old file or a complete new one, and recover_pending_writes()
+# finishes any rename that was cut short. Unique names keep two instances writing the same file
+# on a shared drive from clobbering each other's temp file or marker.
+
+def fsync_directory(folder):
+    """Make a rename in folder durable (not supported on Windows, where it is a no-op)"""
+    if os.name == 'nt':
+        return
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def commit_temp_file(tmp_path, path):
+    """Move a fully written and fsynced temp file (in path's folder) over path, behind a write-ahead marker"""
+    marker_path = tmp_path + ".pending"
+    with open(marker_path, 'w', encoding='utf-8') as f:
+        f.write(os.path.basename(path))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(os.path.dirname(path) or ".")
+    os.remove(marker_path)
+
+
+@contextmanager
+def atomic_file(path, mode='wb', encoding=None, newline=None):
+    """Open a temp file for writing; it replaces path only if the block finishes without error"""
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                    dir=os.path.dirname(path) or ".")
+    try:
+        with open(fd, mode, encoding=encoding, newline=newline) as f:
+            # mkstemp makes the file owner-only; keep the mode the file had (or a plain file's)
+            try:
+                shutil.copymode(path, tmp_path)
+            except OSError:
+                os.chmod(tmp_path, 0o644)
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    commit_temp_file(tmp_path, path)
+
+
+def write_json_atomic(path, data, indent=None):
+    with atomic_file(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=indent)
+
+
+def quarantine_file(path):
+    """Move an unreadable file aside so it is neither used nor overwritten; returns the new path"""
+    corrupt_path = f"{path}.corrupt-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    try:
+        os.replace(path, corrupt_path)
+    except OSError as e:
+        print(f"Could not move corrupt file {path} aside: {e}")
+        return None
+    print(f"Corrupt file moved aside to {corrupt_path}")
+    return corrupt_path
+
+
+def read_json_file(path, default):
+    """Parsed JSON of path, or default if it is missing; a corrupt file is quarantined first"""
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (ValueError, UnicodeDecodeError) as e:
+        print(f"Could not parse {path}: {e}")
+        quarantine_file(path)
+    except OSError as e:
+        print(f"Could not read {path}: {e}")
+    return default
+
+
+def recover_pending_writes(folder):
+    """Finish or roll back atomic writes interrupted by a crash; run at startup before any file is read
+
+    A marker means its temp file was complete, so the rename is redone. A temp file without a
+    marker was still being written and is removed; the old file it was replacing is intact.
+    """
+    for root, _, files in os.walk(folder):
+        names = set(files)
+        for name in files:
+            if not name.endswith(".pending"):
+                continue
+            marker_path = os.path.join(root, name)
+            stem = name[:-len(".pending")]
+            path = os.path.join(root, stem)
+            try:
+                with open(marker_path, 'r', encoding='utf-8') as f:
+                    named = os.path.basename(f.read().strip())
+                if stem.endswith(".tmp"):
+                    # "<temp file>.pending" holds the name of the file it replaces
+                    tmp_name, path = stem, os.path.join(root, named)
+                else:
+                    # Older "<file>.pending" markers hold the temp file's name
+                    tmp_name = named
+                if tmp_name in names:
+                    os.replace(os.path.join(root, tmp_name), path)
+                    names.discard(tmp_name)
+                    print(f"Recovered interrupted write of {path}")
+                os.remove(marker_path)
+            except OSError as e:
+                print(f"Could not recover {path}: {e}")
+        for name in names:
+            if name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(root, name))
+                    print(f"Removed incomplete write {os.path.join(root, name)}")
+                except OSError as e:
+                    print(f"Could not remove {name}: {e}")
+    fsync_directory(folder)
+
+
+def file_stamp(path):
+    """(size, mtime_ns) of a file, or None if it doesn't exist; changes whenever it is rewritten"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+class FileLock:
+    """Advisory lock on a lock file, shared by every app instance that uses the same DB folder
+
+    Several counter PCs can point at one DB folder on a shared drive; each read-modify-write of
+    profiles or history runs under this lock. Re-entrant within a process, so nested steps can
+    each take it. Raises TimeoutError if another instance holds it for longer than timeout.
+    """
+
+    def __init__(self, path, timeout=LOCK_TIMEOUT_S):
+        self.path = path
+        self.timeout = timeout
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def acquire(self):
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            try:
+                self.file = self.lock_file()
+            except BaseException:
+                self.thread_lock.release()
+                raise
+        self.depth += 1
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            try:
+                if os.name == 'nt':
+                    self.file.seek(0)
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            finally:
+                self.file.close()
+                self.file = None
+        self.thread_lock.release()
+
+    def lock_file(self):
+        f = open(self.path, 'a+b')
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if os.name == 'nt':
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except OSError:
+                if time.monotonic() >= deadline:
+                    f.close()
+                    raise TimeoutError(f"{self.path} is locked by another instance")
+                time.sleep(0.05)
+
+
+def merge_profiles(base, ours, theirs):
+    """Three-way merge of profiles.json: keep our edits since base, take every other change from theirs
+
+    last_invoice_num only ever moves forward, so two counters can't hand out the same number.
+    """
+    theirs = theirs if isinstance(theirs, dict) else {}
+    merged = {}
+    for biz_id in set(ours) | set(theirs):
+        our_profile = ours.get(biz_id, {})
+        their_profile = theirs.get(biz_id, {})
+        if not (isinstance(our_profile, dict) and isinstance(their_profile, dict)):
+            ours_changed = biz_id in ours and (biz_id not in theirs or our_profile != base.get(biz_id))
+            merged[biz_id] = our_profile if ours_changed else their_profile
+            continue
+        base_profile = base.get(biz_id) if isinstance(base.get(biz_id), dict) else {}
+        profile = {}
+        for key in set(our_profile) | set(their_profile):
+            if key == "last_invoice_num":
+                profile[key] = max(our_profile.get(key, 0), their_profile.get(key, 0))
+            elif key in our_profile and our_profile[key] != base_profile.get(key):
+                profile[key] = our_profile[key]
+            else:
+                profile[key] = their_profile.get(key, our_profile.get(key))
+        merged[biz_id] = profile
+    return merged
+
+
+def settled_profiles(base, ours, written):
+    """The merge base once written (a merge of ours) is on disk
+
+    Where written holds our value, we and the file agree on it now. Anything merged in from
+    other instances keeps its old base value, so it still counts as their change until
+    refresh_profiles takes it into our profiles.
+    """
+    settled = {}
+    for biz_id, profile in written.items():
+        our_profile = ours.get(biz_id)
+        base_profile = base.get(biz_id)
+        if profile == our_profile:
+            settled[biz_id] = profile
+        elif isinstance(profile, dict) and isinstance(our_profile, dict):
+            base_profile = base_profile if isinstance(base_profile, dict) else {}
+            settled[biz_id] = {}
+            for key, value in profile.items():
+                if key in our_profile and our_profile[key] == value:
+                    settled[biz_id][key] = value
+                elif key in base_profile:
+                    settled[biz_id][key] = base_profile[key]
+        elif biz_id in base:
+            settled[biz_id] = base_profile
+    return settled
+
+
+class BatchedJsonWriter:
+    """Coalesces closely spaced saves of the same JSON file into one atomic write
+
+    The data is serialized when save() is called, so later changes to it don't leak into the
+    write; only the newest version of each file is flushed, WRITE_BATCH_MS after the first save.
+    A save can name a FileLock to write under and a merge(data) hook that folds in what other
+    instances wrote since, called with the lock held, and a written(data, merged) hook called
+    (lock still held) once the merged data is on disk.
+    """
+
+    def __init__(self, delay_ms=None):
+        self.delay = (WRITE_BATCH_MS if delay_ms is None else delay_ms) / 1000
+        self.pending = {}  # path -> (text, indent, lock, merge, written)
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # Keeps flushes of the same file in order
+        self.timer = None
+        atexit.register(self.flush)
+
+    def save(self, path, data, indent=None, defer=True, lock=None, merge=None, written=None):
+        """Queue a write of data to path; defer=False writes it (and anything queued) right away"""
+        text = json.dumps(data, indent=indent)
+        with self.lock:
+            self.pending[path] = (text, indent, lock, merge, written)
+            if defer:
+                self.schedule()
+        if not defer:
+            self.flush()
+
+    def schedule(self):
+        """Start the flush timer if it isn't running (caller holds self.lock)"""
+        if self.timer is None:
+            self.timer = threading.Timer(self.delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """Write every pending file now"""
+        with self.flush_lock:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+                pending, self.pending = self.pending, {}
+            for path, entry in pending.items():
+                text, indent, lock, merge, written = entry
+                try:
+                    with lock or nullcontext():
+                        data = merged = json.loads(text) if merge or written else None
+                        if merge:
+                            merged = merge(data)
+                            text = json.dumps(merged, indent=indent)
+                        with atomic_file(path, 'w', encoding='utf-8') as f:
+                            f.write(text)
+                        if written:
+                            written(data, merged)
+                except TimeoutError as e:
+                    print(f"{e}; will retry saving {path}")
+                    with self.lock:
+                        self.pending.setdefault(path, entry)
+                        self.schedule()
+                except OSError as e:
+                    print(f"Could not save {path}: {e}")
+
+
+JSON_WRITER = BatchedJsonWriter()
+
+
+# --- VALIDATION ---
+
+EMAIL_PATTERN = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+
+
+def is_valid_email(email):
+    return re.match(EMAIL_PATTERN, email) is not None
+
+
+def is_valid_phone(phone):
+    """Phone numbers must have exactly 10 digits (spaces, dashes etc. are ignored)"""
+    return len(''.join(filter(str.isdigit, phone))) == 10
+
+
+def parse_quantity(qty_str):
+    """Parse quantity string that can be fraction (1/2, 1/4) or decimal (15.5)
+
+    Returns (text as typed, value), or (None, None) if it is blank or unreadable.
+    """
+    qty_str = qty_str.strip()
+    if not qty_str:
+        return None, None
+    
+    # Check if it's a fraction (e.g., 1/2, 1/4, 3/4)
+    if '/' in qty_str:
+        try:
+            parts = qty_str.split('/')
+            if len(parts) == 2:
+                numerator = float(parts[0].strip())
+                denominator = float(parts[1].strip())
+                if denominator != 0:
+                    decimal_value = numerator / denominator
+                    # Return both the original fraction string and decimal value
+                    return qty_str, decimal_value
+        except:
+            pass
+    
+    # Try to parse as float/decimal
+    try:
+        decimal_value = float(qty_str)
+        return qty_str, decimal_value
+    except:
+        return None, None
+
+
+def invoice_totals(subtotal, discount_rate, tax_rate):
+    """Invoice amounts from the items' subtotal: the discount comes off first, tax is on the rest"""
+    discount_amt = subtotal * (discount_rate / 100)
+    taxable_subtotal = subtotal - discount_amt
+    tax_amt = taxable_subtotal * (tax_rate / 100)
+    return {
+        "subtotal": subtotal,
+        "discount_rate": discount_rate,
+        "discount_amt": discount_amt,
+        "tax_rate": tax_rate,
+        "tax_amt": tax_amt,
+        "total": taxable_subtotal + tax_amt
+    }
+
+
+# --- HISTORY STORAGE ---
+
+class JsonStreamReader:
+    """Incremental JSON reader: steps through a file's lists and objects a chunk at a time
+
+    Containers are walked token by token; only the values taken with value() (one invoice,
+    say) are decoded whole, so a file's memory use is bounded by its largest single record.
+    """
+
+    CHUNK_SIZE = 1 << 16
+    WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        """Read another chunk, dropping what was already parsed; False at end of file"""
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character, without consuming it ("" at end of file)"""
+        while True:
+            self.pos = self.WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, chars):
+        """Consume the next character, which must be one of chars"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} but found {char or 'end of file'!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode and consume the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue  # The value goes on in the next chunk
+                raise
+            if end == len(self.buf) and self.fill():
+                continue  # A number or literal may be cut off at the chunk boundary
+            self.pos = end
+            return value
+
+
+def iter_json_list(reader):
+    """Yield the elements of the JSON list at the reader's position, one at a time"""
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.pos += 1
+        return
+    while True:
+        yield reader.value()
+        if reader.expect(",]") == "]":
+            return
+
+
+def iter_history_json(path):
+    """Stream a history.json file as (biz_id, invoice) pairs without loading the whole file
+
+    Reads both the per-business dict and the old list format, where each invoice carries its biz_id.
+    """
+    with open(path, 'r') as f:
+        reader = JsonStreamReader(f)
+        char = reader.peek()
+        if char == "[":
+            # Old list format: assign invoices to businesses based on biz_id if available
+            for item in iter_json_list(reader):
+                if not isinstance(item, dict):
+                    continue
+                biz_id = item.get('biz_id', 'biz_1')
+                if biz_id in DEFAULT_PROFILES:
+                    yield biz_id, item
+        elif char == "{":
+            reader.expect("{")
+            if reader.peek() == "}":
+                return
+            while True:
+                biz_id = reader.value()
+                reader.expect(":")
+                if reader.peek() == "[":
+                    for record in iter_json_list(reader):
+                        yield biz_id, record
+                else:
+                    reader.value()  # Not a business's invoice list
+                if reader.expect(",}") == "}":
+                    return
+
+
+def date_ordinal(text):
+    """dd-mm-YYYY date string -> day ordinal (int), or None for blank/"PENDING"/unparsable"""
+    try:
+        return datetime.strptime(str(text).strip(), "%d-%m-%Y").toordinal()
+    except ValueError:
+        return None
+
+
+def invoice_is_pending(record):
+    """True for an unpaid invoice (record or summary); older records said so with a "PENDING" due date"""
+    if record.get("is_pending") is not None:
+        return bool(record["is_pending"])
+    return str(record.get("due_date") or "").upper() == "PENDING"
+
+
+def with_date_ordinals(record):
+    """Fill in date_ord/due_date_ord on a record saved before they existed"""
+    if record.get("date_ord") is None:
+        record["date_ord"] = date_ordinal(record.get("date", ""))
+    if record.get("due_date_ord") is None:
+        record["due_date_ord"] = date_ordinal(record.get("due_date", ""))
+    return record
+
+
+# --- SCHEMA MIGRATIONS ---
+# Stored invoice records carry a schema version: the snapshot header of a journal shard, "v" on
+# journal events, PRAGMA user_version in history.db and "schema" in an archive's index. Anything
+# saved before versioning (history.json, list snapshots, old journals) is version 1.
+#
+# Each step upgrades a single record from one version to the next, so a history of any size is
+# migrated as a stream. To change the record format, bump HISTORY_SCHEMA_VERSION and register
+# the step that gets there.
+
+HISTORY_MIGRATIONS = {}  # from_version -> (description, step(record) -> record)
+
+
+def history_migration(from_version, description):
+    """Register the step that upgrades a record from from_version to from_version + 1"""
+    def register(step):
+        HISTORY_MIGRATIONS[from_version] = (description, step)
+        return step
+    return register
+
+
+@history_migration(1, "day ordinals for date and due date")
+def migrate_date_ordinals(record):
+    return with_date_ordinals(record)
+
+
+@history_migration(2, "invoice ids as text, price per unit on every item")
+def migrate_ids_and_items(record):
+    record["id"] = str(record.get("id", ""))
+    for item in record.get("items", []):
+        if item.get("price_per_unit") is None:
+            item["price_per_unit"] = item.get("price")
+    return record
+
+
+@history_migration(3, "is_pending flag instead of a PENDING due date")
+def migrate_pending_flag(record):
+    record["is_pending"] = invoice_is_pending(record)
+    if str(record.get("due_date") or "").upper() == "PENDING":
+        record["due_date"] = ""
+        record["due_date_ord"] = None
+    return record
+
+
+def migrate_record(record, version):
+    """Bring one invoice record from schema version up to HISTORY_SCHEMA_VERSION"""
+    for from_version in range(version, HISTORY_SCHEMA_VERSION):
+        record = HISTORY_MIGRATIONS[from_version][1](record)
+    return record
+
+
+def migrate_records(records, version):
+    """Stream records through migrate_record, one at a time"""
+    for record in records:
+        yield migrate_record(record, version)
+
+
+def financial_year_start(ordinal):
+    """Ordinal of 1 April that starts the financial year containing a day"""
+    day = datetime.fromordinal(ordinal)
+    year = day.year if day.month >= 4 else day.year - 1
+    return datetime(year, 4, 1).toordinal()
+
+
+def financial_year_label(ordinal):
+    """e.g. "FY2024-25" for any day from 1 April 2024 to 31 March 2025"""
+    year = datetime.fromordinal(financial_year_start(ordinal)).year
+    return f"FY{year}-{(year + 1) % 100:02d}"
+
+
+def archive_cutoff(keep_years=None):
+    """First day (ordinal) still kept in the live history; older invoices get archived"""
+    keep_years = ARCHIVE_KEEP_FINANCIAL_YEARS if keep_years is None else keep_years
+    start = datetime.fromordinal(financial_year_start(datetime.now().toordinal()))
+    return datetime(start.year - (keep_years - 1), 4, 1).toordinal()
+
+
+def invoice_summary(record):
+    """Lightweight sidebar entry for an invoice; the full record (with items) stays on disk"""
+    return {
+        "id": record.get("id"),
+        "client": record.get("client", ""),
+        "total": record.get("total", 0),
+        "tax_amt": record.get("tax_amt", 0),
+        "discount_amt": record.get("discount_amt", 0),
+        "date": record.get("date", ""),
+        "due_date": record.get("due_date", ""),
+        "is_pending": invoice_is_pending(record),
+        "date_ord": record["date_ord"] if "date_ord" in record else date_ordinal(record.get("date", "")),
+        "due_date_ord": (record["due_date_ord"] if "due_date_ord" in record
+                         else date_ordinal(record.get("due_date", ""))),
+    }
+
+
+class DateIndex:
+    """Invoice ids of one business sorted by date ordinal, for O(log n) date-range lookups"""
+
+    def __init__(self):
+        self.keys = []  # Sorted (date_ord, invoice id)
+
+    def add(self, summary):
+        if summary.get("date_ord") is not None:
+            bisect.insort(self.keys, (summary["date_ord"], str(summary['id'])))
+
+    def discard(self, summary):
+        if summary.get("date_ord") is None:
+            return
+        key = (summary["date_ord"], str(summary['id']))
+        pos = bisect.bisect_left(self.keys, key)
+        if pos < len(self.keys) and self.keys[pos] == key:
+            del self.keys[pos]
+
+    def between(self, start, end):
+        """Invoice ids dated from start to end (ordinals, inclusive), oldest first"""
+        lo = bisect.bisect_left(self.keys, (start, ""))
+        hi = bisect.bisect_left(self.keys, (end + 1, ""))
+        return [invoice_id for _, invoice_id in self.keys[lo:hi]]
+
+
+class InvoiceStats:
+    """Running totals of one business's invoices, updated in O(1) as invoices are added or removed
+
+    Amounts are kept in paise so adding and removing the same invoice never drifts.
+    An invoice counts as pending while its is_pending flag is set (see invoice_is_pending).
+    """
+
+    FIELDS = ["count", "gross", "tax", "discount", "pending_count", "pending"]
+
+    def __init__(self):
+        self.count = 0
+        self.gross = 0
+        self.tax = 0
+        self.discount = 0
+        self.pending_count = 0
+        self.pending = 0
+        self.daily = {}  # date -> [invoice count, total in paise]
+
+    @staticmethod
+    def paise(value):
+        try:
+            return int(round(float(value or 0) * 100))
+        except (TypeError, ValueError):
+            return 0
+
+    def apply(self, summary, sign):
+        total = self.paise(summary.get("total"))
+        self.count += sign
+        self.gross += sign * total
+        self.tax += sign * self.paise(summary.get("tax_amt"))
+        self.discount += sign * self.paise(summary.get("discount_amt"))
+        if invoice_is_pending(summary):
+            self.pending_count += sign
+            self.pending += sign * total
+        day = summary.get("date") or ""
+        takings = self.daily.setdefault(day, [0, 0])
+        takings[0] += sign
+        takings[1] += sign * total
+        if takings[0] == 0:
+            del self.daily[day]
+
+    def add(self, summary):
+        self.apply(summary, 1)
+
+    def discard(self, summary):
+        self.apply(summary, -1)
+
+    def day_total(self, day):
+        """Takings of one day (dd-mm-yyyy) in rupees"""
+        return self.daily.get(day, [0, 0])[1] / 100
+
+    def to_dict(self):
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        data["daily"] = self.daily
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for field in cls.FIELDS:
+            setattr(stats, field, data.get(field, 0))
+        stats.daily = data.get("daily", {})
+        return stats
+
+    def __eq__(self, other):
+        return isinstance(other, InvoiceStats) and self.to_dict() == other.to_dict()
+
+
+class InvoiceIndex:
+    """One business's invoice summaries keyed by invoice id, in save order
+
+    slots holds the summaries in save order, with None tombstones where invoices were deleted;
+    positions maps invoice id -> slot. Lookup, upsert (re-saving an invoice replaces it in
+    place) and delete are O(1); tombstones are squeezed out once they pile up. Iterating and
+    indexing skip tombstones, so it can stand in for the plain list of summaries. stats holds
+    the business's running totals and dates its invoices sorted by date.
+    """
+
+    def __init__(self, summaries=()):
+        self.slots = []
+        self.positions = {}  # str(invoice id) -> slot
+        self.tombstones = []  # Sorted slots of deleted invoices
+        self.stats = InvoiceStats()
+        self.dates = DateIndex()
+        for summary in summaries:
+            self.upsert(summary)
+
+    def __len__(self):
+        return len(self.slots) - len(self.tombstones)
+
+    def __iter__(self):
+        return (summary for summary in self.slots if summary is not None)
+
+    def __contains__(self, invoice_id):
+        return str(invoice_id) in self.positions
+
+    def __getitem__(self, index):
+        """Summary at a position counted over live invoices only"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("invoice index out of range")
+        slot = index
+        for tombstone in self.tombstones:
+            if tombstone > slot:
+                break
+            slot += 1
+        return self.slots[slot]
+
+    def get(self, invoice_id):
+        slot = self.positions.get(str(invoice_id))
+        return None if slot is None else self.slots[slot]
+
+    def row_of(self, invoice_id):
+        """Position of an invoice among the live invoices, or None"""
+        slot = self.positions.get(str(invoice_id))
+        if slot is None:
+            return None
+        return slot - bisect.bisect_left(self.tombstones, slot)
+
+    def upsert(self, summary):
+        """Add an invoice, or replace the one with the same id where it stands"""
+        key = str(summary['id'])
+        slot = self.positions.get(key)
+        if slot is None:
+            self.positions[key] = len(self.slots)
+            self.slots.append(summary)
+        else:
+            self.stats.discard(self.slots[slot])
+            self.dates.discard(self.slots[slot])
+            self.slots[slot] = summary
+        self.stats.add(summary)
+        self.dates.add(summary)
+
+    def remove(self, invoice_id):
+        """Tombstone an invoice; returns the summary that was removed, or None"""
+        slot = self.positions.pop(str(invoice_id), None)
+        if slot is None:
+            return None
+        summary = self.slots[slot]
+        self.slots[slot] = None
+        self.stats.discard(summary)
+        self.dates.discard(summary)
+        bisect.insort(self.tombstones, slot)
+        if len(self.tombstones) > max(32, len(self.slots) // 8):
+            self.compact()
+        return summary
+
+    def between(self, start, end):
+        """Summaries dated from start to end (ordinals, inclusive), oldest first"""
+        return [self.get(invoice_id) for invoice_id in self.dates.between(start, end)]
+
+    def compact(self):
+        """Drop tombstones and renumber the slots"""
+        if not self.tombstones:
+            return
+        self.slots = [summary for summary in self.slots if summary is not None]
+        self.positions = {str(summary['id']): slot for slot, summary in enumerate(self.slots)}
+        self.tombstones = []
+
+
+def iter_journal_events(journal_path):
+    """Yield the events of a journal file; a torn line from a crash is skipped"""
+    if not os.path.exists(journal_path):
+        return
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line_num, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                print(f"Skipping unreadable journal line {line_num} in {journal_path}")
+
+
+def iter_journaled_history(snapshot_path, journal_path):
+    """Stream the old single-file history (history.json + history.journal) as (biz_id, invoice) pairs
+
+    The journal is small (it was compacted into the snapshot), so its net effect is read first;
+    snapshot invoices it updated or deleted are then swapped or dropped as they stream past, and
+    invoices it created follow at the end.
+    """
+    DELETED = object()
+    changes = {}  # (biz_id, invoice id) -> latest invoice, or DELETED
+    for path in (journal_path + ".compacting", journal_path):
+        for event in iter_journal_events(path):
+            if event.get("op") == "delete":
+                changes[(event.get("biz_id"), str(event["id"]))] = DELETED
+            elif event.get("op") in ("create", "update"):
+                key = (event.get("biz_id"), str(event["invoice"]["id"]))
+                changes.pop(key, None)  # Keep journal order for invoices created after a delete
+                changes[key] = event["invoice"]
+
+    if os.path.exists(snapshot_path):
+        for biz_id, record in iter_history_json(snapshot_path):
+            key = (biz_id, str(record.get('id')))
+            change = changes.get(key)
+            if change is DELETED:
+                continue
+            if change is not None:
+                record = changes.pop(key)
+            yield biz_id, record
+    for (biz_id, _), record in changes.items():
+        if record is not DELETED:
+            yield biz_id, record
+
+
+class JournalHistoryShard:
+    """One business's history: a JSON-lines snapshot plus an append-only journal of invoice events
+
+    Every save appends one JSON line, so the write cost does not grow with the history and a crash
+    can only lose the line being written. A background thread folds the journal into the snapshot
+    once it grows past JOURNAL_COMPACT_BYTES.
+
+    Only invoice summaries (see invoice_summary) are kept in memory, each with the byte offset of
+    its full record. A small .idx sidecar caches the snapshot's summaries so startup doesn't have
+    to parse every invoice.
+
+    Other app instances may share the files: appends, loads and compactions run under
+    shared_lock (a FileLock), and poll_changes picks up the journal lines they added.
+    """
+
+    def __init__(self, snapshot_path, journal_path, compact_bytes=JOURNAL_COMPACT_BYTES, shared_lock=None):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.index_path = os.path.splitext(snapshot_path)[0] + ".idx"
+        self.stats_path = os.path.splitext(snapshot_path)[0] + ".stats.json"
+        self.compact_bytes = compact_bytes
+        self.shared_lock = shared_lock or nullcontext()
+        self.lock = threading.Lock()
+        self.compact_lock = threading.Lock()  # Only one compaction at a time
+        self.compactor = None
+        self.summaries = None  # Loaded summaries, newest last
+        self.journal_end = 0  # Bytes of the live journal already applied to summaries
+        self.snapshot_stamp = None  # file_stamp of the snapshot the summaries were loaded from
+        self.stale = False  # Another instance compacted the shard; reload before using the summaries
+        self.foreign = set()  # Ids changed by other instances, not reported by poll_changes yet
+
+    # --- Snapshot files ---
+
+    def read_header(self):
+        """First line of the snapshot: {"schema": 1, "folded": <journal already folded in>}"""
+        if not os.path.exists(self.snapshot_path):
+            return {}
+        with open(self.snapshot_path, 'rb') as f:
+            first = f.readline()
+        try:
+            header = json.loads(first)
+        except ValueError:
+            return {}
+        return header if isinstance(header, dict) and "schema" in header else {}
+
+    def iter_snapshot(self):
+        """Yield (offset, record) for every invoice line in the snapshot"""
+        if not os.path.exists(self.snapshot_path):
+            return
+        with open(self.snapshot_path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if "schema" not in record:
+                        yield offset, record
+                offset += len(line)
+
+    def write_snapshot_lines(self, lines, folded=None, tmp_path=None):
+        """Write a new snapshot to a temp file; returns (tmp_path, offset of each line)"""
+        tmp_path = tmp_path or f"{self.snapshot_path}.{os.getpid()}-{time.time_ns()}.tmp"
+        offsets = []
+        with open(tmp_path, 'wb') as f:
+            header = {"schema": HISTORY_SCHEMA_VERSION, "folded": folded}
+            f.write((json.dumps(header) + "\n").encode('utf-8'))
+            for line in lines:
+                offsets.append(f.tell())
+                f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp_path, offsets
+
+    def write_snapshot(self, records, folded=None):
+        """Replace the snapshot with the given full records, written as they stream in (used by migrations)"""
+        summaries = []
+
+        def lines():
+            for record in records:
+                summaries.append(invoice_summary(record))
+                yield (json.dumps(record) + "\n").encode('utf-8')
+
+        tmp_path, offsets = self.write_snapshot_lines(lines(), folded=folded)
+        commit_temp_file(tmp_path, self.snapshot_path)
+        for summary, offset in zip(summaries, offsets):
+            summary.update(source="snapshot", offset=offset)
+        self.write_index(summaries)
+        return summaries
+
+    def snapshot_version(self):
+        """Schema version of the snapshot's records (1 for a snapshot written as one JSON list)"""
+        if not os.path.exists(self.snapshot_path):
+            return HISTORY_SCHEMA_VERSION
+        if self.is_list_snapshot():
+            return 1
+        header = self.read_header()
+        if not header:
+            return 1
+        if header["schema"] == 1 and header.get("date_ord"):
+            return 2  # Written before versioning, when ordinals were flagged on their own
+        return header["schema"]
+
+    def is_list_snapshot(self):
+        with open(self.snapshot_path, 'rb') as f:
+            return f.read(1).strip() == b"["
+
+    def iter_list_snapshot(self):
+        """Records of a snapshot written as one JSON list, read incrementally"""
+        with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+            yield from iter_json_list(JsonStreamReader(f))
+
+    def migrate_snapshot(self):
+        """Upgrade an older snapshot to HISTORY_SCHEMA_VERSION, one record at a time
+
+        The upgraded records are streamed into a temp file that replaces the snapshot atomically.
+        """
+        version = self.snapshot_version()
+        if version >= HISTORY_SCHEMA_VERSION:
+            return
+        if self.is_list_snapshot():
+            records, folded = self.iter_list_snapshot(), None
+        else:
+            records = (record for _, record in self.iter_snapshot())
+            folded = self.read_header().get("folded")
+        self.write_snapshot(migrate_records(records, version), folded=folded)
+        print(f"Migrated {self.snapshot_path} from schema {version} to {HISTORY_SCHEMA_VERSION}")
+
+    def write_index(self, summaries):
+        """Cache the snapshot's summaries, stamped with the snapshot's size and mtime"""
+        stat = os.stat(self.snapshot_path)
+        index = {
+            "version": SUMMARY_INDEX_VERSION,
+            "snapshot_size": stat.st_size,
+            "snapshot_mtime": stat.st_mtime_ns,
+            "summaries": [{k: v for k, v in s.items() if k != "source"} for s in summaries],
+        }
+        write_json_atomic(self.index_path, index)
+
+    def read_index(self):
+        """Snapshot summaries from the .idx sidecar, or None if it is missing or stale"""
+        if not os.path.exists(self.snapshot_path):
+            return []
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            stat = os.stat(self.snapshot_path)
+            if index.get("version") != SUMMARY_INDEX_VERSION:
+                return None
+            if index["snapshot_size"] != stat.st_size or index["snapshot_mtime"] != stat.st_mtime_ns:
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+        for summary in index["summaries"]:
+            summary["source"] = "snapshot"
+        return index["summaries"]
+
+    def read_stats(self):
+        """Totals saved by the last change, or None"""
+        try:
+            with open(self.stats_path, 'r', encoding='utf-8') as f:
+                return InvoiceStats.from_dict(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def write_stats(self, stats):
+        write_json_atomic(self.stats_path, stats.to_dict())
+
+    # --- Journal files ---
+
+    def rotated_journals(self):
+        """Journals renamed aside by a compaction that has not finished yet"""
+        return sorted(glob.glob(glob.escape(self.journal_path) + ".*.compacting"))
+
+    def iter_journal(self, path):
+        """Yield (offset, event) for a journal file; a torn line from a crash is skipped"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            offset = 0
+            for line_num, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        yield offset, json.loads(line)
+                    except ValueError:
+                        print(f"Skipping unreadable journal line {line_num} in {path}")
+                offset += len(line)
+
+    def repair_journal(self):
+        """Cut off a half-written last line so new events don't get glued onto it"""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb+') as f:
+            data = f.read()
+            if not data or data.endswith(b"\n"):
+                return
+            keep = data.rfind(b"\n") + 1
+            f.truncate(keep)
+            print(f"Dropped incomplete last line from {self.journal_path}")
+
+    def apply_event(self, summaries, event, source, offset):
+        """Apply a journal event to an InvoiceIndex; create and update both upsert by id"""
+        if event.get("op") == "delete":
+            summaries.remove(event["id"])
+            return None
+        entry = invoice_summary(migrate_record(event["invoice"], event.get("v", 1)))
+        entry.update(source=source, offset=offset)
+        summaries.upsert(entry)
+        return entry
+
+    # --- Public API ---
+
+    def load(self):
+        """Load the business's invoice summaries (an InvoiceIndex) as snapshot index plus journal replay"""
+        with self.shared_lock, self.lock:
+            self.repair_journal()
+            self.migrate_snapshot()
+            summaries = self.read_index()
+            if summaries is None:
+                summaries = []
+                for offset, record in self.iter_snapshot():
+                    summary = invoice_summary(record)
+                    summary.update(source="snapshot", offset=offset)
+                    summaries.append(summary)
+                self.write_index(summaries)
+            summaries = InvoiceIndex(summaries)
+
+            folded = self.read_header().get("folded")
+            for path in self.rotated_journals():
+                if folded and os.path.basename(path) == folded:
+                    # Compaction finished but crashed before removing the old journal
+                    os.remove(path)
+                    continue
+                for offset, event in self.iter_journal(path):
+                    self.apply_event(summaries, event, path, offset)
+            for offset, event in self.iter_journal(self.journal_path):
+                self.apply_event(summaries, event, "journal", offset)
+            self.summaries = summaries
+            self.journal_end = self.journal_size()
+            self.snapshot_stamp = file_stamp(self.snapshot_path)
+            self.stale = False
+            self.foreign = set()
+            if self.read_stats() != summaries.stats:
+                self.write_stats(summaries.stats)
+        self.maybe_compact()
+        return summaries
+
+    def source_path(self, source):
+        if source == "snapshot":
+            return self.snapshot_path
+        if source == "journal":
+            return self.journal_path
+        return source  # Rotated journal path
+
+    def read_record_line(self, summary):
+        """Raw JSON line of the full record a summary points at"""
+        with open(self.source_path(summary["source"]), 'rb') as f:
+            f.seek(summary["offset"])
+            line = f.readline()
+        if summary["source"] == "snapshot":
+            return line
+        event = json.loads(line)
+        return (json.dumps(migrate_record(event["invoice"], event.get("v", 1))) + "\n").encode('utf-8')
+
+    def get_invoice(self, summary):
+        """Load the full invoice record for a summary"""
+        with self.lock:
+            return json.loads(self.read_record_line(summary))
+
+    def append_event(self, event):
+        """Append one event line, flush it to disk and apply it to the loaded summaries"""
+        return self.append_events([event])[0]
+
+    def append_events(self, events):
+        """Append several event lines with a single flush to disk"""
+        lines = [(json.dumps(event) + "\n").encode('utf-8') for event in events]
+        entries = []
+        with self.shared_lock, self.lock:
+            if self.summaries is not None:
+                self.catch_up()
+            with open(self.journal_path, 'ab') as f:
+                offsets = []
+                for line in lines:
+                    offsets.append(f.tell())
+                    f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+                if self.summaries is not None and not self.stale:
+                    self.journal_end = f.tell()
+            for event, offset in zip(events, offsets):
+                entry = None
+                if self.summaries is not None:
+                    entry = self.apply_event(self.summaries, event, "journal", offset)
+                entries.append(entry)
+            if self.summaries is not None:
+                self.write_stats(self.summaries.stats)
+        self.maybe_compact()
+        return entries
+
+    # --- Changes by other instances ---
+
+    def is_stale(self):
+        """True when another instance compacted the shard, so offsets in summaries point at old files"""
+        return (self.stale or file_stamp(self.snapshot_path) != self.snapshot_stamp
+                or self.journal_size() < self.journal_end)
+
+    def catch_up(self):
+        """Apply journal lines other instances appended since we last looked (caller holds self.lock)
+
+        Only complete lines are taken; a line still being written is picked up next time. If the
+        shard went stale, it is marked stale so poll_changes reloads it.
+        """
+        if self.is_stale():
+            self.stale = True
+            return
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(self.journal_end)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        offset = self.journal_end
+        for line in data[:data.rfind(b"\n") + 1].splitlines(keepends=True):
+            if line.strip():
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    print(f"Skipping unreadable journal line at byte {offset} in {self.journal_path}")
+                else:
+                    self.apply_event(self.summaries, event, "journal", offset)
+                    self.foreign.add(str(event["id"] if event.get("op") == "delete" else event["invoice"]["id"]))
+            offset += len(line)
+        self.journal_end = offset
+
+    def poll_changes(self):
+        """Ids of invoices other instances changed since the last call, or None if the shard was reloaded"""
+        with self.lock:
+            if self.summaries is None:
+                return set()
+            self.catch_up()
+            if not self.stale:
+                changed, self.foreign = self.foreign, set()
+                return changed
+        self.load()
+        return None
+
+    def insert(self, record):
+        return self.append_event({"op": "create", "v": HISTORY_SCHEMA_VERSION, "invoice": record})
+
+    def update(self, record):
+        return self.append_event({"op": "update", "v": HISTORY_SCHEMA_VERSION, "invoice": record})
+
+    def delete(self, invoice_id):
+        self.append_event({"op": "delete", "id": invoice_id})
+
+    def delete_many(self, invoice_ids):
+        self.append_events([{"op": "delete", "id": invoice_id} for invoice_id in invoice_ids])
+
+    def journal_size(self):
+        try:
+            return os.path.getsize(self.journal_path)
+        except OSError:
+            return 0
+
+    def maybe_compact(self):
+        """Start the background compactor when the journal is over the size threshold"""
+        if self.summaries is None or (self.compactor and self.compactor.is_alive()):
+            return
+        if self.journal_size() < self.compact_bytes and not self.rotated_journals():
+            return
+        self.compactor = threading.Thread(target=self.compact, daemon=True)
+        self.compactor.start()
+
+    def compact(self):
+        """Fold the journal into a new snapshot
+
+        The live journal is renamed aside under the lock so saves can keep appending to a fresh
+        one. The new snapshot is written from the in-memory summaries (raw lines copied by offset,
+        nothing re-parsed except journal events) and swapped in with an atomic rename. Its header
+        names the journal it folded in, so a crash before that journal is removed can't replay it
+        twice.
+
+        The rename and the swap also hold shared_lock. If another instance folded the same journal
+        in the meantime, this compaction's snapshot is thrown away.
+        """
+        with self.compact_lock:
+            self.fold_journal()
+
+    def fold_journal(self):
+        try:
+            with self.shared_lock, self.lock:
+                if self.summaries is not None:
+                    self.catch_up()
+                if self.summaries is None or self.stale:
+                    return  # Reloaded by the next poll_changes, which may start a fresh compaction
+                rotated = self.rotated_journals()
+                if rotated:
+                    rotated_path = rotated[0]
+                else:
+                    if not os.path.exists(self.journal_path):
+                        return
+                    rotated_path = f"{self.journal_path}.{time.time_ns()}.compacting"
+                    os.replace(self.journal_path, rotated_path)
+                    self.journal_end = 0
+                self.summaries.compact()
+                for summary in self.summaries:
+                    if summary["source"] == "journal":
+                        summary["source"] = rotated_path
+                pending = list(self.summaries)
+                folded_stamp = self.snapshot_stamp
+
+            tmp_path, offsets = self.write_snapshot_lines(
+                (self.read_record_line(summary) for summary in pending),
+                folded=os.path.basename(rotated_path),
+                tmp_path=f"{self.snapshot_path}.{os.getpid()}-{time.time_ns()}.tmp")
+
+            with self.shared_lock, self.lock:
+                if not os.path.exists(rotated_path) or file_stamp(self.snapshot_path) != folded_stamp:
+                    os.remove(tmp_path)
+                    self.stale = True
+                    print(f"{self.snapshot_path} was compacted by another instance")
+                    return
+                commit_temp_file(tmp_path, self.snapshot_path)
+                self.snapshot_stamp = file_stamp(self.snapshot_path)
+                for summary, offset in zip(pending, offsets):
+                    summary["source"] = "snapshot"
+                    summary["offset"] = offset
+                os.remove(rotated_path)
+                self.write_index(pending)
+            print(f"History journal compacted into {self.snapshot_path}")
+        except Exception as e:
+            print(f"History compaction failed: {e}")
+
+    def close(self):
+        if self.compactor and self.compactor.is_alive():
+            self.compactor.join()
+
+
+class JournalHistoryStore:
+    """Lightweight history backend with one journal shard per business in DB/history/
+
+    Saving an invoice only touches the active business's journal, so a busy business
+    doesn't slow down saves for the others.
+    """
+
+    def __init__(self, folder, compact_bytes=JOURNAL_COMPACT_BYTES, shared_lock=None):
+        self.folder = folder
+        self.compact_bytes = compact_bytes
+        self.shared_lock = shared_lock
+        self.shards = {}
+        os.makedirs(folder, exist_ok=True)
+
+    def shard(self, biz_id):
+        if biz_id not in self.shards:
+            self.shards[biz_id] = JournalHistoryShard(
+                os.path.join(self.folder, f"{biz_id}.json"),
+                os.path.join(self.folder, f"{biz_id}.journal"),
+                self.compact_bytes, self.shared_lock)
+        return self.shards[biz_id]
+
+    def poll_changes(self):
+        """{biz_id: ids other instances changed} for loaded businesses; None instead of ids = reloaded"""
+        changes = {}
+        for biz_id, shard in list(self.shards.items()):
+            changed = shard.poll_changes()
+            if changed is None or changed:
+                changes[biz_id] = changed
+        return changes
+
+    def load_business(self, biz_id):
+        """InvoiceIndex of one business's summaries (kept up to date by insert/update/delete)"""
+        shard = self.shard(biz_id)
+        return shard.summaries if shard.summaries is not None else shard.load()
+
+    def get_invoice(self, biz_id, summary):
+        return self.shard(biz_id).get_invoice(summary)
+
+    def read_stats(self, biz_id):
+        """Saved totals of a business without loading its history (None if never saved)"""
+        return self.shard(biz_id).read_stats()
+
+    def iter_invoices(self, biz_id):
+        """Yield one business's full invoice records, one at a time"""
+        shard = self.shard(biz_id)
+        for summary in list(self.load_business(biz_id)):
+            yield shard.get_invoice(summary)
+
+    def iter_records(self, biz_id, summaries):
+        """Yield the full records of some of a business's summaries, in their order"""
+        shard = self.shard(biz_id)
+        for summary in summaries:
+            yield shard.get_invoice(summary)
+
+    def insert(self, biz_id, record):
+        return self.shard(biz_id).insert(record)
+
+    def import_invoices(self, invoices, on_record=None):
+        """Save a stream of new (biz_id, record) pairs; returns how many were saved
+
+        Each business's journal gets one write per IMPORT_BATCH_ROWS invoices. on_record(biz_id,
+        record) is called for each invoice so indexes can be updated in the same pass.
+        """
+        pending = {}  # biz_id -> create events not written yet
+        count = 0
+        for biz_id, record in invoices:
+            events = pending.setdefault(biz_id, [])
+            events.append({"op": "create", "v": HISTORY_SCHEMA_VERSION, "invoice": record})
+            if on_record:
+                on_record(biz_id, record)
+            count += 1
+            if len(events) >= IMPORT_BATCH_ROWS:
+                self.shard(biz_id).append_events(pending.pop(biz_id))
+        for biz_id, events in pending.items():
+            self.shard(biz_id).append_events(events)
+        return count
+
+    def update(self, biz_id, record):
+        return self.shard(biz_id).update(record)
+
+    def delete(self, biz_id, invoice_id):
+        self.shard(biz_id).delete(invoice_id)
+
+    def delete_many(self, biz_id, invoice_ids):
+        self.shard(biz_id).delete_many(invoice_ids)
+
+    def needs_migration(self, json_path, journal_path):
+        """True while an old single-file history.json (or journal) is waiting to be split into shards"""
+        if not os.path.exists(json_path) and not os.path.exists(journal_path):
+            return False
+        return not any(name.endswith(".json") for name in os.listdir(self.folder))
+
+    def migrate_from_json(self, json_path, journal_path, on_record=None):
+        """Split an old single-file history.json (and journal) into per-business shards once
+
+        The old file is streamed: each business's invoices are spooled to a temp file as JSON
+        lines, then every spool becomes that business's snapshot. on_record(biz_id, record) is
+        called for each migrated invoice so indexes can be built in the same pass. Raises if
+        the old file can't be read, before any shard is written.
+        """
+        if not self.needs_migration(json_path, journal_path):
+            return
+        spools = {}  # biz_id -> temp file of migrated records
+        try:
+            for biz_id, record in iter_journaled_history(json_path, journal_path):
+                record = migrate_record(record, 1)
+                if biz_id not in spools:
+                    spool_path = os.path.join(self.folder, f"{biz_id}.import.tmp")
+                    spools[biz_id] = open(spool_path, 'w+', encoding='utf-8')
+                spools[biz_id].write(json.dumps(record) + "\n")
+                if on_record:
+                    on_record(biz_id, record)
+            for biz_id, spool in spools.items():
+                spool.seek(0)
+                self.shard(biz_id).write_snapshot(json.loads(line) for line in spool)
+        finally:
+            for spool in spools.values():
+                spool.close()
+                os.remove(spool.name)
+
+        for path in (json_path, journal_path, journal_path + ".compacting"):
+            if os.path.exists(path):
+                try:
+                    os.replace(path, path + ".migrated")
+                except OSError as e:
+                    print(f"Could not rename migrated history file: {e}")
+        print(f"History split into per-business shards in {self.folder}")
+
+    def close(self):
+        for shard in self.shards.values():
+            shard.close()
+
+
+class SQLiteHistoryStore:
+    """Invoice history kept in SQLite so saving one invoice is one row insert, not a full file rewrite"""
+
+    # (history key, column) pairs stored directly on the invoices table
+    INVOICE_FIELDS = [
+        ("id", "invoice_id"),
+        ("client", "client"),
+        ("client_email", "client_email"),
+        ("client_phone", "client_phone"),
+        ("client_address", "client_address"),
+        ("total", "total"),
+        ("business", "business"),
+        ("subtotal", "subtotal"),
+        ("discount_rate", "discount_rate"),
+        ("discount_amt", "discount_amt"),
+        ("tax_rate", "tax_rate"),
+        ("tax_amt", "tax_amt"),
+        ("date", "date"),
+        ("due_date", "due_date"),
+        ("date_ord", "date_ord"),
+        ("due_date_ord", "due_date_ord"),
+        ("is_pending", "is_pending"),
+    ]
+    ITEM_FIELDS = [
+        ("desc", "description"),
+        ("price", "price"),
+        ("price_per_unit", "price_per_unit"),
+        ("quantity", "quantity"),
+        ("quantity_display", "quantity_display"),
+        ("unit", "unit"),
+    ]
+
+    READ_BATCH = 500  # Invoice rows fetched at a time when streaming a whole business
+
+    def __init__(self, db_path, shard_folder=None):
+        self.db_path = db_path
+        self.shard_folder = shard_folder  # The journal backend's folder, imported if that backend was used
+        self.conn = self.connect()
+        self.thread_id = threading.get_ident()  # sqlite3 connections only work on their own thread
+        self.summaries = {}  # biz_id -> loaded invoice summaries
+        self.create_tables()
+        # Other instances sharing the database are followed through the changes table
+        self.seen_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        self.own_seqs = set()
+        self.data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def create_tables(self):
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS invoices (
+                row_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                biz_id TEXT NOT NULL,
+                invoice_id TEXT NOT NULL,
+                client TEXT,
+                client_email TEXT,
+                client_phone TEXT,
+                client_address TEXT,
+                total REAL,
+                business TEXT,
+                subtotal REAL,
+                discount_rate REAL,
+                discount_amt REAL,
+                tax_rate REAL,
+                tax_amt REAL,
+                date TEXT,
+                due_date TEXT,
+                date_ord INTEGER,
+                due_date_ord INTEGER,
+                is_pending INTEGER,
+                extra TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_invoices_biz ON invoices (biz_id, invoice_id);
+            CREATE INDEX IF NOT EXISTS idx_invoices_client ON invoices (biz_id, client);
+            CREATE TABLE IF NOT EXISTS invoice_items (
+                invoice_row INTEGER NOT NULL REFERENCES invoices (row_id) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                description TEXT,
+                price REAL,
+                price_per_unit REAL,
+                quantity REAL,
+                quantity_display TEXT,
+                unit TEXT,
+                extra TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_items_invoice ON invoice_items (invoice_row, position);
+            CREATE TABLE IF NOT EXISTS business_stats (
+                biz_id TEXT PRIMARY KEY,
+                stats TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                biz_id TEXT NOT NULL,
+                invoice_id TEXT NOT NULL
+            );
+        """)
+        self.migrate_schema()
+        # Date filters run on the in-memory summaries (InvoiceIndex.between), so no SQL index is kept
+        self.conn.execute("DROP INDEX IF EXISTS idx_invoices_date")
+
+    def migrate_schema(self):
+        """Upgrade the stored invoices to HISTORY_SCHEMA_VERSION (tracked in PRAGMA user_version)
+
+        Rows are streamed in row_id order, one batch at a time, through the registered migration
+        steps and written back, so memory use doesn't grow with the history. The whole upgrade is
+        one transaction: it either completes or leaves the database as it was.
+        """
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(invoices)")}
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if not version:
+            # Databases from before versioning; date ordinals were the only change until then
+            version = 2 if "date_ord" in columns else 1
+        if version >= HISTORY_SCHEMA_VERSION:
+            return
+        with self.conn:
+            if "date_ord" not in columns:
+                self.conn.execute("ALTER TABLE invoices ADD COLUMN date_ord INTEGER")
+                self.conn.execute("ALTER TABLE invoices ADD COLUMN due_date_ord INTEGER")
+            if "is_pending" not in columns:
+                self.conn.execute("ALTER TABLE invoices ADD COLUMN is_pending INTEGER")
+            last_row_id = 0
+            migrated = 0
+            while True:
+                rows = self.conn.execute("SELECT * FROM invoices WHERE row_id > ? ORDER BY row_id LIMIT 500",
+                                         (last_row_id,)).fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    item_rows = self.conn.execute(
+                        "SELECT * FROM invoice_items WHERE invoice_row = ? ORDER BY position", (row["row_id"],))
+                    record = self._record_from_row(row, [self._item_from_row(item) for item in item_rows])
+                    self._rewrite_rows(row["row_id"], migrate_record(record, version))
+                last_row_id = rows[-1]["row_id"]
+                migrated += len(rows)
+            self.conn.execute(f"PRAGMA user_version = {HISTORY_SCHEMA_VERSION}")
+        if migrated:
+            print(f"Migrated {migrated} invoices in {self.db_path} from schema {version} to {HISTORY_SCHEMA_VERSION}")
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _split_fields(self, data, fields):
+        """Split a dict into column values and a JSON blob of any other keys"""
+        known = {key for key, _ in fields}
+        values = [data.get(key) for key, _ in fields]
+        extra = {k: v for k, v in data.items() if k not in known}
+        return values, (json.dumps(extra) if extra else None)
+
+    def _insert_rows(self, biz_id, record):
+        """Insert one invoice and its items (caller owns the transaction)"""
+        record = with_date_ordinals(dict(record))
+        values, extra = self._split_fields(
+            {k: v for k, v in record.items() if k not in ("items", "biz_id")}, self.INVOICE_FIELDS)
+        columns = ", ".join(col for _, col in self.INVOICE_FIELDS)
+        placeholders = ", ".join("?" for _ in self.INVOICE_FIELDS)
+        cur = self.conn.execute(
+            f"INSERT INTO invoices (biz_id, {columns}, extra) VALUES (?, {placeholders}, ?)",
+            [biz_id] + values + [extra])
+        row_id = cur.lastrowid
+        self._insert_items(row_id, record.get("items", []))
+        return row_id
+
+    def _rewrite_rows(self, row_id, record):
+        """Overwrite a stored invoice and its items in place (caller owns the transaction)"""
+        values, extra = self._split_fields(
+            {k: v for k, v in record.items() if k not in ("items", "biz_id")}, self.INVOICE_FIELDS)
+        assignments = ", ".join(f"{col} = ?" for _, col in self.INVOICE_FIELDS)
+        self.conn.execute(f"UPDATE invoices SET {assignments}, extra = ? WHERE row_id = ?",
+                          values + [extra, row_id])
+        self.conn.execute("DELETE FROM invoice_items WHERE invoice_row = ?", (row_id,))
+        self._insert_items(row_id, record.get("items", []))
+
+    def _insert_items(self, row_id, items):
+        item_columns = ", ".join(col for _, col in self.ITEM_FIELDS)
+        item_placeholders = ", ".join("?" for _ in self.ITEM_FIELDS)
+        item_rows = []
+        for position, item in enumerate(items):
+            item_values, item_extra = self._split_fields(item, self.ITEM_FIELDS)
+            item_rows.append([row_id, position] + item_values + [item_extra])
+        self.conn.executemany(
+            f"INSERT INTO invoice_items (invoice_row, position, {item_columns}, extra) "
+            f"VALUES (?, ?, {item_placeholders}, ?)",
+            item_rows)
+
+    def _record_from_row(self, row, items):
+        record = {}
+        for key, col in self.INVOICE_FIELDS:
+            record[key] = row[col]
+        if record["is_pending"] is not None:
+            record["is_pending"] = bool(record["is_pending"])
+        else:
+            del record["is_pending"]  # Row from before the flag; invoice_is_pending falls back on due_date
+        record["items"] = items
+        if row["extra"]:
+            record.update(json.loads(row["extra"]))
+        record["biz_id"] = row["biz_id"]
+        return record
+
+    def _item_from_row(self, row):
+        item = {key: row[col] for key, col in self.ITEM_FIELDS}
+        if row["extra"]:
+            item.update(json.loads(row["extra"]))
+        return item
+
+    SUMMARY_COLUMNS = ("row_id, invoice_id, client, total, tax_amt, discount_amt, date, due_date, "
+                       "date_ord, due_date_ord, is_pending")
+
+    def _summary_from_row(self, row):
+        return {
+            "id": row["invoice_id"],
+            "client": row["client"] or "",
+            "total": row["total"] or 0,
+            "tax_amt": row["tax_amt"] or 0,
+            "discount_amt": row["discount_amt"] or 0,
+            "date": row["date"] or "",
+            "due_date": row["due_date"] or "",
+            "date_ord": row["date_ord"],
+            "due_date_ord": row["due_date_ord"],
+            "is_pending": invoice_is_pending({"is_pending": row["is_pending"], "due_date": row["due_date"]}),
+            "offset": row["row_id"],
+        }
+
+    def load_business(self, biz_id):
+        """InvoiceIndex of one business's summaries in save order (kept up to date by insert/update/delete)"""
+        if biz_id not in self.summaries:
+            rows = self.conn.execute(
+                f"SELECT {self.SUMMARY_COLUMNS} FROM invoices WHERE biz_id = ? ORDER BY row_id", (biz_id,))
+            self.summaries[biz_id] = InvoiceIndex(self._summary_from_row(row) for row in rows)
+            if self.read_stats(biz_id) != self.summaries[biz_id].stats:
+                with self.conn:
+                    self._save_stats(biz_id)
+        return self.summaries[biz_id]
+
+    def read_stats(self, biz_id):
+        """Saved totals of a business without loading its history (None if never saved)"""
+        row = self.conn.execute("SELECT stats FROM business_stats WHERE biz_id = ?", (biz_id,)).fetchone()
+        return InvoiceStats.from_dict(json.loads(row["stats"])) if row else None
+
+    def _save_stats(self, biz_id):
+        """Store the loaded totals of a business (caller owns the transaction)"""
+        if biz_id in self.summaries:
+            self.conn.execute("INSERT OR REPLACE INTO business_stats (biz_id, stats) VALUES (?, ?)",
+                              (biz_id, json.dumps(self.summaries[biz_id].stats.to_dict())))
+
+    def get_invoice(self, biz_id, summary):
+        """Load the full invoice record (with items) a summary points at"""
+        row = self.conn.execute("SELECT * FROM invoices WHERE row_id = ?", (summary["offset"],)).fetchone()
+        if row is None:
+            return None
+        item_rows = self.conn.execute(
+            "SELECT * FROM invoice_items WHERE invoice_row = ? ORDER BY position", (row["row_id"],))
+        return self._record_from_row(row, [self._item_from_row(item) for item in item_rows])
+
+    def iter_invoices(self, biz_id):
+        """Yield one business's full invoice records in save order, READ_BATCH rows in memory at a time
+
+        Called from another thread (e.g. an export), it reads through a connection of its own.
+        """
+        conn = self.conn if threading.get_ident() == self.thread_id else self.connect()
+        try:
+            last_row_id = 0
+            while True:
+                rows = conn.execute("SELECT * FROM invoices WHERE biz_id = ? AND row_id > ? ORDER BY row_id LIMIT ?",
+                                    (biz_id, last_row_id, self.READ_BATCH)).fetchall()
+                if not rows:
+                    return
+                for row in rows:
+                    item_rows = conn.execute(
+                        "SELECT * FROM invoice_items WHERE invoice_row = ? ORDER BY position", (row["row_id"],))
+                    yield self._record_from_row(row, [self._item_from_row(item) for item in item_rows])
+                last_row_id = rows[-1]["row_id"]
+        finally:
+            if conn is not self.conn:
+                conn.close()
+
+    def iter_records(self, biz_id, summaries):
+        """Yield the full records of some of a business's summaries in their order, READ_BATCH at a time
+
+        Like iter_invoices, it reads through a connection of its own when called from another thread.
+        Invoices deleted since the summaries were taken are skipped.
+        """
+        summaries = list(summaries)
+        conn = self.conn if threading.get_ident() == self.thread_id else self.connect()
+        try:
+            for start in range(0, len(summaries), self.READ_BATCH):
+                row_ids = [summary["offset"] for summary in summaries[start:start + self.READ_BATCH]]
+                rows = {row["row_id"]: row for row in conn.execute(
+                    f"SELECT * FROM invoices WHERE row_id IN ({', '.join('?' * len(row_ids))})", row_ids)}
+                for row_id in row_ids:
+                    if row_id not in rows:
+                        continue
+                    item_rows = conn.execute(
+                        "SELECT * FROM invoice_items WHERE invoice_row = ? ORDER BY position", (row_id,))
+                    yield self._record_from_row(rows[row_id], [self._item_from_row(item) for item in item_rows])
+        finally:
+            if conn is not self.conn:
+                conn.close()
+
+    def insert(self, biz_id, record):
+        """Save one invoice (and the updated totals) in a single transaction"""
+        with self.conn:
+            row_id = self._insert_rows(biz_id, record)
+            summary = self._index_summary(biz_id, record, row_id)
+            self._save_stats(biz_id)
+            self._log_changes(biz_id, [record["id"]])
+        return summary
+
+    def update(self, biz_id, record):
+        """Replace a saved invoice in place (keeping its position), or insert it if it is new"""
+        record = with_date_ordinals(dict(record))
+        with self.conn:
+            row_ids = [row["row_id"] for row in self.conn.execute(
+                "SELECT row_id FROM invoices WHERE biz_id = ? AND invoice_id = ? ORDER BY row_id",
+                (biz_id, str(record["id"])))]
+            if not row_ids:
+                row_id = self._insert_rows(biz_id, record)
+            else:
+                row_id = row_ids[0]
+                # Older duplicate copies from before re-saves replaced invoices
+                self.conn.executemany("DELETE FROM invoices WHERE row_id = ?", [(r,) for r in row_ids[1:]])
+                self._rewrite_rows(row_id, record)
+            summary = self._index_summary(biz_id, record, row_id)
+            self._save_stats(biz_id)
+            self._log_changes(biz_id, [record["id"]])
+        return summary
+
+    def _index_summary(self, biz_id, record, row_id):
+        summary = invoice_summary(record)
+        summary["offset"] = row_id
+        if biz_id in self.summaries:
+            self.summaries[biz_id].upsert(summary)
+        return summary
+
+    def import_invoices(self, invoices, on_record=None):
+        """Save a stream of new (biz_id, record) pairs in a single transaction; returns how many were saved
+
+        on_record(biz_id, record) is called for each invoice so indexes can be updated in the same pass.
+        """
+        saved = {}  # biz_id -> ids of the invoices saved
+        with self.conn:
+            for biz_id, record in invoices:
+                self._index_summary(biz_id, record, self._insert_rows(biz_id, record))
+                saved.setdefault(biz_id, []).append(record["id"])
+                if on_record:
+                    on_record(biz_id, record)
+            for biz_id, invoice_ids in saved.items():
+                self._save_stats(biz_id)
+                self._log_changes(biz_id, invoice_ids)
+        return sum(len(invoice_ids) for invoice_ids in saved.values())
+
+    def delete(self, biz_id, invoice_id):
+        """Delete every stored copy of an invoice (its items go with it)"""
+        with self.conn:
+            self.conn.execute("DELETE FROM invoices WHERE biz_id = ? AND invoice_id = ?",
+                              (biz_id, str(invoice_id)))
+            if biz_id in self.summaries:
+                self.summaries[biz_id].remove(invoice_id)
+                self._save_stats(biz_id)
+            self._log_changes(biz_id, [invoice_id])
+
+    def delete_many(self, biz_id, invoice_ids):
+        """Delete several invoices of one business in a single transaction"""
+        with self.conn:
+            self.conn.executemany("DELETE FROM invoices WHERE biz_id = ? AND invoice_id = ?",
+                                  [(biz_id, str(invoice_id)) for invoice_id in invoice_ids])
+            if biz_id in self.summaries:
+                for invoice_id in invoice_ids:
+                    self.summaries[biz_id].remove(invoice_id)
+                self._save_stats(biz_id)
+            self._log_changes(biz_id, invoice_ids)
+
+    def _log_changes(self, biz_id, invoice_ids):
+        """Note changed invoices for other instances to pick up (caller owns the transaction)"""
+        cur = None
+        for invoice_id in invoice_ids:
+            cur = self.conn.execute("INSERT INTO changes (biz_id, invoice_id) VALUES (?, ?)",
+                                    (biz_id, str(invoice_id)))
+            self.own_seqs.add(cur.lastrowid)
+        if cur is not None:
+            self.conn.execute("DELETE FROM changes WHERE seq <= ?", (cur.lastrowid - CHANGE_LOG_KEEP,))
+
+    def poll_changes(self):
+        """{biz_id: ids other instances changed} for loaded businesses; None instead of ids = reloaded
+
+        PRAGMA data_version only moves when another connection commits, so an idle poll is one
+        cheap query. A business whose changes were already pruned from the log is reloaded.
+        """
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.data_version:
+            return {}
+        self.data_version = version
+        rows = self.conn.execute("SELECT seq, biz_id, invoice_id FROM changes WHERE seq > ? ORDER BY seq",
+                                 (self.seen_seq,)).fetchall()
+        if not rows:
+            return {}
+        changes = {}
+        if rows[0]["seq"] > self.seen_seq + 1:
+            for biz_id in list(self.summaries):
+                del self.summaries[biz_id]
+                self.load_business(biz_id)
+                changes[biz_id] = None
+        else:
+            for row in rows:
+                if row["seq"] in self.own_seqs or row["biz_id"] not in self.summaries:
+                    continue
+                changes.setdefault(row["biz_id"], set()).add(row["invoice_id"])
+            for biz_id, invoice_ids in changes.items():
+                for invoice_id in invoice_ids:
+                    self._refresh_summary(biz_id, invoice_id)
+        self.seen_seq = rows[-1]["seq"]
+        self.own_seqs = {seq for seq in self.own_seqs if seq > self.seen_seq}
+        return changes
+
+    def _refresh_summary(self, biz_id, invoice_id):
+        """Re-read one invoice's summary after another instance saved or deleted it"""
+        row = self.conn.execute(
+            f"SELECT {self.SUMMARY_COLUMNS} FROM invoices WHERE biz_id = ? AND invoice_id = ? "
+            "ORDER BY row_id LIMIT 1", (biz_id, str(invoice_id))).fetchone()
+        if row is None:
+            self.summaries[biz_id].remove(invoice_id)
+        else:
+            self.summaries[biz_id].upsert(self._summary_from_row(row))
+
+    def shard_ids(self):
+        """Businesses with journal backend shards waiting to be imported"""
+        if not self.shard_folder or not os.path.isdir(self.shard_folder) or self.get_meta("shards_migrated"):
+            return []
+        return sorted({name.rsplit('.', 1)[0] for name in os.listdir(self.shard_folder)
+                       if name.endswith((".json", ".journal"))})
+
+    def needs_migration(self, json_path, journal_path=None):
+        """True while an existing history.json, or the journal backend's shards, wait to be imported"""
+        return bool(self.shard_ids()) or (not self.get_meta("json_migrated") and os.path.exists(json_path))
+
+    def migrate_from_json(self, json_path, journal_path=None, on_record=None):
+        """Import the history of an earlier backend once, then keep its files aside as a backup
+
+        That is the journal backend's shards if there are any (they were split from history.json
+        and are newer than it), else history.json (and journal). The history is streamed into one
+        transaction, one invoice at a time; on_record(biz_id, record) is called for each so
+        indexes can be built in the same pass. Invoices the database already has are skipped.
+        Raises (and rolls back) if the history can't be read.
+        """
+        if not self.needs_migration(json_path, journal_path):
+            return
+        shard_ids = self.shard_ids()
+        shards = JournalHistoryStore(self.shard_folder) if shard_ids else None
+        if shards:
+            history = ((biz_id, record) for biz_id in shard_ids for record in shards.iter_invoices(biz_id))
+            source = self.shard_folder
+        elif journal_path:
+            history = iter_journaled_history(json_path, journal_path)
+            source = json_path
+        else:
+            history = iter_history_json(json_path)
+            source = json_path
+
+        try:
+            with self.conn:
+                for biz_id, record in history:
+                    record = migrate_record(record, 1)
+                    if self.conn.execute("SELECT 1 FROM invoices WHERE biz_id = ? AND invoice_id = ?",
+                                         (biz_id, str(record['id']))).fetchone():
+                        continue
+                    self._insert_rows(biz_id, record)
+                    if on_record:
+                        on_record(biz_id, record)
+                self.set_meta("json_migrated", datetime.now().isoformat())
+                if shards:
+                    self.set_meta("shards_migrated", datetime.now().isoformat())
+        finally:
+            if shards:
+                shards.close()
+
+        for path in (json_path, journal_path, journal_path and journal_path + ".compacting",
+                     shards and self.shard_folder):
+            if path and os.path.exists(path):
+                try:
+                    os.replace(path, path + ".migrated")
+                except OSError as e:
+                    print(f"Could not rename migrated history file: {e}")
+        print(f"History migrated from {source} to {self.db_path}")
+
+    def close(self):
+        self.conn.close()
+
+
+class InvoiceArchive:
+    """Read-only, zlib-compressed archives of old invoices, one file per business and financial year
+
+    File layout: MAGIC, then blocks of ARCHIVE_BLOCK_SIZE JSON lines each compressed on its own,
+    then the compressed index (block offsets and invoice summaries, oldest first) and the
+    index's offset as 8 bytes. Listing an archive only reads its index; loading one invoice
+    only decompresses its block.
+    """
+
+    MAGIC = b"TCGARC1\n"
+
+    def __init__(self, folder, block_size=ARCHIVE_BLOCK_SIZE):
+        self.folder = folder
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.cache = {}  # biz_id -> list of archived summaries, oldest first
+        self.indexes = {}  # path -> parsed index
+        self.last_block = (None, None, None)  # (path, block number, records) of the last block read
+
+    def path(self, biz_id, fy):
+        return os.path.join(self.folder, biz_id, f"{fy}.tcga")
+
+    def years(self, biz_id):
+        """Financial years archived for a business, oldest first"""
+        folder = os.path.join(self.folder, biz_id)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(name[:-len(".tcga")] for name in os.listdir(folder) if name.endswith(".tcga"))
+
+    def read_index(self, path):
+        if path not in self.indexes:
+            self.indexes[path] = self.load_index(path)
+        return self.indexes[path]
+
+    def load_index(self, path):
+        """Parse an archive's index; date_ords lists its summaries' dates (sorted, as they are) for bisecting"""
+        with open(path, 'rb') as f:
+            if f.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError(f"{path} is not an invoice archive")
+            f.seek(-8, os.SEEK_END)
+            end = f.tell()
+            (index_offset,) = struct.unpack("<Q", f.read(8))
+            f.seek(index_offset)
+            index = json.loads(zlib.decompress(f.read(end - index_offset)))
+        index["date_ords"] = [summary.get("date_ord") or 0 for summary in index["summaries"]]
+        return index
+
+    def summaries(self, biz_id):
+        """Summaries of every archived invoice of a business, oldest first"""
+        with self.lock:
+            if biz_id not in self.cache:
+                summaries = []
+                for fy in self.years(biz_id):
+                    try:
+                        summaries.extend(self.read_index(self.path(biz_id, fy))["summaries"])
+                    except (OSError, ValueError) as e:
+                        print(f"Could not read archive {fy} of {biz_id}: {e}")
+                self.cache[biz_id] = summaries
+            return self.cache[biz_id]
+
+    def between(self, biz_id, start, end):
+        """Archived summaries dated from start to end (ordinals, inclusive), oldest first
+
+        Bisects each year's cached date_ords, so a query costs O(years * log n) once the indexes are read.
+        """
+        found = []
+        with self.lock:
+            for fy in self.years(biz_id):
+                try:
+                    index = self.read_index(self.path(biz_id, fy))
+                except (OSError, ValueError) as e:
+                    print(f"Could not read archive {fy} of {biz_id}: {e}")
+                    continue
+                keys = index["date_ords"]
+                found.extend(index["summaries"][bisect.bisect_left(keys, start):bisect.bisect_right(keys, end)])
+        return found
+
+    def read_block(self, path, block):
+        with self.lock:
+            if self.last_block[:2] == (path, block):
+                return self.last_block[2]
+            offset, length = self.read_index(path)["blocks"][block]
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data = zlib.decompress(f.read(length))
+            version = self.read_index(path).get("schema", 2)
+            records = [migrate_record(json.loads(line), version) for line in data.splitlines() if line.strip()]
+            self.last_block = (path, block, records)
+            return records
+
+    def get_invoice(self, biz_id, summary):
+        """Load the full record of an archived invoice"""
+        path = self.path(biz_id, summary["archive"])
+        return self.read_block(path, summary["block"])[summary["line"]]
+
+    def iter_year(self, biz_id, fy):
+        path = self.path(biz_id, fy)
+        if not os.path.exists(path):
+            return
+        for block in range(len(self.read_index(path)["blocks"])):
+            yield from self.read_block(path, block)
+
+    def iter_invoices(self, biz_id):
+        """Yield every archived invoice of a business, one block in memory at a time"""
+        for fy in self.years(biz_id):
+            yield from self.iter_year(biz_id, fy)
+
+    def iter_records(self, biz_id, summaries):
+        """Yield the full records of some archived summaries, in their order
+
+        Consecutive invoices of one block (as in date order) decompress it only once.
+        """
+        for summary in summaries:
+            yield self.get_invoice(biz_id, summary)
+
+    def add(self, biz_id, fy, records):
+        """Write invoices into a year's archive (merged with what is already there, newest copy wins)"""
+        by_id = {str(record["id"]): record for record in self.iter_year(biz_id, fy)}
+        by_id.update((str(record["id"]), record) for record in records)
+        ordered = sorted(by_id.values(), key=lambda record: record.get("date_ord") or 0)
+
+        path = self.path(biz_id, fy)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        blocks = []
+        summaries = []
+        with atomic_file(path) as f:
+            f.write(self.MAGIC)
+            for start in range(0, len(ordered), self.block_size):
+                chunk = ordered[start:start + self.block_size]
+                data = zlib.compress("".join(json.dumps(record) + "\n" for record in chunk).encode('utf-8'), 9)
+                blocks.append([f.tell(), len(data)])
+                f.write(data)
+                for line, record in enumerate(chunk):
+                    summary = invoice_summary(record)
+                    summary.update(archive=fy, block=len(blocks) - 1, line=line)
+                    summaries.append(summary)
+            index_offset = f.tell()
+            f.write(zlib.compress(json.dumps({"fy": fy, "schema": HISTORY_SCHEMA_VERSION, "blocks": blocks,
+                                           "summaries": summaries}).encode('utf-8')))
+            f.write(struct.pack("<Q", index_offset))
+        self.forget(biz_id)
+
+    def forget(self, biz_id):
+        """Drop everything cached about a business's archives (after it or another instance wrote one)"""
+        folder = os.path.join(self.folder, biz_id) + os.sep
+        with self.lock:
+            self.cache.pop(biz_id, None)
+            for path in [path for path in self.indexes if path.startswith(folder)]:
+                del self.indexes[path]
+            self.last_block = (None, None, None)
+
+
+class HistorySearchIndex:
+    """Persistent trigram index over the searchable fields of every saved invoice
+
+    Each field is split into overlapping 3-character grams (plus the 2- and 1-character tail),
+    so any substring of up to 3 characters is a prefix of some gram and longer substrings are
+    found by intersecting their grams. Kept up to date one invoice at a time on save/delete.
+    """
+
+    SEARCH_FIELDS = ["id", "client", "client_email", "client_phone", "client_address", "client_notes"]
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # Searches run on a background thread, saves on the UI thread; the lock serialises them
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                biz_id TEXT NOT NULL,
+                invoice_id TEXT NOT NULL,
+                text TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_docs_invoice ON docs (biz_id, invoice_id);
+            CREATE TABLE IF NOT EXISTS postings (
+                biz_id TEXT NOT NULL,
+                gram TEXT NOT NULL,
+                doc_id INTEGER NOT NULL,
+                PRIMARY KEY (biz_id, gram, doc_id)
+            ) WITHOUT ROWID;
+        """)
+
+    def searchable_text(self, record):
+        """Lower-cased searchable fields and item descriptions, one per line"""
+        parts = [str(record.get(field) or "") for field in self.SEARCH_FIELDS]
+        parts.extend(str(item.get("desc") or "") for item in record.get("items", []))
+        return "\n".join(part.lower() for part in parts if part)
+
+    def grams(self, text):
+        grams = set()
+        for part in text.split("\n"):
+            for i in range(len(part)):
+                grams.add(part[i:i + 3])
+        return grams
+
+    def _add(self, biz_id, record):
+        self._remove(biz_id, record.get("id"))  # A re-saved invoice replaces its old entry
+        text = self.searchable_text(record)
+        cur = self.conn.execute("INSERT INTO docs (biz_id, invoice_id, text) VALUES (?, ?, ?)",
+                                (biz_id, str(record.get("id")), text))
+        doc_id = cur.lastrowid
+        self.conn.executemany("INSERT OR IGNORE INTO postings (biz_id, gram, doc_id) VALUES (?, ?, ?)",
+                              [(biz_id, gram, doc_id) for gram in self.grams(text)])
+
+    def add(self, biz_id, record):
+        """Index one saved invoice"""
+        with self.lock, self.conn:
+            self._add(biz_id, record)
+
+    def remove(self, biz_id, invoice_id):
+        """Drop every indexed copy of an invoice"""
+        with self.lock, self.conn:
+            self._remove(biz_id, invoice_id)
+
+    def _remove(self, biz_id, invoice_id):
+        rows = self.conn.execute(
+            "SELECT doc_id, text FROM docs WHERE biz_id = ? AND invoice_id = ?", (biz_id, str(invoice_id))).fetchall()
+        for doc_id, text in rows:
+            self.conn.executemany("DELETE FROM postings WHERE biz_id = ? AND gram = ? AND doc_id = ?",
+                                  [(biz_id, gram, doc_id) for gram in self.grams(text)])
+            self.conn.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+
+    def is_synced(self, biz_id, invoice_count):
+        """False if a business's index doesn't match its history (first run or lost index)"""
+        with self.lock:
+            indexed = self.conn.execute(
+                "SELECT COUNT(DISTINCT invoice_id) FROM docs WHERE biz_id = ?", (biz_id,)).fetchone()[0]
+        return indexed == invoice_count
+
+    @contextmanager
+    def rebuilding(self, biz_ids):
+        """Clear the index of some businesses and yield add(biz_id, record) to refill it
+
+        Everything happens in one transaction, committed when the block ends. With no biz_ids
+        nothing is cleared, which bulk-adds invoices (e.g. an import) in one transaction.
+        """
+        with self.lock, self.conn:
+            for biz_id in biz_ids:
+                self.conn.execute("DELETE FROM postings WHERE biz_id = ?", (biz_id,))
+                self.conn.execute("DELETE FROM docs WHERE biz_id = ?", (biz_id,))
+            yield self._add
+        if biz_ids:
+            print(f"Search index rebuilt for {', '.join(biz_ids)}")
+
+    def search(self, biz_id, term):
+        """Return the set of invoice ids of a business whose searchable text contains term"""
+        with self.lock:
+            return self._search(biz_id, term.lower().strip())
+
+    def _search(self, biz_id, term):
+        if len(term) <= 3:
+            # Every substring this short is the start of an indexed gram, no need to re-check text
+            rows = self.conn.execute(
+                "SELECT DISTINCT d.invoice_id FROM postings p JOIN docs d ON d.doc_id = p.doc_id "
+                "WHERE p.biz_id = ? AND p.gram >= ? AND p.gram < ?",
+                (biz_id, term, term + "\uffff"))
+            return {row[0] for row in rows}
+
+        grams = sorted({term[i:i + 3] for i in range(len(term) - 2)})
+        intersect = " INTERSECT ".join(
+            "SELECT doc_id FROM postings WHERE biz_id = ? AND gram = ?" for _ in grams)
+        params = []
+        for gram in grams:
+            params.extend([biz_id, gram])
+        rows = self.conn.execute(
+            f"SELECT invoice_id, text FROM docs WHERE doc_id IN ({intersect})", params)
+        # Grams can all appear without the whole term being there, so confirm each candidate
+        return {invoice_id for invoice_id, text in rows if term in text}
+
+    def close(self):
+        self.conn.close()
+
+
+class PrefixTrie:
+    """Character trie for autocomplete, ranked by score (e.g. how often a key was used)
+
+    Every node caches the TOP_K best-scoring keys below it, so a lookup only walks the prefix
+    and reads that list. Scores only ever grow, which keeps the cached lists exact.
+    """
+
+    TOP_K = 8
+
+    def __init__(self):
+        self.root = self.new_node()
+        self.values = {}  # key -> value
+
+    @staticmethod
+    def new_node():
+        return {"children": {}, "top": []}  # top: sorted (-score, key)
+
+    def rank(self, node, key, entry):
+        top = [e for e in node["top"] if e[1] != key]
+        bisect.insort(top, entry)
+        node["top"] = top[:self.TOP_K]
+
+    def insert(self, key, value, score=0):
+        """Add a key or update its value and score"""
+        self.values[key] = value
+        entry = (-score, key)
+        node = self.root
+        self.rank(node, key, entry)
+        for char in key:
+            node = node["children"].setdefault(char, self.new_node())
+            self.rank(node, key, entry)
+
+    def complete(self, prefix, limit=TOP_K):
+        """Values of the best-scoring keys starting with prefix"""
+        node = self.root
+        for char in prefix:
+            node = node["children"].get(char)
+            if node is None:
+                return []
+        return [self.values[key] for _, key in node["top"][:limit]]
+
+
+class ClientDirectory:
+    """Deduplicated clients of each business (one entry per name) with prefix autocomplete
+
+    Suggestions are ranked by how many invoices each client has.
+
+    Kept in SQLite and updated from every saved invoice; the latest details of a client win.
+    A business's trie is built from the table the first time it is needed.
+    """
+
+    CLIENT_FIELDS = ["client", "client_email", "client_phone", "client_address"]
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS clients (
+                biz_id TEXT NOT NULL,
+                name_key TEXT NOT NULL,
+                client TEXT,
+                client_email TEXT,
+                client_phone TEXT,
+                client_address TEXT,
+                uses INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (biz_id, name_key)
+            );
+            CREATE TABLE IF NOT EXISTS built (
+                biz_id TEXT PRIMARY KEY
+            );
+        """)
+        self.tries = {}  # biz_id -> PrefixTrie of client dicts
+
+    @staticmethod
+    def name_key(name):
+        return " ".join(str(name or "").lower().split())
+
+    def trie(self, biz_id):
+        if biz_id not in self.tries:
+            trie = PrefixTrie()
+            for row in self.conn.execute("SELECT * FROM clients WHERE biz_id = ?", (biz_id,)):
+                trie.insert(row["name_key"], dict(row), row["uses"])
+            self.tries[biz_id] = trie
+        return self.tries[biz_id]
+
+    def is_built(self, biz_id):
+        return self.conn.execute("SELECT 1 FROM built WHERE biz_id = ?", (biz_id,)).fetchone() is not None
+
+    def _record(self, biz_id, record):
+        key = self.name_key(record.get("client"))
+        if not key:
+            return None
+        values = [record.get(field) or "" for field in self.CLIENT_FIELDS]
+        self.conn.execute(
+            "INSERT INTO clients (biz_id, name_key, client, client_email, client_phone, client_address, uses) "
+            "VALUES (?, ?, ?, ?, ?, ?, 1) "
+            "ON CONFLICT (biz_id, name_key) DO UPDATE SET client = excluded.client, "
+            "client_email = excluded.client_email, client_phone = excluded.client_phone, "
+            "client_address = excluded.client_address, uses = uses + 1",
+            [biz_id, key] + values)
+        return key
+
+    def record(self, biz_id, record):
+        """Add or refresh the client of a saved invoice"""
+        with self.conn:
+            key = self._record(biz_id, record)
+        if key and biz_id in self.tries:
+            row = self.conn.execute("SELECT * FROM clients WHERE biz_id = ? AND name_key = ?",
+                                    (biz_id, key)).fetchone()
+            self.tries[biz_id].insert(key, dict(row), row["uses"])
+
+    @contextmanager
+    def building(self, biz_ids):
+        """Fill some businesses' directories from their existing history, once
+
+        Yields add(biz_id, record), to be called for every invoice; commits when the block ends.
+        """
+        with self.conn:
+            for biz_id in biz_ids:
+                self.conn.execute("DELETE FROM clients WHERE biz_id = ?", (biz_id,))
+            yield self._record
+            self.conn.executemany("INSERT OR IGNORE INTO built (biz_id) VALUES (?)",
+                                  [(biz_id,) for biz_id in biz_ids])
+        for biz_id in biz_ids:
+            self.tries.pop(biz_id, None)
+
+    def forget(self, biz_id):
+        """Drop the in-memory trie so it is rebuilt with what other instances recorded"""
+        self.tries.pop(biz_id, None)
+
+    def suggest(self, biz_id, prefix, limit=8):
+        """Clients whose name starts with prefix"""
+        key = self.name_key(prefix)
+        if not key:
+            return []
+        return self.trie(biz_id).complete(key, limit)
+
+    def close(self):
+        self.conn.close()
+
+
+class ItemCatalog:
+    """Items each business has sold (one entry per description) with ranked prefix autocomplete
+
+    Mined from the history once and updated on every save; keeps the last price per unit and
+    unit of each item and how often it was sold, which ranks the suggestions.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS items (
+                biz_id TEXT NOT NULL,
+                desc_key TEXT NOT NULL,
+                description TEXT,
+                price_per_unit REAL,
+                unit TEXT,
+                uses INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (biz_id, desc_key)
+            );
+            CREATE TABLE IF NOT EXISTS built (
+                biz_id TEXT PRIMARY KEY
+            );
+        """)
+        self.tries = {}  # biz_id -> PrefixTrie of item dicts
+
+    @staticmethod
+    def desc_key(desc):
+        return " ".join(str(desc or "").lower().split())
+
+    def trie(self, biz_id):
+        if biz_id not in self.tries:
+            trie = PrefixTrie()
+            for row in self.conn.execute("SELECT * FROM items WHERE biz_id = ?", (biz_id,)):
+                trie.insert(row["desc_key"], dict(row), row["uses"])
+            self.tries[biz_id] = trie
+        return self.tries[biz_id]
+
+    def is_built(self, biz_id):
+        return self.conn.execute("SELECT 1 FROM built WHERE biz_id = ?", (biz_id,)).fetchone() is not None
+
+    def _record(self, biz_id, item):
+        key = self.desc_key(item.get("desc"))
+        if not key:
+            return None
+        price_per_unit = item.get("price_per_unit")
+        if price_per_unit is None:
+            price_per_unit = item.get("price")
+        self.conn.execute(
+            "INSERT INTO items (biz_id, desc_key, description, price_per_unit, unit, uses) "
+            "VALUES (?, ?, ?, ?, ?, 1) "
+            "ON CONFLICT (biz_id, desc_key) DO UPDATE SET description = excluded.description, "
+            "price_per_unit = excluded.price_per_unit, unit = excluded.unit, uses = uses + 1",
+            (biz_id, key, item.get("desc"), price_per_unit, item.get("unit")))
+        return key
+
+    def record(self, biz_id, items):
+        """Add or refresh the items of a saved invoice"""
+        with self.conn:
+            keys = [self._record(biz_id, item) for item in items]
+        if biz_id in self.tries:
+            for key in filter(None, keys):
+                row = self.conn.execute("SELECT * FROM items WHERE biz_id = ? AND desc_key = ?",
+                                        (biz_id, key)).fetchone()
+                self.tries[biz_id].insert(key, dict(row), row["uses"])
+
+    @contextmanager
+    def building(self, biz_ids):
+        """Fill some businesses' catalogs from their existing history, once
+
+        Yields add(biz_id, record), to be called for every invoice; commits when the block ends.
+        """
+        def add(biz_id, record):
+            for item in record.get("items", []):
+                self._record(biz_id, item)
+
+        with self.conn:
+            for biz_id in biz_ids:
+                self.conn.execute("DELETE FROM items WHERE biz_id = ?", (biz_id,))
+            yield add
+            self.conn.executemany("INSERT OR IGNORE INTO built (biz_id) VALUES (?)",
+                                  [(biz_id,) for biz_id in biz_ids])
+        for biz_id in biz_ids:
+            self.tries.pop(biz_id, None)
+
+    def forget(self, biz_id):
+        """Drop the in-memory trie so it is rebuilt with what other instances recorded"""
+        self.tries.pop(biz_id, None)
+
+    def suggest(self, biz_id, prefix, limit=8):
+        """Most sold items whose description starts with prefix"""
+        key = self.desc_key(prefix)
+        if not key:
+            return []
+        return self.trie(biz_id).complete(key, limit)
+
+    def close(self):
+        self.conn.close()
+
+
+# --- CSV EXPORT ---
+
+# (header, key) of each column; the invoice file has one row per invoice, the item file one per line item
+INVOICE_CSV_COLUMNS = [
+    ("Business ID", "biz_id"),
+    ("Business", "business"),
+    ("Invoice No", "id"),
+    ("Date", "date"),
+    ("Due Date", "due_date"),
+    ("Pending", "is_pending"),
+    ("Client", "client"),
+    ("Client Email", "client_email"),
+    ("Client Phone", "client_phone"),
+    ("Client Address", "client_address"),
+    ("Client Notes", "client_notes"),
+    ("Subtotal", "subtotal"),
+    ("Discount %", "discount_rate"),
+    ("Discount", "discount_amt"),
+    ("Tax %", "tax_rate"),
+    ("Tax", "tax_amt"),
+    ("Total", "total"),
+    ("Line Items", "item_count"),
+]
+ITEM_CSV_COLUMNS = [
+    ("Business ID", "biz_id"),
+    ("Invoice No", "invoice_id"),
+    ("Line", "line"),
+    ("Description", "desc"),
+    ("Quantity", "quantity"),
+    ("Unit", "unit"),
+    ("Price per Unit", "price_per_unit"),
+    ("Amount", "price"),
+]
+
+
+class JobCancelled(Exception):
+    """Raised inside a background job when the user cancels it"""
+
+
+def csv_rows(invoices):
+    """Pipeline stage: (biz_id, record) pairs -> (invoice row, line item rows)"""
+    for biz_id, record in invoices:
+        items = record.get("items", [])
+        invoice = dict(record, biz_id=biz_id, item_count=len(items),
+                       is_pending="Yes" if invoice_is_pending(record) else "")
+        item_rows = []
+        for line, item in enumerate(items, 1):
+            item = dict(item, biz_id=biz_id, invoice_id=record.get("id"), line=line,
+                        quantity=item.get("quantity_display") or item.get("quantity"))
+            item_rows.append([item.get(key, "") for _, key in ITEM_CSV_COLUMNS])
+        yield [invoice.get(key, "") for _, key in INVOICE_CSV_COLUMNS], item_rows
+
+
+def export_history_csv(invoices, invoice_path, item_path, total=None, progress=None, cancelled=None):
+    """Stream (biz_id, record) pairs into an invoice CSV and a line-item CSV; returns the invoice count
+
+    Rows are written as the records arrive, so memory use doesn't grow with the history.
+    progress(done, total) is called every EXPORT_PROGRESS_EVERY invoices. Setting the
+    cancelled event raises JobCancelled and leaves neither file behind.
+    """
+    count = 0
+    # utf-8-sig so Excel opens client names and the rupee sign correctly
+    with atomic_file(invoice_path, 'w', encoding='utf-8-sig', newline='') as invoice_file, \
+            atomic_file(item_path, 'w', encoding='utf-8-sig', newline='') as item_file:
+        invoice_writer = csv.writer(invoice_file)
+        item_writer = csv.writer(item_file)
+        invoice_writer.writerow([header for header, _ in INVOICE_CSV_COLUMNS])
+        item_writer.writerow([header for header, _ in ITEM_CSV_COLUMNS])
+        for invoice_row, item_rows in csv_rows(invoices):
+            if cancelled is not None and cancelled.is_set():
+                raise JobCancelled()
+            invoice_writer.writerow(invoice_row)
+            item_writer.writerows(item_rows)
+            count += 1
+            if progress and count % EXPORT_PROGRESS_EVERY == 0:
+                progress(count, total)
+    if progress:
+        progress(count, total)
+    return count
+
+
+# --- CSV IMPORT ---
+
+def csv_column_keys(header, columns):
+    """{column index: key} for a CSV header row; cells may be the export's titles or raw keys, in any case"""
+    names = {}
+    for title, key in columns:
+        names[title.lower()] = key
+        names[key.lower()] = key
+    return {i: names[cell.strip().lower()] for i, cell in enumerate(header) if cell.strip().lower() in names}
+
+
+def parse_amount(text):
+    """Number from a CSV cell ("Rs 1,180.00" works too), or None if blank; raises ValueError"""
+    text = str(text or "").replace("Rs", "").replace("₹", "").replace(",", "").strip()
+    return float(text) if text else None
+
+
+class InvoiceCsvImport:
+    """Validates an invoice CSV and its line-item CSV (the layout Export CSV writes) in batches
+
+    Line items are first spilled into a temporary SQLite database, so the invoice file can then
+    be read IMPORT_BATCH_ROWS rows at a time with each batch's items fetched in one query. Valid
+    invoices and per-row errors wait in the same database, so memory use doesn't grow with the files.
+    """
+
+    def __init__(self, invoice_path, item_path, businesses, default_biz_id, existing_ids):
+        self.invoice_path = invoice_path
+        self.item_path = item_path
+        self.businesses = businesses  # biz_id -> business name
+        self.default_biz_id = default_biz_id  # For rows without a Business ID
+        self.existing_ids = existing_ids  # {(biz_id, invoice id)} already in the history
+        self.valid_count = 0
+        self.error_count = 0
+        fd, self.db_path = tempfile.mkstemp(prefix="tcg_import_", suffix=".db")
+        os.close(fd)
+        # Filled on the worker thread, read back on the Tk thread once it is done
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE items (
+                biz_id TEXT NOT NULL,
+                invoice_id TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                item TEXT,
+                used INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX idx_items_invoice ON items (invoice_id);
+            CREATE TABLE valid (seq INTEGER PRIMARY KEY, biz_id TEXT NOT NULL, record TEXT NOT NULL);
+            CREATE TABLE errors (seq INTEGER PRIMARY KEY, file TEXT, row INTEGER, invoice_id TEXT, error TEXT);
+        """)
+
+    def run(self, progress=None, cancelled=None):
+        """Validate both files; returns (valid invoices, rows with errors)
+
+        progress(done, total, text) is called after every batch; setting the cancelled event
+        raises JobCancelled.
+        """
+        with self.conn:
+            self.load_items(progress, cancelled)
+            self.check_invoices(progress, cancelled)
+            unused = self.conn.execute("SELECT row, invoice_id FROM items WHERE used = 0 ORDER BY row").fetchall()
+            for row, invoice_id in unused:
+                self.error(self.item_path, row, invoice_id, "No invoice with this Invoice No in the invoice file")
+        return self.valid_count, self.error_count
+
+    def read_batches(self, path, columns, required):
+        """Yield lists of (line number, {key: cell}) from a CSV file, IMPORT_BATCH_ROWS rows at a time"""
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            keys = csv_column_keys(next(reader, []), columns)
+            titles = {key: title for title, key in columns}
+            missing = [titles[key] for key in required if key not in keys.values()]
+            if missing:
+                raise ValueError(f"{os.path.basename(path)} has no {', '.join(missing)} column")
+            batch = []
+            for cells in reader:
+                if any(cell.strip() for cell in cells):
+                    batch.append((reader.line_num,
+                                  {key: cells[i].strip() for i, key in keys.items() if i < len(cells)}))
+                if len(batch) == IMPORT_BATCH_ROWS:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    def error(self, path, row, invoice_id, message):
+        self.conn.execute("INSERT INTO errors (file, row, invoice_id, error) VALUES (?, ?, ?, ?)",
+                          (os.path.basename(path), row, invoice_id, message))
+        self.error_count += 1
+
+    def load_items(self, progress, cancelled):
+        """Validate every line item row and spill it into the temp database, keyed by invoice"""
+        done = 0
+        for batch in self.read_batches(self.item_path, ITEM_CSV_COLUMNS, ["invoice_id", "desc"]):
+            if cancelled is not None and cancelled.is_set():
+                raise JobCancelled()
+            rows = []
+            for row, cells in batch:
+                item, error = self.parse_item(cells)
+                if error:
+                    self.error(self.item_path, row, cells.get("invoice_id", ""), error)
+                if cells.get("invoice_id"):
+                    rows.append((cells.get("biz_id") or self.default_biz_id, cells["invoice_id"], row,
+                                 item and json.dumps(item)))
+            self.conn.executemany("INSERT INTO items (biz_id, invoice_id, row, item) VALUES (?, ?, ?, ?)", rows)
+            done += len(batch)
+            if progress:
+                progress(done, None, "Checking line items...")
+
+    def parse_item(self, cells):
+        """(line item as add_item builds it, None), or (None, error message) for an invalid row"""
+        if not cells.get("invoice_id"):
+            return None, "Missing Invoice No"
+        if not cells.get("desc"):
+            return None, "Missing Description"
+        try:
+            amount = parse_amount(cells.get("price"))
+            price_per_unit = parse_amount(cells.get("price_per_unit"))
+        except ValueError:
+            return None, "Price per Unit and Amount must be numbers"
+
+        quantity_display = quantity = unit = None
+        if cells.get("quantity"):
+            quantity_display, quantity = parse_quantity(cells["quantity"])
+            if quantity is None:
+                return None, f"Invalid Quantity '{cells['quantity']}' (use numbers like 15.5 or fractions like 1/2)"
+            unit = cells.get("unit") or "units"
+            if price_per_unit is None and amount is not None and quantity:
+                price_per_unit = amount / quantity
+            if price_per_unit is None:
+                return None, "Missing Price per Unit"
+            expected = quantity * price_per_unit
+            if amount is None:
+                amount = expected
+            elif abs(amount - expected) > IMPORT_TOTAL_TOLERANCE:
+                return None, f"Amount {amount:.2f} is not Quantity x Price per Unit ({expected:.2f})"
+        else:
+            amount = amount if amount is not None else price_per_unit
+            price_per_unit = price_per_unit if price_per_unit is not None else amount
+            if amount is None:
+                return None, "Missing Amount"
+        return {
+            "desc": cells["desc"],
+            "price": amount,
+            "price_per_unit": price_per_unit,
+            "quantity": quantity,
+            "quantity_display": quantity_display,
+            "unit": unit
+        }, None
+
+    def batch_items(self, batch):
+        """{(biz_id, invoice id): [(row, item JSON or None if invalid)]} for a batch of invoice rows"""
+        keys = {(cells.get("biz_id") or self.default_biz_id, cells.get("id", "")) for _, cells in batch}
+        invoice_ids = sorted({invoice_id for _, invoice_id in keys})
+        placeholders = ", ".join("?" * len(invoice_ids))
+        rows = self.conn.execute(
+            f"SELECT rowid, biz_id, invoice_id, row, item FROM items WHERE invoice_id IN ({placeholders}) "
+            "ORDER BY row", invoice_ids).fetchall()
+        items = {}
+        used = []
+        for rowid, biz_id, invoice_id, row, item in rows:
+            if (biz_id, invoice_id) in keys:
+                items.setdefault((biz_id, invoice_id), []).append((row, item))
+                used.append((rowid,))
+        self.conn.executemany("UPDATE items SET used = 1 WHERE rowid = ?", used)
+        return items
+
+    def check_invoices(self, progress, cancelled):
+        """Validate the invoice rows batch by batch, each joined with its line items"""
+        seen = set()
+        done = 0
+        for batch in self.read_batches(self.invoice_path, INVOICE_CSV_COLUMNS, ["id", "date"]):
+            if cancelled is not None and cancelled.is_set():
+                raise JobCancelled()
+            items = self.batch_items(batch)
+            valid = []
+            for row, cells in batch:
+                key = (cells.get("biz_id") or self.default_biz_id, cells.get("id", ""))
+                record, error = self.parse_invoice(key[0], cells, items.get(key, []))
+                if error is None and key in self.existing_ids:
+                    error = "Invoice No already exists in the history"
+                elif error is None and key in seen:
+                    error = "Invoice No appears more than once in the file"
+                seen.add(key)
+                if error:
+                    self.error(self.invoice_path, row, key[1], error)
+                else:
+                    valid.append((key[0], json.dumps(record)))
+            self.conn.executemany("INSERT INTO valid (biz_id, record) VALUES (?, ?)", valid)
+            self.valid_count += len(valid)
+            done += len(batch)
+            if progress:
+                progress(done, None, "Checking invoices...")
+
+    def parse_invoice(self, biz_id, cells, items):
+        """(history record as save_to_history builds it, None), or (None, error message)"""
+        invoice_id = cells.get("id", "")
+        if not invoice_id:
+            return None, "Missing Invoice No"
+        if biz_id not in self.businesses:
+            return None, f"Unknown Business ID '{biz_id}'"
+        date = cells.get("date", "")
+        if date_ordinal(date) is None:
+            return None, f"Invalid Date '{date}' (use dd-mm-yyyy)"
+        due_date = cells.get("due_date", "")
+        is_pending = cells.get("is_pending", "").strip().lower() in ("yes", "y", "true", "1")
+        if due_date.upper() == "PENDING":
+            # Older exports marked a pending invoice by its due date
+            due_date, is_pending = "", True
+        elif due_date and date_ordinal(due_date) is None:
+            return None, f"Invalid Due Date '{due_date}' (use dd-mm-yyyy or PENDING)"
+        client_email = cells.get("client_email", "")
+        if client_email and not is_valid_email(client_email):
+            return None, f"Invalid client email '{client_email}'"
+        client_phone = cells.get("client_phone", "")
+        if client_phone and not is_valid_phone(client_phone):
+            return None, "Client phone number must be exactly 10 digits"
+        if not items:
+            return None, "No line items for this invoice in the item file"
+        bad_rows = [str(row) for row, item in items if item is None]
+        if bad_rows:
+            return None, f"Invalid line items (item file row {', '.join(bad_rows)})"
+        try:
+            discount_rate = parse_amount(cells.get("discount_rate")) or 0.0
+            tax_rate = parse_amount(cells.get("tax_rate")) or 0.0
+            given = {key: parse_amount(cells.get(key)) for key in ("subtotal", "discount_amt", "tax_amt", "total")}
+        except ValueError:
+            return None, "Amounts and rates must be numbers"
+
+        items = [json.loads(item) for _, item in items]
+        totals = invoice_totals(sum(item["price"] for item in items), discount_rate, tax_rate)
+        for key, title in (("subtotal", "Subtotal"), ("discount_amt", "Discount"), ("tax_amt", "Tax"), ("total", "Total")):
+            if given[key] is not None and abs(given[key] - totals[key]) > IMPORT_TOTAL_TOLERANCE:
+                return None, f"{title} {given[key]:.2f} does not match the line items ({totals[key]:.2f})"
+
+        record = {
+            "id": invoice_id,
+            "client": cells.get("client", ""),
+            "client_email": client_email,
+            "client_phone": client_phone,
+            "client_address": cells.get("client_address", ""),
+            "business": cells.get("business") or self.businesses[biz_id],
+            "items": items,
+            "date": date,
+            "due_date": due_date,
+            "is_pending": is_pending,
+            "date_ord": date_ordinal(date),
+            "due_date_ord": date_ordinal(due_date),
+            "client_notes": cells.get("client_notes", ""),
+            "biz_id": biz_id
+        }
+        record.update(totals)
+        return record, None
+
+    def valid_invoices(self):
+        """Stream the validated (biz_id, record) pairs in file order"""
+        for biz_id, record in self.conn.execute("SELECT biz_id, record FROM valid ORDER BY seq"):
+            yield biz_id, json.loads(record)
+
+    def write_error_report(self, path):
+        """Write every rejected row (file, row number, invoice, reason) to a CSV file"""
+        with atomic_file(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["File", "Row", "Invoice No", "Error"])
+            writer.writerows(self.conn.execute("SELECT file, row, invoice_id, error FROM errors ORDER BY seq"))
+
+    def close(self):
+        self.conn.close()
+        try:
+            os.remove(self.db_path)
+        except OSError as e:
+            print(f"Could not remove import database {self.db_path}: {e}")
+
+
+# --- PDF RENDERING ---
+
+def write_cache_file(path, write):
+    """Create a regenerable cache file with write(tmp_path), under a temp name no other process uses"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}-{time.time_ns()}.tmp"
+    try:
+        write(tmp_path)
+        # No .pending marker: a lost cache file is simply made again
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class LogoCache:
+    """PDF-ready copies of business logos: flattened onto white, downsampled, saved as JPEG
+
+    Files are named by a hash of the logo's content, so a logo is converted once no matter how
+    many invoices use it, and a re-uploaded or edited logo gets a new file. The hash is only
+    recomputed when the logo's size or mtime changes. Files are written under a unique temp
+    name and renamed into place, so any number of renderers (threads or processes) can read
+    the cache while another fills it.
+    """
+
+    def __init__(self, folder, max_pixels=LOGO_MAX_PIXELS):
+        self.folder = folder
+        self.max_pixels = max_pixels
+        self.entries = {}  # logo path -> (file_stamp, cached JPEG path)
+        self.lock = threading.Lock()
+
+    def get(self, logo_path):
+        """Path of the cached JPEG for a logo, converting it on first use; None if there is no usable logo"""
+        if not logo_path or not os.path.exists(logo_path):
+            return None
+        try:
+            stamp = file_stamp(logo_path)
+            with self.lock:
+                entry = self.entries.get(logo_path)
+            if entry and entry[0] == stamp and os.path.exists(entry[1]):
+                return entry[1]
+            with open(logo_path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:24]
+            cached_path = os.path.join(self.folder, f"{digest}-{self.max_pixels}.jpg")
+            if not os.path.exists(cached_path):
+                self.convert(logo_path, cached_path)
+            with self.lock:
+                self.entries[logo_path] = (stamp, cached_path)
+            return cached_path
+        except Exception as e:
+            print(f"Logo load failed: {e}")
+            return None
+
+    def convert(self, logo_path, cached_path):
+        img = Image.open(logo_path)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            # Transparent areas become white, as they look on the page, instead of black
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.thumbnail((self.max_pixels, self.max_pixels), Image.LANCZOS)
+        write_cache_file(cached_path, lambda tmp_path: img.save(tmp_path, 'JPEG', quality=90))
+
+
+class InvoicePdf(FPDF):
+    """FPDF for the Unicode-font invoice PDFs
+
+    The pyfpdf internals these PDFs depend on (written against pyfpdf 1.7.2) are kept here:
+    - TrueType fonts are embedded by _putfonts below instead of fpdf's own, so the subsets it
+      has built can be reused. fpdf parses the whole font file again for each PDF it embeds a
+      font subset in, which takes far longer than laying out an invoice; most invoices need the
+      same glyphs (FontRegistry puts all of printable ASCII in every subset), so each glyph set
+      is only subset once per process. Other FPDF documents are not affected.
+    - Logos are parsed once (parse_jpeg) and handed to each document (add_image).
+    """
+
+    subsets = {}  # (font file, glyph set) -> (compressed font program, its length, compressed CIDToGIDMap, maxUni)
+    subsets_lock = threading.Lock()
+
+    @staticmethod
+    def parse_jpeg(path):
+        """fpdf's image info of a JPEG file"""
+        return FPDF._parsejpg(None, path)
+
+    def add_image(self, name, info):
+        """Make an image parsed with parse_jpeg available to image(name, ...) without reading it again"""
+        self.images.setdefault(name, dict(info, i=len(self.images) + 1))
+
+    def _putfonts(self):
+        # fpdf writes the other fonts; it would embed the TrueType ones with a fresh subsetter
+        ttf_fonts = {key: font for key, font in self.fonts.items() if font['type'] == 'TTF'}
+        other_fonts = {key: font for key, font in self.fonts.items() if key not in ttf_fonts}
+        all_fonts, self.fonts = self.fonts, other_fonts
+        try:
+            super()._putfonts()
+        finally:
+            self.fonts = all_fonts
+        for font in sorted(ttf_fonts.values(), key=lambda font: font['i']):
+            self._put_ttf_font(font)
+
+    @classmethod
+    def font_subset(cls, ttffile, subset):
+        key = (ttffile, frozenset(subset))
+        with cls.subsets_lock:
+            cached = cls.subsets.get(key)
+        if cached is None:
+            ttf = TTFontFile()
+            program = ttf.makeSubset(ttffile, subset)
+            cidtogidmap = bytearray(256 * 256 * 2)
+            for code, glyph in ttf.codeToGlyph.items():
+                cidtogidmap[code * 2] = glyph >> 8
+                cidtogidmap[code * 2 + 1] = glyph & 0xFF
+            # fpdf writes widths up to maxUni but skips every code point above 255 not in the subset
+            max_uni = min(ttf.maxUni, max(max(subset), 255))
+            cached = (zlib.compress(program), len(program), zlib.compress(bytes(cidtogidmap)), max_uni)
+            with cls.subsets_lock:
+                if len(cls.subsets) >= FONT_SUBSET_CACHE_SIZE:
+                    del cls.subsets[next(iter(cls.subsets))]
+                cls.subsets[key] = cached
+        return cached
+
+    def _put_ttf_font(self, font):
+        """Embed one TrueType font subset as a Type0 font, object for object as fpdf 1.7.2 does"""
+        font['n'] = self.n + 1
+        fontname = 'MPDFAA+' + font['name']
+        subset = font['subset']
+        del subset[0]
+        fontstream, fontsize, cidtogidmap, max_uni = self.font_subset(font['ttffile'], subset)
+
+        # Type0 font, made of the CIDFont below
+        self._newobj()
+        self._out('<</Type /Font')
+        self._out('/Subtype /Type0')
+        self._out('/BaseFont /' + fontname)
+        self._out('/Encoding /Identity-H')
+        self._out('/DescendantFonts [' + str(self.n + 1) + ' 0 R]')
+        self._out('/ToUnicode ' + str(self.n + 2) + ' 0 R')
+        self._out('>>')
+        self._out('endobj')
+
+        # CIDFontType2
+        self._newobj()
+        self._out('<</Type /Font')
+        self._out('/Subtype /CIDFontType2')
+        self._out('/BaseFont /' + fontname)
+        self._out('/CIDSystemInfo ' + str(self.n + 2) + ' 0 R')
+        self._out('/FontDescriptor ' + str(self.n + 3) + ' 0 R')
+        if font['desc'].get('MissingWidth'):
+            self._out('/DW %d' % font['desc']['MissingWidth'])
+        self._putTTfontwidths(font, max_uni)
+        self._out('/CIDToGIDMap ' + str(self.n + 4) + ' 0 R')
+        self._out('>>')
+        self._out('endobj')
+
+        # ToUnicode
+        to_unicode = ("/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n"
+                      "/CIDSystemInfo\n<</Registry (Adobe)\n/Ordering (UCS)\n/Supplement 0\n>> def\n"
+                      "/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n"
+                      "1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n"
+                      "1 beginbfrange\n<0000> <FFFF> <0000>\nendbfrange\n"
+                      "endcmap\nCMapName currentdict /CMap defineresource pop\nend\nend")
+        self._newobj()
+        self._out('<</Length ' + str(len(to_unicode)) + '>>')
+        self._putstream(to_unicode)
+        self._out('endobj')
+
+        # CIDSystemInfo
+        self._newobj()
+        self._out('<</Registry (Adobe)')
+        self._out('/Ordering (UCS)')
+        self._out('/Supplement 0')
+        self._out('>>')
+        self._out('endobj')
+
+        # Font descriptor
+        self._newobj()
+        self._out('<</Type /FontDescriptor')
+        self._out('/FontName /' + fontname)
+        for key in ('Ascent', 'Descent', 'CapHeight', 'Flags', 'FontBBox', 'ItalicAngle', 'StemV', 'MissingWidth'):
+            value = font['desc'][key]
+            if key == 'Flags':
+                value = (value | 4) & ~32  # Nonsymbolic
+            self._out(' /%s %s' % (key, value))
+        self._out('/FontFile2 ' + str(self.n + 2) + ' 0 R')
+        self._out('>>')
+        self._out('endobj')
+
+        # CIDToGIDMap (binary data goes through fpdf's buffer as latin-1)
+        self._newobj()
+        self._out('<</Length ' + str(len(cidtogidmap)))
+        self._out('/Filter /FlateDecode')
+        self._out('>>')
+        self._putstream(cidtogidmap.decode('latin-1'))
+        self._out('endobj')
+
+        # Font program
+        self._newobj()
+        self._out('<</Length ' + str(len(fontstream)))
+        self._out('/Filter /FlateDecode')
+        self._out('/Length1 ' + str(fontsize))
+        self._out('>>')
+        self._putstream(fontstream.decode('latin-1'))
+        self._out('endobj')
+
+
+class GlyphSubset(list):
+    """The code points a document uses of a font, as the list fpdf keeps, with a set for `in`
+
+    fpdf tests membership once per glyph of the font when it writes a subset's widths, and
+    appends every character it draws; repeats are dropped so long documents keep a short list.
+    """
+
+    def __init__(self, codes):
+        super().__init__(codes)
+        self.codes = set(self)
+
+    def append(self, code):
+        if code not in self.codes:
+            super().append(code)
+            self.codes.add(code)
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.codes = set(self)
+
+    def __contains__(self, code):
+        return code in self.codes
+
+
+class PdfBuffer:
+    """Stand-in for FPDF.buffer that appends in constant time
+
+    fpdf writes a document with `self.buffer += line`, copying everything written so far for
+    each line, which makes writing a long (many-page) document take quadratic time.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.length = 0
+
+    def __iadd__(self, text):
+        self.parts.append(text)
+        self.length += len(text)
+        return self
+
+    def __len__(self):
+        return self.length
+
+    def getvalue(self):
+        return ''.join(self.parts)
+
+
+class FontRegistry:
+    """The Unicode TrueType fonts for PDFs, loaded once per process
+
+    A font's metrics are parsed once and kept in FONT_CACHE_FOLDER under a name that holds a
+    hash of the font file and FONT_METRICS_VERSION, so an updated font or a new metrics format
+    is parsed again. register(pdf) hands the loaded fonts to a document, which embeds only the
+    glyphs it uses. A style with no usable font file of its own (italic, or a missing bold) is
+    drawn with the regular face; see style(). If the regular face is unusable too, family is
+    None and PDFs stay on the core (ASCII-only) fonts. Characters the fonts have no glyph for
+    (Tamil or Devanagari, say, in DejaVu Sans) are printed as '?'; see sanitize().
+    """
+
+    FAMILY = 'DejaVu'
+
+    def __init__(self, font_dir, cache_folder, faces=PDF_FONT_FACES):
+        self.font_dir = font_dir
+        self.cache_folder = cache_folder
+        self.faces = faces
+        self.fonts = None  # style -> font metrics of each usable face, loaded on first use
+        self.covered = frozenset()  # Code points every usable face has a glyph for
+        self.lock = threading.Lock()
+
+    @property
+    def family(self):
+        return self.FAMILY if self.loaded() else None
+
+    def loaded(self):
+        """Style -> font metrics of each usable face; empty if there is no usable regular face"""
+        with self.lock:
+            if self.fonts is None:
+                fonts = {}
+                for style, filename in self.faces.items():
+                    try:
+                        fonts[style] = self.load_metrics(os.path.join(self.font_dir, filename))
+                    except Exception as e:
+                        print(f"PDF font {filename} unavailable: {e}")
+                self.fonts = fonts if '' in fonts else {}
+                if self.fonts:
+                    self.covered = frozenset.intersection(*(
+                        frozenset(code for code, width in enumerate(metrics['cw']) if width)
+                        for metrics in self.fonts.values()))
+            return self.fonts
+
+    def sanitize(self, text):
+        """Text with each character the fonts can't draw (they would leave a blank) replaced by '?'"""
+        if not text:
+            return ""
+        text = str(text)
+        if text.isascii():
+            return text
+        self.loaded()
+        return ''.join(char if ord(char) < 128 or ord(char) in self.covered else '?' for char in text)
+
+    def style(self, style):
+        """The registered style to draw a requested one ('', 'B', 'I', 'BI') with"""
+        style = style.upper()
+        if style in self.loaded():
+            return style
+        return 'B' if 'B' in style and 'B' in self.fonts else ''
+
+    def load_metrics(self, font_path):
+        with open(font_path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:24]
+        name = os.path.splitext(os.path.basename(font_path))[0]
+        cache_path = os.path.join(self.cache_folder, f"{name}-{digest}-v{FONT_METRICS_VERSION}.json")
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                metrics = json.load(f)
+        except (OSError, ValueError):
+            metrics = self.parse_metrics(font_path)
+
+            def write(tmp_path):
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(metrics, f, separators=(',', ':'))
+            try:
+                write_cache_file(cache_path, write)
+            except OSError as e:
+                print(f"Could not cache metrics of {font_path}: {e}")
+        # The cache is keyed by content, so the font may have moved since it was written
+        metrics['ttffile'] = font_path
+        return metrics
+
+    @staticmethod
+    def parse_metrics(font_path):
+        """The metrics FPDF.add_font reads from a TrueType file"""
+        with open(font_path, 'rb') as f:
+            if f.read(4) not in (b'\x00\x01\x00\x00', b'true'):
+                raise ValueError("not a TrueType font")
+        ttf = TTFontFile()
+        ttf.getMetrics(font_path)
+        return {
+            'name': re.sub('[ ()]', '', ttf.fullName),
+            'desc': {
+                'Ascent': int(round(ttf.ascent)),
+                'Descent': int(round(ttf.descent)),
+                'CapHeight': int(round(ttf.capHeight)),
+                'Flags': ttf.flags,
+                'FontBBox': "[%s %s %s %s]" % tuple(int(round(v)) for v in ttf.bbox),
+                'ItalicAngle': int(ttf.italicAngle),
+                'StemV': int(round(ttf.stemV)),
+                'MissingWidth': int(round(ttf.defaultWidth)),
+            },
+            'up': round(ttf.underlinePosition),
+            'ut': round(ttf.underlineThickness),
+            'originalsize': os.path.getsize(font_path),
+            'cw': ttf.charWidths,
+        }
+
+    def register(self, pdf):
+        """Add the fonts to a document as family FAMILY, as FPDF.add_font would without reading them again"""
+        for style, metrics in self.loaded().items():
+            fontkey = self.FAMILY.lower() + style
+            if fontkey in pdf.fonts:
+                continue
+            pdf.fonts[fontkey] = {
+                'i': len(pdf.fonts) + 1, 'type': 'TTF', 'name': metrics['name'],
+                'desc': metrics['desc'], 'up': metrics['up'], 'ut': metrics['ut'],
+                'cw': metrics['cw'], 'ttffile': metrics['ttffile'], 'fontkey': fontkey,
+                # Control codes as add_font sets them, plus printable ASCII so most PDFs share one subset
+                'subset': GlyphSubset(range(0, 127)), 'unifilename': None,
+            }
+            pdf.font_files[fontkey] = {'length1': metrics['originalsize'], 'type': 'TTF',
+                                       'ttffile': metrics['ttffile']}
+
+
+class PdfRenderPlan:
+    """The profile-dependent (static) layer of a Style 1 invoice, compiled once per business
+
+    Compiling works out the theme colour and watermark, converts and parses the logo, and picks
+    the font: the Unicode one from the font registry, or core Arial if it has none. Text is
+    passed through sanitize first, which keeps what the chosen font can draw (just ASCII for
+    Arial). Rendering an invoice then only lays out its own fields.
+    key records the profile fields (and logo file) the plan was compiled from; render_plan
+    compiles a new plan when an invoice's key differs, so a plan never outlives a profile edit.
+    """
+
+    PROFILE_FIELDS = ['biz_name', 'biz_addr', 'biz_email', 'biz_phone', 'biz_gst_no',
+                      'biz_watermark', 'biz_color', 'biz_logo']
+
+    @classmethod
+    def profile_key(cls, data):
+        """What a plan compiled from data depends on; a re-uploaded logo changes its file stamp"""
+        return (tuple(data.get(field) for field in cls.PROFILE_FIELDS),
+                file_stamp(data['biz_logo']) if data.get('biz_logo') else None)
+
+    def __init__(self, data, sanitize, logo_cache, fonts, rupee):
+        self.key = self.profile_key(data)
+        self.fonts = fonts
+        self.unicode = fonts.family is not None
+        if self.unicode:
+            self.font = fonts.family
+            sanitize = fonts.sanitize
+            self.currency = rupee if sanitize(rupee) == rupee else "Rs."
+        else:
+            self.font = 'Arial'  # Core font: ASCII only
+            self.currency = "Rs."
+        self.sanitize = sanitize
+        hex_color = data['biz_color'].lstrip('#')
+        self.color = tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+        self.gst_line = f"GST No: {sanitize(data['biz_gst_no'])}" if data.get('biz_gst_no') else None
+
+        from_info = f"{sanitize(data['biz_name'])}\n{sanitize(data['biz_addr'])}"
+        if data['biz_email']:
+            from_info += f"\n{sanitize(data['biz_email'])}"
+        if data['biz_phone']:
+            from_info += f"\n{sanitize(data['biz_phone'])}"
+        self.from_info = from_info
+
+        watermark = data.get('biz_watermark') or ""
+        if self.unicode:
+            watermark = sanitize(watermark)
+        else:
+            # Convert to ASCII, dropping non-ASCII characters
+            watermark = watermark.encode('ascii', 'ignore').decode('ascii')
+        self.watermark = watermark if watermark.strip() else ""
+        self.logo = self.load_logo(logo_cache.get(data.get('biz_logo')))
+
+    @staticmethod
+    def load_logo(jpeg_path):
+        """(image path, parsed fpdf image info) of a cached logo JPEG, or None"""
+        if not jpeg_path:
+            return None
+        try:
+            return jpeg_path, InvoicePdf.parse_jpeg(jpeg_path)
+        except Exception as e:
+            print(f"Logo load failed: {e}")
+            return None
+
+    def new_document(self):
+        """An empty InvoicePdf document (no pages yet) with the plan's fonts available"""
+        pdf = InvoicePdf()
+        if self.unicode:
+            self.fonts.register(pdf)
+        return pdf
+
+    def set_font(self, pdf, style, size):
+        if self.unicode:
+            style = self.fonts.style(style)
+        pdf.set_font(self.font, style, size)
+
+    def draw_header(self, pdf):
+        """Logo at the top left, INVOICE title and GST number at the right"""
+        if self.logo:
+            name, info = self.logo
+            # Hand fpdf the image parsed at compile time so it isn't read and decoded again
+            pdf.add_image(name, info)
+            # Size: 50mm width, Position: very top (y=3) and left (x=5)
+            pdf.image(name, 5, 3, 50)
+
+        self.set_font(pdf, 'B', 28)
+        pdf.set_text_color(*self.color)
+        pdf.cell(0, 15, "INVOICE", 0, 1, 'R')
+
+        self.set_font(pdf, '', 12)
+        pdf.set_text_color(100)
+        if self.gst_line:
+            pdf.cell(0, 6, self.gst_line, 0, 1, 'R')
+
+    def draw_from(self, pdf):
+        pdf.set_text_color(0)
+        self.set_font(pdf, 'B', 13)
+        pdf.cell(0, 8, "FROM:", 0, 1)
+        self.set_font(pdf, '', 12)
+        pdf.multi_cell(0, 6, self.from_info)
+
+    def draw_table_header(self, pdf, has_quantity):
+        pdf.set_fill_color(*self.color)
+        pdf.set_text_color(255)
+        self.set_font(pdf, 'B', 12)
+        if has_quantity:
+            pdf.cell(90, 10, " Description", 1, 0, 'L', True)
+            pdf.cell(50, 10, " Quantity", 1, 0, 'C', True)
+            pdf.cell(50, 10, f" Price ({self.currency})", 1, 1, 'R', True)
+        else:
+            pdf.cell(140, 10, " Description", 1, 0, 'L', True)
+            pdf.cell(50, 10, f" Price ({self.currency})", 1, 1, 'R', True)
+
+    def draw_watermark(self, pdf):
+        """Watermark slightly lower on the page, if the business has one"""
+        if not self.watermark:
+            return
+        # Add some space and place watermark (don't use absolute positioning)
+        pdf.ln(15)
+        self.set_font(pdf, 'I', 10)
+        pdf.set_text_color(150, 150, 150)
+        pdf.cell(0, 10, self.watermark, 0, 0, 'C')
+
+
+def invoice_pdf_data(record, profile, biz_id):
+    """The data generate() renders, rebuilt from a stored invoice and its business's profile"""
+    due_date = record.get('due_date') or ""
+    return {
+        "id": str(record['id']),
+        "date": record.get('date', ""),
+        "due_date": "" if due_date.upper() == "PENDING" else due_date,
+        "is_pending": invoice_is_pending(record),
+        "client_name": record.get('client', ""),
+        "client_email": record.get('client_email', ""),
+        "client_phone": record.get('client_phone', ""),
+        "discount_rate": record.get('discount_rate', 0),
+        "discount_amt": record.get('discount_amt', 0),
+        "client_address": record.get('client_address', ""),
+        "client_notes": record.get('client_notes', ""),
+        "items": record.get('items', []),
+        "subtotal": record.get('subtotal', 0),
+        "tax_rate": record.get('tax_rate', 0),
+        "tax_amt": record.get('tax_amt', 0),
+        "total": record.get('total', 0),
+        **profile_pdf_data(profile, biz_id),
+    }
+
+
+def profile_pdf_data(profile, biz_id):
+    """The business fields of the data generate() renders, which is all a PdfRenderPlan reads"""
+    return {
+        "biz_id": biz_id,
+        "biz_name": profile["name"],
+        "biz_addr": profile["address"],
+        "biz_email": profile.get("email", ""),
+        "biz_phone": profile.get("phone", ""),
+        "biz_gst_no": profile.get("gst_no", ""),
+        "biz_logo": profile["logo"],
+        "biz_color": profile["color"],
+        "biz_style": profile.get("style", "Modern"),
+        "biz_watermark": profile.get("watermark", ""),
+    }
+
+
+class AutocompleteDropdown:
+    """Suggestion list that drops down under an entry as the user types
+
+    get_suggestions(text) returns (label, value) pairs, best first; on_select(value) is called
+    when one is picked with the mouse or Up/Down + Enter (Enter alone takes the first one).
+    Escape or leaving the entry closes the list.
+    """
+
+    def __init__(self, entry, get_suggestions, on_select, max_rows=8):
+        self.entry = entry
+        self.get_suggestions = get_suggestions
+        self.on_select = on_select
+        self.max_rows = max_rows
+        self.values = []
+        self.popup = None
+        self.listbox = None
+        entry.bind("<KeyRelease>", self.on_key, add="+")
+        entry.bind("<Down>", lambda e: self.move(1), add="+")
+        entry.bind("<Up>", lambda e: self.move(-1), add="+")
+        entry.bind("<Return>", self.on_return, add="+")
+        entry.bind("<Escape>", lambda e: self.hide(), add="+")
+        entry.bind("<FocusOut>", lambda e: entry.after(200, self.hide), add="+")
+
+    def on_key(self, event):
+        if event.keysym in ("Up", "Down", "Return", "Escape", "Tab"):
+            return
+        suggestions = self.get_suggestions(self.entry.get())
+        if suggestions:
+            self.show(suggestions)
+        else:
+            self.hide()
+
+    def show(self, suggestions):
+        if self.popup is None:
+            self.popup = Toplevel(self.entry)
+            self.popup.overrideredirect(True)
+            self.listbox = Listbox(self.popup, activestyle="none", borderwidth=1, relief="solid",
+                                   highlightthickness=0, font=("Segoe UI", 10),
+                                   background="#ffffff", foreground="#1e293b",
+                                   selectbackground="#3b82f6", selectforeground="#ffffff")
+            self.listbox.pack(fill="both", expand=True)
+            self.listbox.bind("<ButtonRelease-1>", self.on_click)
+        self.values = [value for _, value in suggestions]
+        self.listbox.delete(0, "end")
+        for label, _ in suggestions:
+            self.listbox.insert("end", label)
+        self.listbox.configure(height=min(len(suggestions), self.max_rows))
+        x = self.entry.winfo_rootx()
+        y = self.entry.winfo_rooty() + self.entry.winfo_height()
+        self.popup.geometry(f"{self.entry.winfo_width()}x{self.listbox.winfo_reqheight()}+{x}+{y}")
+        self.popup.deiconify()
+        self.popup.lift()
+
+    def hide(self):
+        if self.popup is not None:
+            self.popup.withdraw()
+        self.values = []
+
+    def move(self, step):
+        if not self.values:
+            return
+        current = self.listbox.curselection()
+        index = (current[0] + step) if current else (0 if step > 0 else len(self.values) - 1)
+        index = max(0, min(index, len(self.values) - 1))
+        self.listbox.selection_clear(0, "end")
+        self.listbox.selection_set(index)
+        self.listbox.see(index)
+        return "break"
+
+    def on_return(self, event):
+        if self.values:
+            selection = self.listbox.curselection()
+            self.pick(selection[0] if selection else 0)
+            return "break"
+
+    def on_click(self, event):
+        if self.values:
+            self.pick(self.listbox.nearest(event.y))
+
+    def pick(self, index):
+        value = self.values[index]
+        self.hide()
+        self.on_select(value)
+
+
+class VirtualHistoryList(ct.CTkFrame):
+    """Scrollable list that only builds widgets for the rows in view
+
+    Rows have a fixed height. A small pool of row widgets is created once and re-bound to
+    whichever items scroll into view, so drawing and scrolling cost depends on the viewport,
+    not on how many items are in the list.
+
+    The list shows the caller's own list object (last item first when reverse is set). After
+    changing it in place, call rows_inserted/rows_removed/row_changed so only the affected
+    rows are redrawn.
+    """
+
+    def __init__(self, master, row_height, create_row, bind_row, buffer_rows=3, reverse=False, **kwargs):
+        super().__init__(master, **kwargs)
+        self.row_height = row_height
+        self.reverse = reverse  # Show the last item at the top
+        self.create_row = create_row  # create_row(parent) -> new row widget
+        self.bind_row = bind_row  # bind_row(row, item) fills a row widget with an item
+        self.buffer_rows = buffer_rows
+        self.items = []
+        self.empty_text = ""
+        self.visible = {}  # row index -> row widget currently showing it
+        self.windows = {}  # row widget -> canvas window id
+        self.pool = []  # Row widgets not showing anything
+
+        self.canvas = ct.CTkCanvas(self, highlightthickness=0, borderwidth=0,
+                                   yscrollincrement=max(self.scaled_row_height() // 4, 1))
+        self.scrollbar = ct.CTkScrollbar(self, orientation="vertical", command=self.on_scrollbar)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+
+        self.empty_frame = ct.CTkFrame(self.canvas, fg_color=("#f1f5f9", "#1e293b"), corner_radius=8)
+        self.empty_label = ct.CTkLabel(self.empty_frame, text="",
+                                       text_color=("#94a3b8", "#64748b"),
+                                       font=ct.CTkFont(size=11))
+        self.empty_label.pack(pady=12)
+
+        self.canvas.bind("<Configure>", self.on_resize)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.canvas.bind_all(sequence, self.on_mouse_wheel, add="+")
+        self.update_background()
+
+    def scaled_row_height(self):
+        return int(self._apply_widget_scaling(self.row_height))
+
+    def update_background(self):
+        color = self.cget("fg_color")
+        if color == "transparent":
+            color = self.cget("bg_color")
+        self.canvas.configure(bg=self._apply_appearance_mode(color))
+
+    def _set_appearance_mode(self, mode_string):
+        super()._set_appearance_mode(mode_string)
+        if hasattr(self, "canvas"):
+            self.update_background()
+
+    def set_items(self, items, empty_text=""):
+        """Show a new list of items from the top; empty_text is shown when there are none"""
+        self.items = items
+        self.empty_text = empty_text
+        for index in list(self.visible):
+            self.release_row(index)
+        self.update_empty_message()
+        self.update_scrollregion()
+        self.canvas.yview_moveto(0)
+        self.redraw()
+
+    def item_at(self, index):
+        """Item shown in row index"""
+        if self.reverse:
+            return self.items[len(self.items) - 1 - index]
+        return self.items[index]
+
+    def update_empty_message(self):
+        if self.items:
+            self.empty_frame.place_forget()
+        else:
+            self.empty_label.configure(text=self.empty_text)
+            self.empty_frame.place(x=5, y=10, relwidth=1, width=-10)
+
+    def shift_rows(self, start, offset):
+        """Move the rows showing items from start onwards by offset places"""
+        row_height = self.scaled_row_height()
+        gap = int(self._apply_widget_scaling(8))
+        shifted = {}
+        for index, row in self.visible.items():
+            if index >= start:
+                index += offset
+                self.canvas.coords(self.windows[row], 0, index * row_height + gap // 2)
+            shifted[index] = row
+        self.visible = shifted
+
+    def rows_inserted(self, index, count=1):
+        """count items were added at row index of the list"""
+        self.shift_rows(index, count)
+        self.update_empty_message()
+        self.update_scrollregion()
+        self.redraw()
+
+    def rows_removed(self, index, count=1):
+        """count items starting at row index were removed from the list"""
+        for removed in range(index, index + count):
+            if removed in self.visible:
+                self.release_row(removed)
+        self.shift_rows(index + count, -count)
+        self.update_empty_message()
+        self.update_scrollregion()
+        self.redraw()
+
+    def row_changed(self, index):
+        """The item in row index was replaced or edited"""
+        if index in self.visible:
+            self.bind_row(self.visible[index], self.item_at(index))
+
+    def update_scrollregion(self):
+        height = len(self.items) * self.scaled_row_height()
+        self.canvas.configure(scrollregion=(0, 0, self.canvas.winfo_width(), height))
+
+    def release_row(self, index):
+        """Hide the row showing an item and put it back in the pool"""
+        row = self.visible.pop(index)
+        self.canvas.itemconfigure(self.windows[row], state="hidden")
+        self.pool.append(row)
+
+    def redraw(self):
+        """Bind rows to the items in (and just around) the viewport"""
+        row_height = self.scaled_row_height()
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first = max(int(top // row_height) - self.buffer_rows, 0)
+        last = min(int(bottom // row_height) + 1 + self.buffer_rows, len(self.items))
+
+        for index in [i for i in self.visible if i < first or i >= last]:
+            self.release_row(index)
+
+        width = self.canvas.winfo_width()
+        gap = int(self._apply_widget_scaling(8))  # Space between cards
+        for index in range(first, last):
+            if index in self.visible:
+                continue
+            row = self.pool.pop() if self.pool else self.create_row(self.canvas)
+            self.bind_row(row, self.item_at(index))
+            y = index * row_height + gap // 2
+            if row in self.windows:
+                window = self.windows[row]
+                self.canvas.coords(window, 0, y)
+                self.canvas.itemconfigure(window, state="normal", width=width)
+            else:
+                self.windows[row] = self.canvas.create_window(
+                    0, y, anchor="nw", window=row, width=width, height=row_height - gap)
+            self.visible[index] = row
+
+    def on_resize(self, event):
+        for window in self.windows.values():
+            self.canvas.itemconfigure(window, width=event.width)
+        self.update_scrollregion()
+        self.redraw()
+
+    def on_scrollbar(self, *args):
+        self.canvas.yview(*args)
+        self.redraw()
+
+    def on_mouse_wheel(self, event):
+        # bind_all sees every wheel event in the app, only react inside this list
+        if not str(event.widget).startswith(str(self.canvas)):
+            return
+        if event.num == 4:
+            step = -1
+        elif event.num == 5:
+            step = 1
+        else:
+            step = -1 if event.delta > 0 else 1
+        self.canvas.yview_scroll(step * 3, "units")
+        self.redraw()
+
+
+class ProgressDialog:
+    """Modal window that runs a job on a worker thread and shows its progress, with a Cancel button
+
+    The job is called as job(dialog) and reports through dialog.report(done, total), which is
+    safe from any thread; it should stop (e.g. raise JobCancelled) once dialog.cancelled is set.
+    on_done(result, error) is called on the Tk thread when the job ends.
+    """
+
+    POLL_MS = 100
+
+    def __init__(self, parent, title, text=""):
+        self.cancelled = threading.Event()
+        self.reports = queue.Queue()
+        self.text = text
+        self.window = ct.CTkToplevel(parent)
+        self.window.title(title)
+        self.window.geometry("380x160")
+        self.window.resizable(False, False)
+        self.window.transient(parent)
+        self.window.grab_set()
+        self.window.protocol("WM_DELETE_WINDOW", self.cancel)
+
+        self.label = ct.CTkLabel(self.window, text=text or title, font=ct.CTkFont(size=12))
+        self.label.pack(pady=(20, 10), padx=20)
+        self.bar = ct.CTkProgressBar(self.window, width=320)
+        self.bar.set(0)
+        self.bar.pack(pady=5, padx=20)
+        self.cancel_btn = ct.CTkButton(self.window, text="Cancel", width=120, height=32,
+                                       fg_color=("#ef4444", "#dc2626"),
+                                       hover_color=("#dc2626", "#b91c1c"),
+                                       command=self.cancel)
+        self.cancel_btn.pack(pady=15)
+
+    def report(self, done, total=None, text=None):
+        """Queue a progress update (any thread); text replaces the label's description"""
+        self.reports.put(("progress", done, total, text))
+
+    def run(self, job, on_done):
+        def work():
+            try:
+                self.reports.put(("done", job(self), None))
+            except Exception as e:
+                self.reports.put(("done", None, e))
+
+        threading.Thread(target=work, daemon=True).start()
+        self.poll(on_done)
+
+    def poll(self, on_done):
+        """Show the newest progress report; close and call on_done once the job has finished"""
+        latest = finished = None
+        while not self.reports.empty():
+            report = self.reports.get_nowait()
+            if report[0] == "done":
+                finished = report
+            else:
+                latest = report
+        if finished:
+            self.window.grab_release()
+            self.window.destroy()
+            on_done(finished[1], finished[2])
+            return
+        if latest and not self.cancelled.is_set():
+            _, done, total, text = latest
+            self.text = text or self.text
+            if total:
+                self.bar.set(min(done / total, 1))
+                self.label.configure(text=f"{self.text} {done:,} of {total:,}".strip())
+            else:
+                self.label.configure(text=f"{self.text} {done:,}".strip())
+        self.window.after(self.POLL_MS, lambda: self.poll(on_done))
+
+    def cancel(self):
+        self.cancelled.set()
+        self.label.configure(text="Cancelling...")
+        self.cancel_btn.configure(state="disabled")
+
+
 class SplashScreen(ct.CTkToplevel):
     def __init__(self, parent):
         super().__init__(parent)
@@ -626,10 +4346,29 @@ class InvoiceApp(ct.CTk):
             print(f"Could not set window icon: {e}")
 
         # Load Data
+        # Other instances (e.g. counter PCs on a shared drive) may use the same DB_FOLDER
+        self.db_lock = FileLock(DB_LOCK_FILE)
         self.profiles = self.load_profiles()
+        self.history_store = self.open_history_store()
+        self.search_index = HistorySearchIndex(SEARCH_INDEX_FILE)
+        self.client_directory = ClientDirectory(CLIENTS_FILE)
+        self.item_catalog = ItemCatalog(ITEM_CATALOG_FILE)
+        self.invoice_archive = InvoiceArchive(ARCHIVE_FOLDER)
+        self.render_plans = {}  # biz_id -> PdfRenderPlan, rebuilt when the profile changes; Tk thread only
+        self.logo_cache = LogoCache(LOGO_CACHE_FOLDER)
+        self.pdf_fonts = FontRegistry(RESOURCE_DIR, FONT_CACHE_FOLDER)
         self.history = self.load_history()
         self.items = []
 
+        # History search runs on a worker thread; only the newest query's result reaches the UI
+        self.search_after_id = None
+        self.search_generation = 0
+        self.search_requests = queue.Queue()
+        self.search_results = queue.Queue()
+        threading.Thread(target=self.search_worker, daemon=True).start()
+        self.after(SEARCH_POLL_MS, self.poll_search_results)
+        self.after(SHARED_POLL_MS, self.poll_shared_changes)
+
         # State: Default to Business 1
         self.current_biz_id = "biz_1"
         self.current_theme = self.profiles[self.current_biz_id]["color"]
@@ -776,45 +4515,70 @@ class InvoiceApp(ct.CTk):
         pass
 
     def load_profiles(self):
-        if os.path.exists(PROFILES_FILE):
-            try:
-                with open(PROFILES_FILE, 'r') as f:
-                    data = json.load(f)
-                    # Merge with defaults to ensure structure exists if file is old
-                    for key, val in DEFAULT_PROFILES.items():
-                        if key not in data:
-                            data[key] = val
-                    return data
-            except:
-                return DEFAULT_PROFILES
-        return DEFAULT_PROFILES
+        # What was on disk is the base that later merges compare our edits against
+        self.profiles_stamp = file_stamp(PROFILES_FILE)
+        data = read_json_file(PROFILES_FILE, None)
+        if not isinstance(data, dict):
+            self.profiles_base = {}
+            return DEFAULT_PROFILES
+        self.profiles_base = json.loads(json.dumps(data))
+        # Merge with defaults to ensure structure exists if file is old
+        for key, val in DEFAULT_PROFILES.items():
+            if key not in data:
+                data[key] = val
+        return data
 
     def save_profiles(self):
-        with open(PROFILES_FILE, 'w') as f:
-            json.dump(self.profiles, f, indent=4)
+        """Queue profiles.json for writing; a burst of edits is flushed as one atomic write
+
+        The write runs under the DB lock and merges in what other instances saved meanwhile,
+        so their edits aren't overwritten.
+        """
+        base = self.profiles_base
+
+        def written(ours, merged):
+            # Our edits are on disk now, so they no longer count as ours in later merges
+            self.profiles_base = settled_profiles(self.profiles_base, ours, merged)
+            if merged == ours:
+                # Nothing new from other instances; don't read our own write back
+                self.profiles_stamp = file_stamp(PROFILES_FILE)
+
+        JSON_WRITER.save(PROFILES_FILE, self.profiles, indent=4, lock=self.db_lock,
+                         merge=lambda ours: merge_profiles(base, ours, read_json_file(PROFILES_FILE, {})),
+                         written=written)
+
+    def refresh_profiles(self):
+        """Merge profile edits other instances saved into self.profiles; returns the changed biz_ids"""
+        stamp = file_stamp(PROFILES_FILE)
+        if stamp == self.profiles_stamp:
+            return set()
+        self.profiles_stamp = stamp
+        theirs = read_json_file(PROFILES_FILE, None)
+        if not isinstance(theirs, dict):
+            return set()
+        merged = merge_profiles(self.profiles_base, self.profiles, theirs)
+        changed = {biz_id for biz_id, profile in merged.items() if profile != self.profiles.get(biz_id)}
+        for biz_id in changed:
+            self.profiles.setdefault(biz_id, {}).update(merged[biz_id])
+        self.profiles_base = theirs
+        return changed
 
     # --- License Management Methods ---
     def load_license_data(self):
         """Load license data from file"""
-        if os.path.exists(LICENSE_FILE):
-            try:
-                with open(LICENSE_FILE, 'r') as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
+        data = read_json_file(LICENSE_FILE, {})
+        return data if isinstance(data, dict) else {}
 
     def save_license_data(self, data):
-        """Save license data to file"""
-        with open(LICENSE_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+        """Save license data to file (written straight away, it is read back right after activation)"""
+        JSON_WRITER.save(LICENSE_FILE, data, indent=4, defer=False)
         
     def update_license_keys_file(self, license_data):
         """Update the license keys text file with all license information"""
         keys_file_path = os.path.join(DB_FOLDER, "license_keys.txt")
         
         try:
-            with open(keys_file_path, 'w') as f:
+            with atomic_file(keys_file_path, 'w', encoding='utf-8') as f:
                 f.write("TCG TECH INVOICE GENERATOR - LICENSE KEYS\n")
                 f.write("=" * 50 + "\n\n")
                 
@@ -1101,7 +4865,7 @@ class InvoiceApp(ct.CTk):
 
         # Search input
         self.search_entry = ct.CTkEntry(self.sidebar, 
-                                       placeholder_text="≡ 💡 Search by ID or Client Name...",
+                                       placeholder_text="≡ 💡 Search by ID, client, phone, item...",
                                        height=35,
                                        corner_radius=10,
                                        border_width=2,
@@ -1110,6 +4874,79 @@ class InvoiceApp(ct.CTk):
         self.search_entry.pack(fill="x", padx=15, pady=(0, 10))
         self.search_entry.bind("<KeyRelease>", self.on_search_change)
 
+        # Date range filter (dd-mm-yyyy, either end may be left empty)
+        date_range_row = ct.CTkFrame(self.sidebar, fg_color="transparent")
+        date_range_row.pack(fill="x", padx=15, pady=(0, 10))
+        self.range_from_entry = ct.CTkEntry(date_range_row, 
+                                            placeholder_text="From dd-mm-yyyy",
+                                            height=30,
+                                            corner_radius=8,
+                                            border_width=2,
+                                            border_color=("#cbd5e1", "#475569"),
+                                            font=ct.CTkFont(size=10))
+        self.range_from_entry.pack(side="left", fill="x", expand=True, padx=(0, 4))
+        self.range_from_entry.bind("<KeyRelease>", self.on_search_change)
+        self.range_to_entry = ct.CTkEntry(date_range_row, 
+                                          placeholder_text="To dd-mm-yyyy",
+                                          height=30,
+                                          corner_radius=8,
+                                          border_width=2,
+                                          border_color=("#cbd5e1", "#475569"),
+                                          font=ct.CTkFont(size=10))
+        self.range_to_entry.pack(side="left", fill="x", expand=True, padx=(4, 0))
+        self.range_to_entry.bind("<KeyRelease>", self.on_search_change)
+
+        # Business totals card (running totals, no history scan)
+        stats_card = ct.CTkFrame(self.sidebar, 
+                                 fg_color=("#f1f5f9", "#1e293b"),
+                                 corner_radius=10)
+        stats_card.pack(fill="x", padx=15, pady=(0, 5))
+        self.stats_label = ct.CTkLabel(stats_card, text="", 
+                                       justify="left",
+                                       font=ct.CTkFont(size=10),
+                                       text_color=("#1e293b", "#f1f5f9"))
+        self.stats_label.pack(anchor="w", padx=10, pady=8)
+
+        csv_row = ct.CTkFrame(self.sidebar, fg_color="transparent")
+        csv_row.pack(fill="x", padx=15, pady=(5, 0))
+        ct.CTkButton(csv_row, text="⬆ Import CSV",
+                     command=self.import_history_csv,
+                     height=30,
+                     corner_radius=8,
+                     font=ct.CTkFont(size=11, weight="bold"),
+                     fg_color=("#0ea5e9", "#0284c7"),
+                     hover_color=("#0284c7", "#0369a1")).pack(side="left", fill="x", expand=True, padx=(0, 4))
+        ct.CTkButton(csv_row, text="⬇ Export CSV",
+                     command=self.export_history_csv,
+                     height=30,
+                     corner_radius=8,
+                     font=ct.CTkFont(size=11, weight="bold"),
+                     fg_color=("#0ea5e9", "#0284c7"),
+                     hover_color=("#0284c7", "#0369a1")).pack(side="left", fill="x", expand=True, padx=(4, 0))
+        pdf_row = ct.CTkFrame(self.sidebar, fg_color="transparent")
+        pdf_row.pack(fill="x", padx=15, pady=(8, 0))
+        ct.CTkButton(pdf_row, text="🖨 Render PDFs",
+                     command=self.render_history_pdfs,
+                     height=30,
+                     corner_radius=8,
+                     font=ct.CTkFont(size=11, weight="bold"),
+                     fg_color=("#0ea5e9", "#0284c7"),
+                     hover_color=("#0284c7", "#0369a1")).pack(side="left", fill="x", expand=True, padx=(0, 4))
+        ct.CTkButton(pdf_row, text="📄 Statement",
+                     command=self.export_statement_pdf,
+                     height=30,
+                     corner_radius=8,
+                     font=ct.CTkFont(size=11, weight="bold"),
+                     fg_color=("#0ea5e9", "#0284c7"),
+                     hover_color=("#0284c7", "#0369a1")).pack(side="left", fill="x", expand=True, padx=(4, 0))
+        ct.CTkButton(self.sidebar, text="📦 Archive Old Invoices",
+                     command=self.archive_history,
+                     height=30,
+                     corner_radius=8,
+                     font=ct.CTkFont(size=11, weight="bold"),
+                     fg_color=("#64748b", "#475569"),
+                     hover_color=("#475569", "#334155")).pack(fill="x", padx=15, pady=(8, 0))
+
         # History Section with modern header
         history_header = ct.CTkFrame(self.sidebar, fg_color="transparent")
         history_header.pack(pady=(15, 8))
@@ -1120,10 +4957,14 @@ class InvoiceApp(ct.CTk):
                    font=ct.CTkFont(size=12, weight="bold"), 
                    text_color=("#475569", "#cbd5e1")).pack(side="left")
 
-        # Scrollable history list with fixed height
-        self.history_list = ct.CTkScrollableFrame(self.sidebar, 
-                                                  fg_color="transparent",
-                                                  height=280)
+        # Virtualized history list: only the cards in view are built, and they are reused on scroll
+        self.history_list = VirtualHistoryList(self.sidebar,
+                                               row_height=HISTORY_ROW_HEIGHT,
+                                               create_row=self.create_history_card,
+                                               bind_row=self.bind_history_card,
+                                               reverse=True,
+                                               fg_color="transparent",
+                                               height=280)
         self.history_list.pack(padx=15, pady=(0, 15), fill="both", expand=True)
         self.refresh_history_ui()
 
@@ -1317,6 +5158,11 @@ class InvoiceApp(ct.CTk):
         self.client_phone, self.client_phone_warning = self.create_input_with_validation_fixed(row2, "Client Phone", "", width=300)
         self.client_email, self.client_email_warning = self.create_input_with_validation_fixed(row2, "Client Email", "", width=300)
         
+        # Suggest known clients while typing the name; picking one fills in their details
+        self.client_autocomplete = AutocompleteDropdown(self.client_name,
+                                                        self.suggest_clients,
+                                                        self.fill_client_details)
+        
         # Third row - Notes (full width text area with save/edit buttons)
         row3 = ct.CTkFrame(client_frame, fg_color="transparent")
         row3.pack(fill="x", pady=(0, 15))
@@ -1462,6 +5308,11 @@ class InvoiceApp(ct.CTk):
                                      border_width=2,
                                      font=ct.CTkFont(size=13))
         self.item_desc.pack(side="left", padx=5)
+        
+        # Suggest previously sold items; picking one fills in its price and unit
+        self.item_autocomplete = AutocompleteDropdown(self.item_desc,
+                                                      self.suggest_items,
+                                                      self.fill_item_details)
 
         self.item_price = ct.CTkEntry(entry_grid, placeholder_text="Amount (Rs )", 
                                       width=150, height=45,
@@ -1762,6 +5613,7 @@ class InvoiceApp(ct.CTk):
             self.profiles[self.current_biz_id]["gst_no"] = current_gst
             self.profiles[self.current_biz_id]["watermark"] = current_watermark
             self.save_profiles()  # Commit to file so it persists
+            self.render_plans.pop(self.current_biz_id, None)
 
         # Now switch
         self.current_biz_id = biz_id
@@ -1858,6 +5710,7 @@ class InvoiceApp(ct.CTk):
                 # Update Profile
                 self.profiles[self.current_biz_id]["logo"] = dest_path
                 self.save_profiles()
+                self.render_plans.pop(self.current_biz_id, None)
                 self.display_logo(dest_path)
                 
                 # Force reload the profile to ensure logo is used
@@ -1869,13 +5722,9 @@ class InvoiceApp(ct.CTk):
 
     def validate_business_email(self, event=None):
         """Validate business email format"""
-        import re
         email = self.biz_email_entry.get().strip()
         
-        # Simple email regex pattern
-        email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        
-        if email and not re.match(email_pattern, email):
+        if email and not is_valid_email(email):
             self.biz_email_warning_label.configure(text="Invalid email format")
             self.biz_email_entry.configure(border_color="red")
         else:
@@ -1886,10 +5735,7 @@ class InvoiceApp(ct.CTk):
         """Validate phone number - should be 10 digits"""
         phone = self.biz_phone_entry.get().strip()
         
-        # Remove any non-digit characters for validation
-        digits_only = ''.join(filter(str.isdigit, phone))
-        
-        if phone and len(digits_only) != 10:
+        if phone and not is_valid_phone(phone):
             self.phone_warning_label.configure(text="Phone number must be exactly 10 digits")
             self.biz_phone_entry.configure(border_color="red")
         else:
@@ -1909,13 +5755,9 @@ class InvoiceApp(ct.CTk):
     
     def validate_client_email(self, event=None):
         """Validate client email format"""
-        import re
         email = self.client_email.get().strip()
         
-        # Simple email regex pattern
-        email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        
-        if email and not re.match(email_pattern, email):
+        if email and not is_valid_email(email):
             self.client_email_warning.configure(text="Invalid email format")
             self.client_email.configure(border_color="red")
         else:
@@ -1926,10 +5768,7 @@ class InvoiceApp(ct.CTk):
         """Validate client phone number - should be 10 digits"""
         phone = self.client_phone.get().strip()
         
-        # Remove any non-digit characters for validation
-        digits_only = ''.join(filter(str.isdigit, phone))
-        
-        if phone and len(digits_only) != 10:
+        if phone and not is_valid_phone(phone):
             self.client_phone_warning.configure(text="Phone must be 10 digits")
             self.client_phone.configure(border_color="red")
         else:
@@ -1946,18 +5785,14 @@ class InvoiceApp(ct.CTk):
         watermark = self.biz_watermark_entry.get().strip()
         
         # Validate business email
-        if email:
-            email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-            if not re.match(email_pattern, email):
-                messagebox.showerror("Validation Error", "Business email format is invalid!")
-                return
+        if email and not is_valid_email(email):
+            messagebox.showerror("Validation Error", "Business email format is invalid!")
+            return
         
         # Validate business phone number before saving
-        if phone:
-            digits_only = ''.join(filter(str.isdigit, phone))
-            if len(digits_only) != 10:
-                messagebox.showerror("Validation Error", "Business phone number must be exactly 10 digits!")
-                return
+        if phone and not is_valid_phone(phone):
+            messagebox.showerror("Validation Error", "Business phone number must be exactly 10 digits!")
+            return
         
         # Validate GST number
         if gst_no and len(gst_no) != 15:
@@ -1972,6 +5807,7 @@ class InvoiceApp(ct.CTk):
             self.profiles[self.current_biz_id]["gst_no"] = gst_no
             self.profiles[self.current_biz_id]["watermark"] = watermark
             self.save_profiles()
+            self.render_plans.pop(self.current_biz_id, None)
             
             # Update the sidebar button text immediately
             self.biz_buttons[self.current_biz_id].configure(
@@ -1991,30 +5827,7 @@ class InvoiceApp(ct.CTk):
 
     def parse_quantity(self, qty_str):
         """Parse quantity string that can be fraction (1/2, 1/4) or decimal (15.5)"""
-        qty_str = qty_str.strip()
-        if not qty_str:
-            return None, None
-        
-        # Check if it's a fraction (e.g., 1/2, 1/4, 3/4)
-        if '/' in qty_str:
-            try:
-                parts = qty_str.split('/')
-                if len(parts) == 2:
-                    numerator = float(parts[0].strip())
-                    denominator = float(parts[1].strip())
-                    if denominator != 0:
-                        decimal_value = numerator / denominator
-                        # Return both the original fraction string and decimal value
-                        return qty_str, decimal_value
-            except:
-                pass
-        
-        # Try to parse as float/decimal
-        try:
-            decimal_value = float(qty_str)
-            return qty_str, decimal_value
-        except:
-            return None, None
+        return parse_quantity(qty_str)
 
     def add_item(self):
         try:
@@ -2194,10 +6007,8 @@ class InvoiceApp(ct.CTk):
         except:
             discount_rate = 0.0
 
-        discount_amt = subtotal * (discount_rate / 100)
-        taxable_subtotal = subtotal - discount_amt
-        tax_amt = taxable_subtotal * (tax_rate / 100)
-        grand_total = taxable_subtotal + tax_amt
+        totals = invoice_totals(subtotal, discount_rate, tax_rate)
+        discount_amt, tax_amt, grand_total = totals["discount_amt"], totals["tax_amt"], totals["total"]
 
         # Modern Summary Frame
         summary_frame = ct.CTkFrame(self.table_frame, 
@@ -2253,14 +6064,7 @@ class InvoiceApp(ct.CTk):
                    text_color=self.current_theme).pack(side="right")
 
         # Save for generation
-        self.current_calc = {
-            "subtotal": subtotal,
-            "discount_rate": discount_rate,
-            "discount_amt": discount_amt,
-            "tax_rate": tax_rate,
-            "tax_amt": tax_amt,
-            "total": grand_total
-        }
+        self.current_calc = totals
 
     def save_notes_template(self):
         """Save current notes as template for future invoices"""
@@ -2306,6 +6110,59 @@ class InvoiceApp(ct.CTk):
         except:
             pass  # Silently fail if no saved notes
 
+    def suggest_clients(self, text):
+        """Autocomplete entries for the client name field"""
+        suggestions = []
+        for client in self.client_directory.suggest(self.current_biz_id, text):
+            label = client['client']
+            if client['client_phone']:
+                label += f"  ({client['client_phone']})"
+            suggestions.append((label, client))
+        return suggestions
+
+    def fill_client_details(self, client):
+        """Fill the client fields from a directory entry"""
+        for entry, field in ((self.client_name, 'client'), (self.client_email, 'client_email'),
+                             (self.client_phone, 'client_phone'), (self.client_address, 'client_address')):
+            entry.delete(0, 'end')
+            entry.insert(0, client.get(field) or '')
+
+    def suggest_items(self, text):
+        """Autocomplete entries for the item description field, most sold first"""
+        suggestions = []
+        for item in self.item_catalog.suggest(self.current_biz_id, text):
+            label = item['description']
+            if item['price_per_unit'] is not None:
+                label += f"  -  Rs {item['price_per_unit']:.2f}"
+                if item['unit']:
+                    label += f" / {item['unit']}"
+            suggestions.append((label, item))
+        return suggestions
+
+    def fill_item_details(self, item):
+        """Fill the item fields from a catalog entry and move on to the quantity (or price)"""
+        self.item_desc.delete(0, 'end')
+        self.item_desc.insert(0, item['description'])
+        self.item_price.delete(0, 'end')
+        if item['price_per_unit'] is not None:
+            self.item_price.insert(0, f"{item['price_per_unit']:g}")
+        
+        if item['unit']:
+            if not self.quantity_var.get():
+                self.quantity_var.set(True)
+                self.toggle_quantity_fields()
+            if item['unit'] in self.item_unit.cget("values"):
+                self.item_unit.set(item['unit'])
+                self.on_unit_change(item['unit'])
+            else:
+                self.item_unit.set("Custom")
+                self.on_unit_change("Custom")
+                self.item_custom_unit.delete(0, 'end')
+                self.item_custom_unit.insert(0, item['unit'])
+            self.item_quantity.focus_set()
+        else:
+            self.item_price.focus_set()
+
     def clear_form(self):
         self.items = []
         self.client_name.delete(0, 'end')
@@ -2340,19 +6197,15 @@ class InvoiceApp(ct.CTk):
             
             # Validate client email
             client_email = self.client_email.get().strip()
-            if client_email:
-                email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-                if not re.match(email_pattern, client_email):
-                    messagebox.showerror("Validation Error", "Client email format is invalid!")
-                    return
+            if client_email and not is_valid_email(client_email):
+                messagebox.showerror("Validation Error", "Client email format is invalid!")
+                return
             
             # Validate client phone
             client_phone = self.client_phone.get().strip()
-            if client_phone:
-                digits_only = ''.join(filter(str.isdigit, client_phone))
-                if len(digits_only) != 10:
-                    messagebox.showerror("Validation Error", "Client phone number must be exactly 10 digits!")
-                    return
+            if client_phone and not is_valid_phone(client_phone):
+                messagebox.showerror("Validation Error", "Client phone number must be exactly 10 digits!")
+                return
 
             self.refresh_table()
         
@@ -2417,6 +6270,8 @@ class InvoiceApp(ct.CTk):
             save_path = filedialog.asksaveasfilename(initialfile=filename, defaultextension=ext)
             if not save_path: return
 
+            self.reserve_invoice_number(data)
+
             if file_type == "pdf":
                 # Use modern style (Style 1) for all businesses
                 self.make_pdf_style_1(data, save_path)
@@ -2426,8 +6281,10 @@ class InvoiceApp(ct.CTk):
             self.save_to_history(data)
             
             # Increment invoice number after successful save
+            # (re-saving an older invoice must not move the counter backwards)
             invoice_num = int(data['id'])
-            self.profiles[self.current_biz_id]["last_invoice_num"] = invoice_num
+            last_num = self.profiles[self.current_biz_id].get("last_invoice_num", 1000)
+            self.profiles[self.current_biz_id]["last_invoice_num"] = max(invoice_num, last_num)
             self.save_profiles()
             
             # Update the invoice number field to next number
@@ -2452,19 +6309,15 @@ class InvoiceApp(ct.CTk):
             
             # Validate client email
             client_email = self.client_email.get().strip()
-            if client_email:
-                email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-                if not re.match(email_pattern, client_email):
-                    messagebox.showerror("Validation Error", "Client email format is invalid!")
-                    return
+            if client_email and not is_valid_email(client_email):
+                messagebox.showerror("Validation Error", "Client email format is invalid!")
+                return
             
             # Validate client phone
             client_phone = self.client_phone.get().strip()
-            if client_phone:
-                digits_only = ''.join(filter(str.isdigit, client_phone))
-                if len(digits_only) != 10:
-                    messagebox.showerror("Validation Error", "Client phone number must be exactly 10 digits!")
-                    return
+            if client_phone and not is_valid_phone(client_phone):
+                messagebox.showerror("Validation Error", "Client phone number must be exactly 10 digits!")
+                return
 
             self.refresh_table()
         
@@ -2525,6 +6378,8 @@ class InvoiceApp(ct.CTk):
                 "• No: Invoice will only be printed (not saved)",
                 icon='question'
             )
+            if save_response:
+                self.reserve_invoice_number(data)
 
             # Create temporary PDF file
             temp_dir = tempfile.gettempdir()
@@ -2539,8 +6394,10 @@ class InvoiceApp(ct.CTk):
                 self.save_to_history(data)
                 
                 # Increment invoice number after successful save
+                # (re-saving an older invoice must not move the counter backwards)
                 invoice_num = int(data['id'])
-                self.profiles[self.current_biz_id]["last_invoice_num"] = invoice_num
+                last_num = self.profiles[self.current_biz_id].get("last_invoice_num", 1000)
+                self.profiles[self.current_biz_id]["last_invoice_num"] = max(invoice_num, last_num)
                 self.save_profiles()
                 
                 # Update the invoice number field to next number
@@ -2805,101 +6662,66 @@ class InvoiceApp(ct.CTk):
         print(f"PDF Generation: Starting make_pdf_style_1")
         
         # Debug: Print all data to see what might contain Unicode
-        print(f"DEBUG - Business name: {repr(data.get('biz_name', ''))}")
         print(f"DEBUG - Client name: {repr(data.get('client_name', ''))}")
         print(f"DEBUG - Items count: {len(data.get('items', []))}")
         if data.get('items'):
             for i, item in enumerate(data['items'][:2]):  # Show first 2 items
                 print(f"DEBUG - Item {i}: {repr(item.get('desc', ''))}")
         
-        # Sanitize only text fields (not the entire data dict to preserve other types)
-        text_fields = ['biz_name', 'biz_addr', 'biz_email', 'biz_phone', 'biz_gst_no', 
-                       'client_name', 'client_email', 'client_phone', 'client_address',
-                       'id', 'date', 'due_date', 'watermark']
+        plan = self.render_plan(data)
+        self.sanitize_invoice_text(data, plan.sanitize)
+
+        pdf = plan.new_document()
+        pdf.add_page()
+        self.draw_pdf_style_1(pdf, plan, data)
+        pdf.output(path)
+
+    def sanitize_invoice_text(self, data, sanitize=None):
+        """Sanitize an invoice's own text fields for the PDF font (the business's are sanitized in its render plan)"""
+        sanitize = sanitize or self.sanitize_text
+        text_fields = ['client_name', 'client_email', 'client_phone', 'client_address',
+                       'client_notes', 'id', 'date', 'due_date']
         for field in text_fields:
             if field in data and isinstance(data[field], str):
                 original = data[field]
-                data[field] = self.sanitize_text(data[field])
+                data[field] = sanitize(data[field])
                 if original != data[field]:
                     print(f"DEBUG - Sanitized {field}: {repr(original)} -> {repr(data[field])}")
-        
+
         # Sanitize items
         if 'items' in data:
             for i, item in enumerate(data['items']):
                 if 'desc' in item and isinstance(item['desc'], str):
                     original = item['desc']
-                    item['desc'] = self.sanitize_text(item['desc'])
+                    item['desc'] = sanitize(item['desc'])
                     if original != item['desc']:
                         print(f"DEBUG - Sanitized item {i} desc: {repr(original)} -> {repr(item['desc'])}")
                 if 'unit' in item and isinstance(item['unit'], str):
-                    item['unit'] = self.sanitize_text(item['unit'])
-        
-        print(f"PDF Generation: All text sanitized for ASCII compatibility")
-        
-        pdf = FPDF()
-        pdf.add_page()
-        
-        # COMPLETELY AVOID UNICODE - Use only ASCII characters
-        font_name = 'Arial'
-        rupee = 'Rs.'  # ASCII-safe only
-        
-        print("PDF Generation: Using ASCII-only approach to avoid encoding errors")
-
-        # Color helper
-        hex_color = data['biz_color'].lstrip('#')
-        r, g, b = tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+                    item['unit'] = sanitize(item['unit'])
 
-        # Logo at absolute top left corner - moderate size
-        if data['biz_logo'] and os.path.exists(data['biz_logo']):
-            try:
-                logo_path = data['biz_logo']
-                # Convert PNG to JPG if needed
-                if logo_path.lower().endswith('.png'):
-                    from PIL import Image
-                    img = Image.open(logo_path)
-                    if img.mode == 'RGBA':
-                        img = img.convert('RGB')
-                    jpeg_path = logo_path.replace('.png', '_temp.jpg')
-                    img.save(jpeg_path, 'JPEG')
-                    logo_path = jpeg_path
-                # Size: 50mm width, Position: very top (y=3) and left (x=5)
-                pdf.image(logo_path, 5, 3, 50)
-            except Exception as e:
-                print(f"Logo load failed: {e}")
-                # Continue without logo
+        print(f"PDF Generation: All text sanitized for the PDF font")
 
-        pdf.set_font(font_name, 'B', 28)
-        pdf.set_text_color(r, g, b)
-        pdf.cell(0, 15, "INVOICE", 0, 1, 'R')
+    def draw_pdf_style_1(self, pdf, plan, data):
+        """Lay out one Style 1 invoice, starting on the document's current page"""
+        currency = plan.currency
+        r, g, b = plan.color
 
-        pdf.set_font(font_name, '', 12)
-        pdf.set_text_color(100)
-        if data.get('biz_gst_no'):
-            pdf.cell(0, 6, f"GST No: {data['biz_gst_no']}", 0, 1, 'R')
+        # Logo, title and GST number come from the business's compiled render plan
+        plan.draw_header(pdf)
         pdf.cell(0, 6, f"#{data['id']}", 0, 1, 'R')
         
         pdf.ln(10)
 
         # Info Blocks - FROM section
-        pdf.set_text_color(0)
-        pdf.set_font(font_name, 'B', 13)
-        pdf.cell(0, 8, "FROM:", 0, 1)
-
-        pdf.set_font(font_name, '', 12)
-        from_info = f"{data['biz_name']}\n{data['biz_addr']}"
-        if data['biz_email']:
-            from_info += f"\n{data['biz_email']}"
-        if data['biz_phone']:
-            from_info += f"\n{data['biz_phone']}"
-        pdf.multi_cell(0, 6, from_info)
+        plan.draw_from(pdf)
         
         pdf.ln(5)
         
         # TO section below FROM
-        pdf.set_font(font_name, 'B', 13)
+        plan.set_font(pdf, 'B', 13)
         pdf.cell(0, 8, "TO:", 0, 1)
         
-        pdf.set_font(font_name, '', 12)
+        plan.set_font(pdf, '', 12)
         client_info = f"{data['client_name']}"
         if data.get('client_address'):
             client_info += f"\n{data['client_address']}"
@@ -2911,7 +6733,7 @@ class InvoiceApp(ct.CTk):
         pdf.ln(10)
 
         # Add Date and Due Date on right side above table
-        pdf.set_font(font_name, '', 11)
+        plan.set_font(pdf, '', 11)
         pdf.set_text_color(0)
         pdf.cell(0, 6, f"Date: {data['date']}", 0, 1, 'R')
         
@@ -2921,9 +6743,9 @@ class InvoiceApp(ct.CTk):
                 pdf.cell(0, 6, f"Due Date: {data['due_date']}", 0, 1, 'R')
             if data.get('is_pending'):
                 pdf.set_text_color(255, 0, 0)  # Red color
-                pdf.set_font(font_name, 'B', 11)
+                plan.set_font(pdf, 'B', 11)
                 pdf.cell(0, 6, "PENDING", 0, 1, 'R')
-                pdf.set_font(font_name, '', 11)
+                plan.set_font(pdf, '', 11)
                 pdf.set_text_color(0)
         
         pdf.ln(5)
@@ -2932,20 +6754,11 @@ class InvoiceApp(ct.CTk):
         has_quantity = any(item.get('quantity') is not None for item in data['items'])
 
         # Table with borders
-        pdf.set_fill_color(r, g, b)
-        pdf.set_text_color(255)
-        pdf.set_font(font_name, 'B', 12)
-        if has_quantity:
-            pdf.cell(90, 10, " Description", 1, 0, 'L', True)
-            pdf.cell(50, 10, " Quantity", 1, 0, 'C', True)
-            pdf.cell(50, 10, " Price (Rs.)", 1, 1, 'R', True)
-        else:
-            pdf.cell(140, 10, " Description", 1, 0, 'L', True)
-            pdf.cell(50, 10, " Price (Rs.)", 1, 1, 'R', True)
+        plan.draw_table_header(pdf, has_quantity)
 
         # Items with borders
         pdf.set_text_color(0)
-        pdf.set_font(font_name, '', 11)
+        plan.set_font(pdf, '', 11)
         pdf.set_fill_color(245, 245, 245)
         fill = False
         for item in data['items']:
@@ -2955,55 +6768,91 @@ class InvoiceApp(ct.CTk):
                 if item.get('quantity') is not None:
                     qty_text = f"{item['quantity']} {item.get('unit', '')}"
                 pdf.cell(50, 10, qty_text, 1, 0, 'C', fill)
-                pdf.cell(50, 10, f"Rs. {item['price']:.2f} ", 1, 1, 'R', fill)
+                pdf.cell(50, 10, f"{currency} {item['price']:.2f} ", 1, 1, 'R', fill)
             else:
                 pdf.cell(140, 10, f" {item['desc']}", 1, 0, 'L', fill)
-                pdf.cell(50, 10, f"Rs. {item['price']:.2f} ", 1, 1, 'R', fill)
+                pdf.cell(50, 10, f"{currency} {item['price']:.2f} ", 1, 1, 'R', fill)
             fill = not fill
 
         # Total section WITHOUT borders
         pdf.ln(5)
         pdf.set_text_color(0)
-        pdf.set_font(font_name, '', 11)
+        plan.set_font(pdf, '', 11)
         pdf.cell(140, 8, "Subtotal", 0, 0, 'R')
-        pdf.cell(50, 8, f"Rs. {data['subtotal']:.2f}", 0, 1, 'R')
+        pdf.cell(50, 8, f"{currency} {data['subtotal']:.2f}", 0, 1, 'R')
         
         pdf.cell(140, 8, f"Discount ({data['discount_rate']}%)", 0, 0, 'R')
-        pdf.cell(50, 8, f"Rs. {data['discount_amt']:.2f}", 0, 1, 'R')
+        pdf.cell(50, 8, f"{currency} {data['discount_amt']:.2f}", 0, 1, 'R')
 
         pdf.cell(140, 8, f"Tax(GST) ({data['tax_rate']}%)", 0, 0, 'R')
-        pdf.cell(50, 8, f"Rs. {data['tax_amt']:.2f}", 0, 1, 'R')
+        pdf.cell(50, 8, f"{currency} {data['tax_amt']:.2f}", 0, 1, 'R')
 
         pdf.set_text_color(r, g, b)
-        pdf.set_font(font_name, 'B', 14)
+        plan.set_font(pdf, 'B', 14)
         pdf.cell(140, 10, "GRAND TOTAL", 0, 0, 'R')
-        pdf.cell(50, 10, f"Rs. {data['total']:.2f}", 0, 1, 'R')
+        pdf.cell(50, 10, f"{currency} {data['total']:.2f}", 0, 1, 'R')
 
         # Add notes below table on left side if exists
         if data.get('client_notes') and data['client_notes'].strip():
             pdf.ln(10)
-            pdf.set_font(font_name, 'B', 12)
+            plan.set_font(pdf, 'B', 12)
             pdf.set_text_color(0)
             pdf.cell(0, 8, "Notes:", 0, 1, 'L')
-            pdf.set_font(font_name, '', 11)
+            plan.set_font(pdf, '', 11)
             pdf.multi_cell(0, 6, data['client_notes'])
 
         # Add watermark slightly lower on the page if exists
-        if data.get('biz_watermark') and data['biz_watermark'].strip():
-            try:
-                # Add some space and place watermark (don't use absolute positioning)
-                pdf.ln(15)
-                pdf.set_font('Arial', 'I', 10)
-                pdf.set_text_color(150, 150, 150)
-                # Convert to ASCII, replacing non-ASCII characters
-                watermark_text = data['biz_watermark'].encode('ascii', 'ignore').decode('ascii')
-                if watermark_text:
-                    pdf.cell(0, 10, watermark_text, 0, 0, 'C')
-            except Exception as e:
-                print(f"Watermark error: {e}")
-                # Skip watermark if any error occurs
-
-        pdf.output(path)
+        try:
+            plan.draw_watermark(pdf)
+        except Exception as e:
+            print(f"Watermark error: {e}")
+            # Skip watermark if any error occurs
+
+    def make_pdf_statement(self, invoices, path, plan, total=None, progress=None, cancelled=None):
+        """Style 1 invoices of one business one after another in a single PDF, each on a new page
+
+        invoices yields PDF data (see invoice_pdf_data) and is read one invoice at a time. plan is
+        the business's render plan, built by the caller on the Tk thread (render_plans is only
+        touched there), so this can run on a worker thread. The document embeds the font subset
+        and logo once, however many invoices use them. Returns the number of invoices written;
+        nothing is written if cancelled is set before the end (JobCancelled is raised) or there
+        are no invoices.
+        """
+        pdf = None
+        count = 0
+        for data in invoices:
+            if cancelled is not None and cancelled.is_set():
+                raise JobCancelled()
+            self.sanitize_invoice_text(data, plan.sanitize)
+            if pdf is None:
+                pdf = plan.new_document()
+                pdf.buffer = PdfBuffer()
+            pdf.add_page()
+            self.draw_pdf_style_1(pdf, plan, data)
+            count += 1
+            if progress and count % EXPORT_PROGRESS_EVERY == 0:
+                progress(count, total)
+        if pdf is None:
+            return 0
+        if progress:
+            progress(count, total, "Writing statement...")
+        pdf.close()
+        with atomic_file(path) as f:
+            f.write(pdf.buffer.getvalue().encode('latin-1'))
+        return count
+
+    def render_plan(self, data):
+        """Compiled static layer for the business an invoice belongs to
+
+        Built on first use and rebuilt whenever the profile fields it was compiled from change.
+        """
+        biz_id = data.get('biz_id') or self.current_biz_id
+        plan = self.render_plans.get(biz_id)
+        if plan is None or plan.key != PdfRenderPlan.profile_key(data):
+            plan = PdfRenderPlan(data, self.sanitize_text, self.logo_cache,
+                                 self.pdf_fonts, self.get_rupee_symbol())
+            self.render_plans[biz_id] = plan
+        return plan
 
     def make_pdf_style_2(self, data, path):
         """ Style 2: Nature/Classic - Centered, Green Theme """
@@ -3032,17 +6881,9 @@ class InvoiceApp(ct.CTk):
         pdf.rect(0, 0, 210, 40, 'F')
 
         # Logo Centered on left side - only if exists
-        if data['biz_logo'] and os.path.exists(data['biz_logo']):
+        logo_path = self.logo_cache.get(data['biz_logo'])
+        if logo_path:
             try:
-                logo_path = data['biz_logo']
-                if logo_path.lower().endswith('.png'):
-                    from PIL import Image
-                    img = Image.open(logo_path)
-                    if img.mode == 'RGBA':
-                        img = img.convert('RGB')
-                    jpeg_path = logo_path.replace('.png', '_temp.jpg')
-                    img.save(jpeg_path, 'JPEG')
-                    logo_path = jpeg_path
                 pdf.image(logo_path, 15, 5, 35)
             except Exception as e:
                 print(f"Logo load failed: {e}")
@@ -3145,17 +6986,9 @@ class InvoiceApp(ct.CTk):
         pdf.rect(5, 5, 200, 50)
 
         # Logo on left side - only if exists
-        if data['biz_logo'] and os.path.exists(data['biz_logo']):
+        logo_path = self.logo_cache.get(data['biz_logo'])
+        if logo_path:
             try:
-                logo_path = data['biz_logo']
-                if logo_path.lower().endswith('.png'):
-                    from PIL import Image
-                    img = Image.open(logo_path)
-                    if img.mode == 'RGBA':
-                        img = img.convert('RGB')
-                    jpeg_path = logo_path.replace('.png', '_temp.jpg')
-                    img.save(jpeg_path, 'JPEG')
-                    logo_path = jpeg_path
                 pdf.image(logo_path, 10, 10, 30)
             except Exception as e:
                 print(f"Logo load failed: {e}")
@@ -3262,17 +7095,9 @@ class InvoiceApp(ct.CTk):
         pdf.ln(10)
 
         # Logo - only if exists
-        if data['biz_logo'] and os.path.exists(data['biz_logo']):
+        logo_path = self.logo_cache.get(data['biz_logo'])
+        if logo_path:
             try:
-                logo_path = data['biz_logo']
-                if logo_path.lower().endswith('.png'):
-                    from PIL import Image
-                    img = Image.open(logo_path)
-                    if img.mode == 'RGBA':
-                        img = img.convert('RGB')
-                    jpeg_path = logo_path.replace('.png', '_temp.jpg')
-                    img.save(jpeg_path, 'JPEG')
-                    logo_path = jpeg_path
                 pdf.image(logo_path, 20, 15, 25)
                 pdf.ln(25)
             except Exception as e:
@@ -3532,55 +7357,505 @@ class InvoiceApp(ct.CTk):
             "tax_amt": data['tax_amt'],
             "date": data['date'],
             "due_date": data['due_date'],
+            "date_ord": date_ordinal(data['date']),
+            "due_date_ord": date_ordinal(data['due_date']),
+            "is_pending": bool(data.get('is_pending')),
+            "client_notes": data.get('client_notes', ''),
             "biz_id": self.current_biz_id
         }
         
-        # Add to current business history
-        if self.current_biz_id not in self.history:
-            self.history[self.current_biz_id] = []
-        
-        self.history[self.current_biz_id].append(history_item)
-        
         # Store unlimited invoices - no limit removed
         # Keep all invoices for unlimited storage
         
-        # Save to file
-        with open(HISTORY_FILE, 'w') as f:
-            json.dump(self.history, f, indent=4)
-        
-        self.refresh_history_ui()
+        with self.db_lock:
+            # Catch up with other instances first, then make sure the business's summaries are
+            # loaded so the store can add this one to them
+            self.sync_shared_changes()
+            current_history = self.get_business_history(self.current_biz_id)
+            
+            # Save to the history store; re-saving a loaded invoice replaces it instead of duplicating it
+            row = current_history.row_of(history_item['id'])
+            if row is None:
+                self.history_store.insert(self.current_biz_id, history_item)
+            else:
+                self.history_store.update(self.current_biz_id, history_item)
+        self.search_index.add(self.current_biz_id, history_item)
+        self.client_directory.record(self.current_biz_id, history_item)
+        self.item_catalog.record(self.current_biz_id, history_item['items'])
+        
+        # Only touch the affected card; redraw the whole list when a search is active
+        if not self.history_list_is_live():
+            self.refresh_history_ui()
+        elif row is None:
+            self.history_list.rows_inserted(0)
+        else:
+            self.history_list.row_changed(len(current_history) - 1 - row)
+        self.refresh_history_stats()
+
+    def sync_shared_changes(self):
+        """Pick up profile and history changes other instances sharing DB_FOLDER saved, and show them
+
+        Only the businesses and invoices they touched are updated; nothing is re-read otherwise.
+        """
+        next_number = self.get_next_invoice_number() if hasattr(self, 'invoice_num') else None
+        changed_profiles = self.refresh_profiles()
+        for biz_id in changed_profiles:
+            self.render_plans.pop(biz_id, None)
+        changed_history = self.history_store.poll_changes()
+        for biz_id in changed_history:
+            if biz_id in self.history:
+                # Same InvoiceIndex unless the store had to reload it
+                self.history[biz_id] = self.history_store.load_business(biz_id)
+            self.client_directory.forget(biz_id)
+            self.item_catalog.forget(biz_id)
+            self.invoice_archive.forget(biz_id)
+
+        if not hasattr(self, 'history_list'):
+            return
+        for biz_id in changed_profiles:
+            if biz_id in self.biz_buttons:
+                self.biz_buttons[biz_id].configure(text=f"{self.profiles[biz_id]['name']}")
+        if self.current_biz_id in changed_profiles and self.invoice_num.get() == next_number:
+            # Another counter used the number we were offering; offer the next free one
+            self.invoice_num.delete(0, 'end')
+            self.invoice_num.insert(0, self.get_next_invoice_number())
+        if self.current_biz_id in changed_history:
+            self.refresh_history_ui()
+
+    def poll_shared_changes(self):
+        """Check for other instances' changes every SHARED_POLL_MS (runs on the Tk thread)"""
+        try:
+            self.sync_shared_changes()
+        except Exception as e:
+            print(f"Could not pick up changes from other instances: {e}")
+        self.after(SHARED_POLL_MS, self.poll_shared_changes)
+
+    def reserve_invoice_number(self, data):
+        """Claim data['id'] before the invoice is written, renumbering it if another counter took it
+
+        A number counts as taken when, since this form showed it, another instance saved an
+        invoice with it or moved last_invoice_num past it. The claim is written to profiles.json
+        straight away so the other counters move on to the next number.
+        """
+        biz_id = self.current_biz_id
+        invoice_id = str(data['id'])
+        with self.db_lock:
+            known_last = self.profiles[biz_id].get("last_invoice_num", 1000)
+            known = self.get_business_history(biz_id).get(invoice_id) is not None
+            self.sync_shared_changes()
+            current_history = self.get_business_history(biz_id)
+            last_num = self.profiles[biz_id].get("last_invoice_num", 1000)
+            taken = not known and (current_history.get(invoice_id) is not None
+                                   or (invoice_id.isdigit() and known_last < int(invoice_id) <= last_num))
+            if taken:
+                new_num = last_num + 1
+                while current_history.get(str(new_num)) is not None:
+                    new_num += 1
+                data['id'] = str(new_num)
+            if str(data['id']).isdigit() and int(data['id']) > last_num:
+                self.profiles[biz_id]["last_invoice_num"] = int(data['id'])
+                self.save_profiles()
+                JSON_WRITER.flush()
+        if taken:
+            self.invoice_num.delete(0, 'end')
+            self.invoice_num.insert(0, data['id'])
+            messagebox.showinfo("Invoice Number Changed",
+                                f"Invoice #{invoice_id} was already used on another computer.\n\n"
+                                f"This invoice will be saved as #{data['id']}.")
+        return data['id']
+
+    def open_history_store(self):
+        """Open the history backend selected by HISTORY_BACKEND"""
+        if HISTORY_BACKEND == "journal":
+            return JournalHistoryStore(HISTORY_SHARD_FOLDER, shared_lock=self.db_lock)
+        return SQLiteHistoryStore(HISTORY_DB_FILE, HISTORY_SHARD_FOLDER)
 
     def load_history(self):
-        if os.path.exists(HISTORY_FILE):
+        """Migrate an old history.json (or another backend's history) on first start; businesses are loaded lazily
+
+        The old file is streamed once, and the search index, client directory and item catalog
+        are built from that same stream, so the whole history is never held in memory.
+        """
+        with self.db_lock:
+            if self.history_store.needs_migration(HISTORY_FILE, HISTORY_JOURNAL_FILE):
+                try:
+                    with self.index_builders(list(DEFAULT_PROFILES)) as feed:
+                        self.history_store.migrate_from_json(HISTORY_FILE, HISTORY_JOURNAL_FILE, on_record=feed)
+                except Exception as e:
+                    print(f"History migration skipped, could not read the old history: {e}")
+        return {}
+
+    @contextmanager
+    def index_builders(self, biz_ids, search=True, clients=True, items=True):
+        """Rebuild the chosen indexes of some businesses in a single pass over their invoices
+
+        Yields feed(biz_id, record), which hands one invoice to every builder, or None if no
+        index was chosen. Nothing is committed if the block raises. With no biz_ids nothing is
+        cleared and the fed invoices are added to the existing indexes.
+        """
+        with ExitStack() as stack:
+            builders = []
+            if search:
+                builders.append(stack.enter_context(self.search_index.rebuilding(biz_ids)))
+            if clients:
+                builders.append(stack.enter_context(self.client_directory.building(biz_ids)))
+            if items:
+                builders.append(stack.enter_context(self.item_catalog.building(biz_ids)))
+
+            def feed(biz_id, record):
+                for add in builders:
+                    add(biz_id, record)
+
+            yield feed if builders else None
+
+    def get_business_history(self, biz_id):
+        """Invoice summaries of one business, loaded the first time they are needed
+
+        Only id, client, total and dates are kept in memory; use get_full_invoice for the items.
+        """
+        if biz_id not in self.history:
+            self.history[biz_id] = self.history_store.load_business(biz_id)
+            if ARCHIVE_AUTOMATICALLY:
+                self.archive_old_invoices(biz_id)
+            invoice_count = len(self.history[biz_id]) + len(self.invoice_archive.summaries(biz_id))
+            # Whatever needs (re)building is filled from one pass over the invoices
+            with self.index_builders([biz_id],
+                                     search=not self.search_index.is_synced(biz_id, invoice_count),
+                                     clients=not self.client_directory.is_built(biz_id),
+                                     items=not self.item_catalog.is_built(biz_id)) as feed:
+                if feed:
+                    for record in self.iter_all_invoices(biz_id):
+                        feed(biz_id, record)
+        return self.history[biz_id]
+
+    def iter_all_invoices(self, biz_id):
+        """Full records of a business's archived and live invoices, one at a time"""
+        yield from self.invoice_archive.iter_invoices(biz_id)
+        yield from self.history_store.iter_invoices(biz_id)
+
+    def iter_export_invoices(self, biz_ids):
+        """Pipeline source for exports: (biz_id, record) of every invoice of the given businesses"""
+        for biz_id in biz_ids:
+            for record in self.iter_all_invoices(biz_id):
+                yield biz_id, record
+
+    def export_history_csv(self):
+        """Export the current business's history (or every business's) for the accountant
+
+        Writes <name>_invoices.csv (one row per invoice) and <name>_items.csv (one row per line
+        item), streamed from a background thread so the window stays responsive.
+        """
+        profile = self.profiles[self.current_biz_id]
+        scope = messagebox.askyesnocancel(
+            "Export CSV",
+            f"Export only {profile['name']}?\n\nYes: this business\nNo: all businesses")
+        if scope is None:
+            return
+        biz_ids = [self.current_biz_id] if scope else list(self.profiles)
+        name = profile['name'].replace(' ', '') if scope else "AllBusinesses"
+        save_path = filedialog.asksaveasfilename(initialfile=f"{name}_invoices.csv", defaultextension=".csv",
+                                                 filetypes=[("CSV files", "*.csv")])
+        if not save_path:
+            return
+        base = os.path.splitext(save_path)[0]
+        if base.endswith("_invoices"):
+            base = base[:-len("_invoices")]
+        invoice_path, item_path = base + "_invoices.csv", base + "_items.csv"
+
+        # Loading (and archiving) happens here on the Tk thread; the worker only reads
+        total = sum(len(self.get_business_history(biz_id)) + len(self.invoice_archive.summaries(biz_id))
+                    for biz_id in biz_ids)
+
+        def on_done(count, error):
+            if isinstance(error, JobCancelled):
+                messagebox.showinfo("Export Cancelled", "The export was cancelled; no files were written.")
+            elif error:
+                messagebox.showerror("Export Failed", f"Could not export invoices:\n{error}")
+            else:
+                messagebox.showinfo("Export Complete",
+                                    f"Exported {count} invoices to:\n{invoice_path}\n{item_path}")
+
+        dialog = ProgressDialog(self, "Export CSV", "Exporting invoices...")
+        dialog.run(lambda d: export_history_csv(self.iter_export_invoices(biz_ids), invoice_path, item_path,
+                                                total, d.report, d.cancelled),
+                   on_done)
+
+    def render_history_pdfs(self):
+        """Re-render the PDFs of past invoices into a folder, on every CPU core
+
+        Renders the invoices the history sidebar shows (the current business's, narrowed by the
+        search and date filter if either is set) or the business's whole history. The records
+        are read on a background thread and rendered on a pool of worker processes.
+        """
+        biz_id = self.current_biz_id
+        profile = dict(self.profiles[biz_id])
+        scope = self.history_scope("Render PDFs", "Render")
+        if scope is None:
+            return
+        selected, total = scope
+        folder = filedialog.askdirectory(title="Save the PDFs in")
+        if not folder:
+            return
+
+        # Fonts and logo are prepared once here; the workers read them from the caches
+        self.pdf_fonts.loaded()
+        self.logo_cache.get(profile['logo'])
+        prefix = profile['name'].replace(' ', '')
+
+        def jobs():
+            for record in self.iter_history_scope(biz_id, selected):
+                yield (invoice_pdf_data(record, profile, biz_id),
+                       os.path.join(folder, f"{prefix}_Inv{record['id']}.pdf"))
+
+        def on_done(result, error):
+            if isinstance(error, JobCancelled):
+                messagebox.showinfo("Rendering Cancelled",
+                                    "Rendering was cancelled; the PDFs already written were kept.")
+            elif error:
+                messagebox.showerror("Rendering Failed", f"Could not render invoices:\n{error}")
+            else:
+                rendered, failures = result
+                message = f"Rendered {rendered} invoices to:\n{folder}"
+                if failures:
+                    listed = "\n".join(f"#{invoice_id}: {reason}" for invoice_id, reason in failures[:10])
+                    message += f"\n\n{len(failures)} could not be rendered:\n{listed}"
+                messagebox.showinfo("Rendering Complete", message)
+
+        dialog = ProgressDialog(self, "Render PDFs", "Rendering invoices...")
+        dialog.run(lambda d: render_history_pdfs(jobs(), total, d.report, d.cancelled,
+                                                 logo_paths=[profile['logo']]),
+                   on_done)
+
+    def export_statement_pdf(self):
+        """Save a month-end statement: many invoices of the current business in one PDF
+
+        Takes the invoices the history sidebar shows (e.g. a client's, found by searching for
+        them, within a date range) or the business's whole history, in the order they were saved.
+        """
+        biz_id = self.current_biz_id
+        profile = dict(self.profiles[biz_id])
+        scope = self.history_scope("Statement PDF", "Put")
+        if scope is None:
+            return
+        selected, total = scope
+        name = profile['name'].replace(' ', '')
+        save_path = filedialog.asksaveasfilename(initialfile=f"{name}_Statement.pdf", defaultextension=".pdf",
+                                                 filetypes=[("PDF files", "*.pdf")])
+        if not save_path:
+            return
+
+        def on_done(count, error):
+            if isinstance(error, JobCancelled):
+                messagebox.showinfo("Statement Cancelled", "The statement was cancelled; no file was written.")
+            elif error:
+                messagebox.showerror("Statement Failed", f"Could not create the statement:\n{error}")
+            else:
+                messagebox.showinfo("Statement Saved", f"Saved {count} invoices in one PDF:\n{save_path}")
+
+        plan = self.render_plan(profile_pdf_data(profile, biz_id))
+        invoices = (invoice_pdf_data(record, profile, biz_id)
+                    for record in self.iter_history_scope(biz_id, selected))
+        dialog = ProgressDialog(self, "Statement PDF", "Adding invoices...")
+        dialog.run(lambda d: self.make_pdf_statement(invoices, save_path, plan, total, d.report, d.cancelled),
+                   on_done)
+
+    def history_scope(self, title, verb):
+        """Ask which invoices a batch job covers: (summaries, count), summaries None for the whole history
+
+        When the sidebar is narrowed by a search or date filter, the user picks between the
+        invoices it shows and the current business's whole history. None if cancelled or empty.
+        """
+        biz_id = self.current_biz_id
+        total = len(self.get_business_history(biz_id)) + len(self.invoice_archive.summaries(biz_id))
+        selected = None
+        if not self.history_list_is_live():
+            shown = self.history_list.items
+            scope = messagebox.askyesnocancel(
+                title,
+                f"{verb} the {len(shown)} invoices shown in the history list?\n\n"
+                f"Yes: shown invoices\nNo: all {total} invoices of {self.profiles[biz_id]['name']}")
+            if scope is None:
+                return None
+            if scope:
+                selected = list(shown)
+                total = len(selected)
+        if not total:
+            messagebox.showinfo(title, "There are no invoices to include.")
+            return None
+        return selected, total
+
+    def iter_history_scope(self, biz_id, selected):
+        """Full records of a business's selected invoices (summaries from history_scope; all if None)
+
+        Only the selected invoices are read from disk, archived ones first, each in the order shown.
+        """
+        if selected is None:
+            yield from self.iter_all_invoices(biz_id)
+            return
+        yield from self.invoice_archive.iter_records(biz_id, [summary for summary in selected if 'archive' in summary])
+        yield from self.history_store.iter_records(biz_id, [summary for summary in selected if 'archive' not in summary])
+
+    def import_history_csv(self):
+        """Bulk-import invoices from another billing tool (same two-file layout as Export CSV)
+
+        Both files are validated in batches on a worker thread; the valid invoices are then saved
+        in one transaction and rejected rows are listed in <name>_import_errors.csv.
+        """
+        invoice_path = filedialog.askopenfilename(title="Select the invoices CSV",
+                                                  filetypes=[("CSV files", "*.csv")])
+        if not invoice_path:
+            return
+        base = os.path.splitext(invoice_path)[0]
+        if base.endswith("_invoices"):
+            base = base[:-len("_invoices")]
+        item_path = base + "_items.csv"
+        if not os.path.exists(item_path):
+            item_path = filedialog.askopenfilename(title="Select the line items CSV",
+                                                   filetypes=[("CSV files", "*.csv")])
+            if not item_path:
+                return
+        error_path = base + "_import_errors.csv"
+
+        # Numbers already used (live or archived) are rejected during validation
+        with self.db_lock:
+            self.sync_shared_changes()
+            existing_ids = set()
+            for biz_id in self.profiles:
+                for summary in itertools.chain(self.get_business_history(biz_id),
+                                               self.invoice_archive.summaries(biz_id)):
+                    existing_ids.add((biz_id, str(summary['id'])))
+        businesses = {biz_id: profile['name'] for biz_id, profile in self.profiles.items()}
+        importer = InvoiceCsvImport(invoice_path, item_path, businesses, self.current_biz_id, existing_ids)
+
+        def on_done(result, error):
             try:
-                with open(HISTORY_FILE, 'r') as f:
-                    data = json.load(f)
-                    # Ensure it's a dictionary with business IDs as keys
-                    if isinstance(data, dict):
-                        return data
-                    # Convert old list format to new dict format
-                    elif isinstance(data, list):
-                        # Migrate old format to new format
-                        new_format = {
-                            "biz_1": [],
-                            "biz_2": [],
-                            "biz_3": [],
-                            "biz_4": []
-                        }
-                        # Try to assign old invoices to businesses based on biz_id if available
-                        for item in data:
-                            biz_id = item.get('biz_id', 'biz_1')
-                            if biz_id in new_format:
-                                new_format[biz_id].append(item)
-                        return new_format
-                    else:
-                        return {"biz_1": [], "biz_2": [], "biz_3": [], "biz_4": []}
-            except:
-                return {"biz_1": [], "biz_2": [], "biz_3": [], "biz_4": []}
-        return {"biz_1": [], "biz_2": [], "biz_3": [], "biz_4": []}
+                if isinstance(error, JobCancelled):
+                    messagebox.showinfo("Import Cancelled", "The import was cancelled; nothing was saved.")
+                    return
+                if error:
+                    messagebox.showerror("Import Failed", f"Could not import the CSV files:\n{error}")
+                    return
+                valid, errors = result
+                if errors:
+                    importer.write_error_report(error_path)
+                    if valid and not messagebox.askyesno(
+                            "Import CSV",
+                            f"{valid} invoices are valid and {errors} rows have errors, listed in:\n"
+                            f"{error_path}\n\nImport the valid invoices now?"):
+                        return
+                saved = self.commit_import(importer) if valid else 0
+                message = f"Imported {saved} invoices."
+                if errors:
+                    message += f"\n\n{errors} rows had errors, listed in:\n{error_path}"
+                messagebox.showinfo("Import Complete", message)
+            finally:
+                importer.close()
+
+        dialog = ProgressDialog(self, "Import CSV", "Checking line items...")
+        dialog.run(lambda d: importer.run(d.report, d.cancelled), on_done)
+
+    def commit_import(self, importer):
+        """Save an import's valid invoices in one transaction; returns how many were saved
+
+        The search index, client directory and item catalog are fed in the same pass, and each
+        business's invoice numbering moves past the highest imported number.
+        """
+        next_number = self.get_next_invoice_number() if hasattr(self, 'invoice_num') else None
+        last_nums = {}  # biz_id -> highest numeric invoice id imported
+
+        def note(biz_id, record):
+            feed(biz_id, record)
+            if str(record['id']).isdigit():
+                last_nums[biz_id] = max(last_nums.get(biz_id, 0), int(record['id']))
+            else:
+                last_nums.setdefault(biz_id, 0)
+
+        with self.db_lock:
+            self.sync_shared_changes()
+            with self.index_builders(()) as feed:
+                # Skip anything another instance saved under the same number since validation
+                saved = self.history_store.import_invoices(
+                    ((biz_id, record) for biz_id, record in importer.valid_invoices()
+                     if record['id'] not in self.get_business_history(biz_id)),
+                    on_record=note)
+            for biz_id, last_num in last_nums.items():
+                self.client_directory.forget(biz_id)
+                self.item_catalog.forget(biz_id)
+                if last_num > self.profiles[biz_id].get("last_invoice_num", 0):
+                    self.profiles[biz_id]["last_invoice_num"] = last_num
+            self.save_profiles()
+            JSON_WRITER.flush()
+            if ARCHIVE_AUTOMATICALLY:
+                for biz_id in last_nums:
+                    self.archive_old_invoices(biz_id)
+
+        if next_number is not None and self.invoice_num.get() == next_number:
+            self.invoice_num.delete(0, 'end')
+            self.invoice_num.insert(0, self.get_next_invoice_number())
+        self.refresh_history_ui()
+        print(f"Imported {saved} invoices from {importer.invoice_path}")
+        return saved
+
+    def archive_history(self):
+        """Ask, then archive the current business's invoices from before the kept financial years"""
+        biz_id = self.current_biz_id
+        with self.db_lock:
+            self.sync_shared_changes()
+            old_count = len(self.get_business_history(biz_id).between(1, archive_cutoff() - 1))
+        if not old_count:
+            messagebox.showinfo("Archive Old Invoices", "There are no invoices old enough to archive.")
+            return
+        if not messagebox.askyesno(
+                "Archive Old Invoices",
+                f"Move {old_count} invoices from before the current financial year into the archive?\n\n"
+                "They stay searchable and can still be opened, but no longer appear in the history "
+                "list or its totals."):
+            return
+        archived = self.archive_old_invoices(biz_id)
+        self.refresh_history_ui()
+        messagebox.showinfo("Archive Old Invoices", f"Archived {archived} invoices.")
+
+    def archive_old_invoices(self, biz_id):
+        """Move invoices from before the kept financial years into compressed yearly archives
+
+        They stay searchable and loadable; the live history and sidebar only carry the current period.
+        Returns how many invoices were archived.
+        """
+        archived = 0
+        with self.db_lock:
+            old = self.history[biz_id].between(1, archive_cutoff() - 1)
+            by_year = {}
+            for summary in old:
+                by_year.setdefault(financial_year_label(summary['date_ord']), []).append(summary)
+            for fy, summaries in by_year.items():
+                try:
+                    records = [self.history_store.get_invoice(biz_id, summary) for summary in summaries]
+                    self.invoice_archive.add(biz_id, fy, records)
+                except Exception as e:
+                    print(f"Could not archive {fy} of {biz_id}: {e}")
+                    continue
+                # Only drop them from the live history once the archive is safely on disk
+                self.history_store.delete_many(biz_id, [summary['id'] for summary in summaries])
+                archived += len(summaries)
+                print(f"Archived {len(summaries)} invoices of {biz_id} into {fy}")
+        return archived
+
+    def get_full_invoice(self, biz_id, summary):
+        """Load the complete invoice record (with items) for a history summary"""
+        if 'items' in summary:
+            return summary
+        if 'archive' in summary:
+            return self.invoice_archive.get_invoice(biz_id, summary)
+        return self.history_store.get_invoice(biz_id, summary)
 
     def load_invoice_from_history(self, history_item):
         """Load invoice data from history into the form"""
+        # The sidebar only holds summaries, fetch the full record from disk
+        history_item = self.get_full_invoice(history_item.get('biz_id', self.current_biz_id), history_item)
+        if history_item is None:
+            messagebox.showerror("Error", "This invoice could not be found in the history.")
+            return
+        
         # Switch to the correct business
         if history_item.get('biz_id'):
             self.switch_business(history_item['biz_id'])
@@ -3608,9 +7883,13 @@ class InvoiceApp(ct.CTk):
         self.client_address.delete(0, 'end')
         self.client_address.insert(0, history_item.get('client_address', ''))
         
+        if history_item.get('client_notes'):
+            self.client_notes.delete("1.0", "end")
+            self.client_notes.insert("1.0", history_item['client_notes'])
+        
         self.due_date.delete(0, 'end')
         due_date_val = history_item.get('due_date', '')
-        if due_date_val == "PENDING":
+        if invoice_is_pending(history_item):
             self.pending_var.set(True)
             self.toggle_pending()
         else:
@@ -3641,14 +7920,10 @@ class InvoiceApp(ct.CTk):
     def delete_invoice_from_history(self, invoice_id):
         """Delete an invoice from current business history with confirmation"""
         # Get current business history
-        current_history = self.history.get(self.current_biz_id, [])
+        current_history = self.get_business_history(self.current_biz_id)
         
         # Find invoice details for confirmation
-        invoice_to_delete = None
-        for h in current_history:
-            if h['id'] == invoice_id:
-                invoice_to_delete = h
-                break
+        invoice_to_delete = current_history.get(invoice_id)
         
         if invoice_to_delete:
             # Show confirmation dialog
@@ -3659,148 +7934,362 @@ class InvoiceApp(ct.CTk):
             )
             
             if result:
-                # Remove from current business history
-                self.history[self.current_biz_id] = [h for h in current_history if h['id'] != invoice_id]
-                
-                # Save to file
-                with open(HISTORY_FILE, 'w') as f:
-                    json.dump(self.history, f, indent=4)
+                with self.db_lock:
+                    self.sync_shared_changes()
+                    current_history = self.get_business_history(self.current_biz_id)
+                    row = current_history.row_of(invoice_id)
+                    # Sidebar row of the invoice, counted from the top (newest first)
+                    removed_row = None if row is None else len(current_history) - 1 - row
+                    
+                    # Remove from the history store (also tombstones it in the loaded summaries)
+                    self.history_store.delete(self.current_biz_id, invoice_id)
+                self.search_index.remove(self.current_biz_id, invoice_id)
                 
-                self.refresh_history_ui()
+                # Drop just that card (another instance may have deleted it already)
+                if removed_row is not None and self.history_list_is_live():
+                    self.history_list.rows_removed(removed_row)
+                else:
+                    self.refresh_history_ui()
+                self.refresh_history_stats()
                 messagebox.showinfo("Success", f"Invoice #{invoice_id} has been deleted.")
 
+    def mark_invoice_paid(self, invoice_id):
+        """Mark a pending invoice as paid today; updates its card and the business totals"""
+        with self.db_lock:
+            self.sync_shared_changes()
+            current_history = self.get_business_history(self.current_biz_id)
+            summary = current_history.get(invoice_id)
+            if summary is None:
+                return
+            
+            record = self.get_full_invoice(self.current_biz_id, summary)
+            record['is_pending'] = False
+            record['due_date'] = datetime.now().strftime("%d-%m-%Y")
+            record['due_date_ord'] = date_ordinal(record['due_date'])
+            self.history_store.update(self.current_biz_id, record)
+        
+        if self.history_list_is_live():
+            self.history_list.row_changed(len(current_history) - 1 - current_history.row_of(invoice_id))
+        else:
+            self.refresh_history_ui()
+        self.refresh_history_stats()
+
     def on_search_change(self, event=None):
-        """Handle search input changes"""
+        """Handle search input changes; the search runs once typing pauses"""
+        if self.search_after_id is not None:
+            self.after_cancel(self.search_after_id)
+        self.search_after_id = self.after(SEARCH_DEBOUNCE_MS, self.run_search)
+
+    def run_search(self):
+        self.search_after_id = None
         self.refresh_history_ui()
 
-    def filter_invoices(self, invoices, search_term):
-        """Filter invoices based on search term"""
-        if not search_term:
-            return invoices
-        
-        search_term = search_term.lower().strip()
-        filtered = []
-        
-        for invoice in invoices:
-            # Search by invoice ID
-            if search_term in str(invoice.get('id', '')).lower():
-                filtered.append(invoice)
-                continue
-            
-            # Search by client name
-            if search_term in invoice.get('client', '').lower():
-                filtered.append(invoice)
+    def search_worker(self):
+        """Background thread: run history searches, skipping any that are already out of date"""
+        while True:
+            request = self.search_requests.get()
+            # Jump straight to the newest query if more were typed while we were busy
+            while not self.search_requests.empty():
+                request = self.search_requests.get_nowait()
+            generation, biz_id, search_term, invoices, date_range = request
+            if generation != self.search_generation:
                 continue
+            try:
+                matches = self.filter_invoices(invoices, search_term, biz_id, date_range)
+            except Exception as e:
+                print(f"History search failed: {e}")
+                matches = []
+            self.search_results.put((generation, biz_id, search_term, matches))
+
+    def poll_search_results(self):
+        """Show the result of the newest search once it is ready (runs on the Tk thread)"""
+        latest = None
+        while not self.search_results.empty():
+            latest = self.search_results.get_nowait()
+        if latest is not None:
+            generation, biz_id, search_term, matches = latest
+            if generation == self.search_generation and biz_id == self.current_biz_id:
+                self.show_history_results(matches, search_term)
+        self.after(SEARCH_POLL_MS, self.poll_search_results)
+
+    def filter_invoices(self, invoices, search_term, biz_id=None, date_range=None):
+        """Filter invoices by id, client, contact details, notes or item descriptions
+
+        With a date_range (start, end ordinals), archived matches are limited to it as well.
+        """
+        if not search_term or not search_term.strip():
+            return invoices
         
-        return filtered
+        biz_id = biz_id or self.current_biz_id
+        matching_ids = self.search_index.search(biz_id, search_term)
+        # Archived invoices are not in the live list but still show up in searches (oldest first)
+        archived = (self.invoice_archive.between(biz_id, *date_range) if date_range
+                    else self.invoice_archive.summaries(biz_id))
+        archived = [s for s in archived if str(s['id']) in matching_ids]
+        return archived + [invoice for invoice in invoices
+                           if str(invoice.get('id')) in matching_ids and 'archive' not in invoice]
+
+    def refresh_history_stats(self):
+        """Show the current business's running totals in the sidebar"""
+        stats = self.get_business_history(self.current_biz_id).stats
+        today = datetime.now().strftime("%d-%m-%Y")
+        self.stats_label.configure(text=(
+            f"Invoices: {stats.count}    Today: Rs {stats.day_total(today):.2f}\n"
+            f"Gross: Rs {stats.gross / 100:.2f}    Tax: Rs {stats.tax / 100:.2f}\n"
+            f"Discount: Rs {stats.discount / 100:.2f}\n"
+            f"Pending: Rs {stats.pending / 100:.2f} ({stats.pending_count} invoices)"))
+
+    def get_date_range(self):
+        """(start, end) day ordinals from the sidebar date filter, or None when it is empty
+
+        An empty or unreadable end leaves that side of the range open.
+        """
+        if not hasattr(self, 'range_from_entry'):
+            return None
+        start = date_ordinal(self.range_from_entry.get())
+        end = date_ordinal(self.range_to_entry.get())
+        if start is None and end is None:
+            return None
+        return (start if start is not None else 1, end if end is not None else datetime.max.toordinal())
 
     def refresh_history_ui(self):
-        for w in self.history_list.winfo_children(): w.destroy()
-        
         # Get current business history
-        current_history = self.history.get(self.current_biz_id, [])
-        
-        # Apply search filter if search entry exists
-        if hasattr(self, 'search_entry'):
-            search_term = self.search_entry.get()
-            current_history = self.filter_invoices(current_history, search_term)
-        
-        if not current_history:
-            empty_frame = ct.CTkFrame(self.history_list, 
-                                     fg_color=("#f1f5f9", "#1e293b"),
-                                     corner_radius=8)
-            empty_frame.pack(fill="x", pady=10, padx=5)
-            
-            if hasattr(self, 'search_entry') and self.search_entry.get():
-                ct.CTkLabel(empty_frame, text="No invoices found", 
-                           text_color=("#94a3b8", "#64748b"),
-                           font=ct.CTkFont(size=11)).pack(pady=12)
-            else:
-                ct.CTkLabel(empty_frame, text="No recent invoices", 
-                           text_color=("#94a3b8", "#64748b"),
-                           font=ct.CTkFont(size=11)).pack(pady=12)
+        current_history = self.get_business_history(self.current_biz_id)
+        self.refresh_history_stats()
+        
+        # Date range: a binary search on the date index, invoices come back oldest first
+        date_range = self.get_date_range()
+        if date_range:
+            current_history = (self.invoice_archive.between(self.current_biz_id, *date_range)
+                               + current_history.between(*date_range))
+        
+        # With a search term, hand the query to the search worker; its result is shown when ready
+        search_term = self.search_entry.get().strip() if hasattr(self, 'search_entry') else ""
+        self.search_generation += 1
+        if search_term:
+            self.search_requests.put(
+                (self.search_generation, self.current_biz_id, search_term, list(current_history), date_range))
             return
         
-        # Show all matching invoices (unlimited) with compact modern card design
-        for idx, h in enumerate(reversed(current_history)):
-            # Compact card for each invoice
-            item_card = ct.CTkFrame(self.history_list, 
-                                   fg_color=("#ffffff", "#1e293b"),
-                                   corner_radius=10,
-                                   border_width=1,
-                                   border_color=("#e2e8f0", "#334155"))
-            item_card.pack(fill="x", pady=4, padx=3)
-            
-            # Main content frame
-            content_frame = ct.CTkFrame(item_card, fg_color="transparent")
-            content_frame.pack(fill="x", padx=8, pady=8)
-            
-            # Top row - Invoice number and amount
-            top_row = ct.CTkFrame(content_frame, fg_color="transparent")
-            top_row.pack(fill="x")
-            
-            ct.CTkLabel(top_row, text=f"#{h['id']}", 
-                       font=ct.CTkFont(size=11, weight="bold"),
-                       text_color=("#1e40af", "#60a5fa")).pack(side="left")
-            
-            ct.CTkLabel(top_row, text=f"Rs {h['total']:.2f}", 
-                       font=ct.CTkFont(size=11, weight="bold"),
-                       text_color=("#059669", "#10b981")).pack(side="right")
-            
-            # Middle row - Client name
-            ct.CTkLabel(content_frame, text=h['client'], 
-                       font=ct.CTkFont(size=10),
-                       text_color=("#1e293b", "#f1f5f9")).pack(anchor="w", pady=(2, 0))
-            
-            # Bottom row - Date and status
-            bottom_row = ct.CTkFrame(content_frame, fg_color="transparent")
-            bottom_row.pack(fill="x", pady=(2, 0))
-            
-            if h.get('date'):
-                ct.CTkLabel(bottom_row, text=f"{h['date']}", 
-                           font=ct.CTkFont(size=9),
-                           text_color=("#94a3b8", "#64748b")).pack(side="left")
-            
-            if h.get('due_date'):
-                due_text = "⏳ Pending" if h['due_date'] == "PENDING" else f"Due: {h['due_date']}"
-                ct.CTkLabel(bottom_row, text=due_text, 
-                           font=ct.CTkFont(size=9),
-                           text_color=("#f59e0b", "#fbbf24")).pack(side="right")
-            
-            # Action buttons row
-            button_row = ct.CTkFrame(item_card, fg_color="transparent")
-            button_row.pack(fill="x", padx=8, pady=(0, 8))
-            
-            # Load button
-            load_btn = ct.CTkButton(
-                button_row,
-                text="📂 Load",
-                command=lambda item=h: self.load_invoice_from_history(item),
-                width=80,
-                height=28,
-                fg_color=("#3b82f6", "#2563eb"),
-                hover_color=("#2563eb", "#1d4ed8"),
-                corner_radius=6,
-                font=ct.CTkFont(size=10, weight="bold")
-            )
-            load_btn.pack(side="left", padx=(0, 4))
-            
-            # Delete button
-            delete_btn = ct.CTkButton(
-                button_row,
-                text="✕",
-                command=lambda item_id=h['id']: self.delete_invoice_from_history(item_id),
-                width=28,
-                height=28,
-                fg_color=("#ef4444", "#dc2626"),
-                hover_color=("#dc2626", "#b91c1c"),
-                corner_radius=6,
-                font=ct.CTkFont(size=12, weight="bold")
-            )
-            delete_btn.pack(side="right")
+        self.show_history_results(current_history, date_range)
+
+    def show_history_results(self, current_history, filtered):
+        """Show a (possibly filtered) invoice list in the sidebar, newest first"""
+        empty_text = "No invoices found" if filtered else "No recent invoices"
+        self.history_list.set_items(current_history, empty_text)
+
+    def history_list_is_live(self):
+        """True when the sidebar shows the current business's unfiltered history list itself"""
+        return (not self.search_entry.get().strip() and not self.get_date_range()
+                and self.history_list.items is self.get_business_history(self.current_biz_id))
+
+    def create_history_card(self, parent):
+        """Build one reusable invoice card; bind_history_card fills it for a given invoice"""
+        item_card = ct.CTkFrame(parent, 
+                               fg_color=("#ffffff", "#1e293b"),
+                               corner_radius=10,
+                               border_width=1,
+                               border_color=("#e2e8f0", "#334155"))
+        
+        # Main content frame
+        content_frame = ct.CTkFrame(item_card, fg_color="transparent")
+        content_frame.pack(fill="x", padx=8, pady=(8, 4))
+        
+        # Top row - Invoice number and amount
+        top_row = ct.CTkFrame(content_frame, fg_color="transparent")
+        top_row.pack(fill="x")
+        
+        item_card.id_label = ct.CTkLabel(top_row, text="", 
+                                         font=ct.CTkFont(size=11, weight="bold"),
+                                         text_color=("#1e40af", "#60a5fa"))
+        item_card.id_label.pack(side="left")
+        
+        item_card.total_label = ct.CTkLabel(top_row, text="", 
+                                            font=ct.CTkFont(size=11, weight="bold"),
+                                            text_color=("#059669", "#10b981"))
+        item_card.total_label.pack(side="right")
+        
+        # Middle row - Client name
+        item_card.client_label = ct.CTkLabel(content_frame, text="", 
+                                             font=ct.CTkFont(size=10),
+                                             text_color=("#1e293b", "#f1f5f9"))
+        item_card.client_label.pack(anchor="w", pady=(2, 0))
+        
+        # Bottom row - Date and status
+        bottom_row = ct.CTkFrame(content_frame, fg_color="transparent")
+        bottom_row.pack(fill="x", pady=(2, 0))
+        
+        item_card.date_label = ct.CTkLabel(bottom_row, text="", 
+                                           font=ct.CTkFont(size=9),
+                                           text_color=("#94a3b8", "#64748b"))
+        item_card.date_label.pack(side="left")
+        
+        item_card.due_label = ct.CTkLabel(bottom_row, text="", 
+                                          font=ct.CTkFont(size=9),
+                                          text_color=("#f59e0b", "#fbbf24"))
+        item_card.due_label.pack(side="right")
+        
+        # Action buttons row
+        button_row = ct.CTkFrame(item_card, fg_color="transparent")
+        button_row.pack(fill="x", padx=8, pady=(0, 8))
+        
+        # Load button
+        item_card.load_btn = ct.CTkButton(
+            button_row,
+            text="📂 Load",
+            width=80,
+            height=28,
+            fg_color=("#3b82f6", "#2563eb"),
+            hover_color=("#2563eb", "#1d4ed8"),
+            corner_radius=6,
+            font=ct.CTkFont(size=10, weight="bold")
+        )
+        item_card.load_btn.pack(side="left", padx=(0, 4))
+        
+        # Mark paid button (only shown on pending invoices)
+        item_card.paid_btn = ct.CTkButton(
+            button_row,
+            text="✓ Paid",
+            width=60,
+            height=28,
+            fg_color=("#10b981", "#059669"),
+            hover_color=("#059669", "#047857"),
+            corner_radius=6,
+            font=ct.CTkFont(size=10, weight="bold")
+        )
+        
+        # Delete button
+        item_card.delete_btn = ct.CTkButton(
+            button_row,
+            text="✕",
+            width=28,
+            height=28,
+            fg_color=("#ef4444", "#dc2626"),
+            hover_color=("#dc2626", "#b91c1c"),
+            corner_radius=6,
+            font=ct.CTkFont(size=12, weight="bold")
+        )
+        item_card.delete_btn.pack(side="right")
+        return item_card
+
+    def bind_history_card(self, item_card, h):
+        """Fill a (possibly recycled) invoice card with one invoice summary"""
+        item_card.id_label.configure(text=f"#{h['id']}")
+        item_card.total_label.configure(text=f"Rs {h['total']:.2f}")
+        item_card.client_label.configure(text=h['client'])
+        item_card.date_label.configure(text=h.get('date') or "")
+        
+        due_text = ""
+        if h.get('archive'):
+            due_text = f"📦 Archived {h['archive']}"
+        elif invoice_is_pending(h):
+            due_text = "⏳ Pending"
+        elif h.get('due_date'):
+            due_text = f"Due: {h['due_date']}"
+        item_card.due_label.configure(text=due_text)
+        
+        item_card.load_btn.configure(command=lambda item=h: self.load_invoice_from_history(item))
+        # Archives are read-only: no delete or mark paid
+        item_card.delete_btn.configure(state="disabled" if h.get('archive') else "normal")
+        if invoice_is_pending(h) and not h.get('archive'):
+            item_card.paid_btn.configure(command=lambda item_id=h['id']: self.mark_invoice_paid(item_id))
+            item_card.paid_btn.pack(side="left", padx=(0, 4))
+        else:
+            item_card.paid_btn.pack_forget()
+        item_card.delete_btn.configure(command=lambda item_id=h['id']: self.delete_invoice_from_history(item_id))
+
+# --- BATCH RENDERING ---
+
+class PdfRenderer:
+    """The part of InvoiceApp that renders invoice PDFs, for worker processes that have no window"""
+
+    make_pdf_style_1 = InvoiceApp.make_pdf_style_1
+    sanitize_invoice_text = InvoiceApp.sanitize_invoice_text
+    draw_pdf_style_1 = InvoiceApp.draw_pdf_style_1
+    render_plan = InvoiceApp.render_plan
+    sanitize_text = InvoiceApp.sanitize_text
+    get_rupee_symbol = InvoiceApp.get_rupee_symbol
+
+    def __init__(self, font_dir, font_cache_folder, logo_cache_folder):
+        self.current_biz_id = None  # Jobs carry their biz_id
+        self.render_plans = {}
+        self.logo_cache = LogoCache(logo_cache_folder)
+        self.pdf_fonts = FontRegistry(font_dir, font_cache_folder)
+
+
+RENDER_WORKER = None  # The PdfRenderer of a render worker process
+
+
+def init_render_worker(font_dir, font_cache_folder, logo_cache_folder, logo_paths):
+    """Worker process start-up: load the fonts and logos once, from the caches the app filled"""
+    global RENDER_WORKER
+    RENDER_WORKER = PdfRenderer(font_dir, font_cache_folder, logo_cache_folder)
+    RENDER_WORKER.pdf_fonts.loaded()
+    for logo_path in logo_paths:
+        RENDER_WORKER.logo_cache.get(logo_path)
+
+
+def render_pdf_batch(jobs):
+    """Worker process: render (data, path) jobs; returns (rendered, [(invoice id, error)])"""
+    rendered, failures = 0, []
+    for data, path in jobs:
+        try:
+            RENDER_WORKER.make_pdf_style_1(data, path)
+            rendered += 1
+        except Exception as e:
+            failures.append((data['id'], str(e)))
+    return rendered, failures
+
+
+def render_history_pdfs(jobs, total=None, progress=None, cancelled=None, workers=RENDER_WORKERS, logo_paths=()):
+    """Render (data, path) jobs to PDF files on a pool of worker processes
+
+    Jobs go out RENDER_BATCH_INVOICES at a time, with at most two batches per worker waiting,
+    so invoices are read only as fast as they are rendered. Returns (rendered, failures), a
+    failure being an (invoice id, error) pair. Once cancelled is set no more batches are sent,
+    and JobCancelled is raised when the running ones finish.
+    """
+    workers = workers or os.cpu_count() or 1
+    rendered, failures = 0, []
+    running = set()
+
+    def collect(finished):
+        nonlocal rendered
+        for future in finished:
+            count, errors = future.result()
+            rendered += count
+            failures.extend(errors)
+        if progress:
+            progress(rendered + len(failures), total)
+
+    batches = iter(lambda: list(itertools.islice(jobs, RENDER_BATCH_INVOICES)), [])
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_render_worker,
+                             initargs=(RESOURCE_DIR, FONT_CACHE_FOLDER, LOGO_CACHE_FOLDER,
+                                       tuple(logo_paths))) as pool:
+        for batch in batches:
+            if cancelled is not None and cancelled.is_set():
+                break
+            running.add(pool.submit(render_pdf_batch, batch))
+            if len(running) >= 2 * workers:
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                collect(finished)
+        while running:
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            collect(finished)
+    if cancelled is not None and cancelled.is_set():
+        raise JobCancelled()
+    return rendered, failures
 
 
 if __name__ == "__main__":
+    # Render worker processes of a frozen EXE start here and must not open the app
+    multiprocessing.freeze_support()
+
+    # Finish any DB file write a crash or power cut interrupted before anything is read
+    # (under the DB lock, so writes another instance is making right now are left alone)
+    with FileLock(DB_LOCK_FILE):
+        recover_pending_writes(DB_FOLDER)
+
     # Create a temporary root window for splash screen and login
     root = ct.CTk()
     root.withdraw()  # Hide the main window
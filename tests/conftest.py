@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def db_folder(tmp_path, monkeypatch):
+    """Point every DB file and folder of main at a fresh temp folder"""
+    original = main.DB_FOLDER
+    for name in dir(main):
+        value = getattr(main, name)
+        if name.endswith(('_FILE', '_FOLDER')) and isinstance(value, str) and value.startswith(original):
+            monkeypatch.setattr(main, name, str(tmp_path) + value[len(original):])
+    return str(tmp_path)
+
+
+def make_invoice(number, client="Acme", date="05-06-2025", **fields):
+    """An invoice record as save_to_history stores it"""
+    record = {
+        "id": str(number), "client": client, "client_email": "acme@example.com",
+        "client_phone": "9876543210", "client_address": "Chennai", "business": "Tech Co",
+        "items": [{"desc": "Widget", "price": 100.0, "price_per_unit": 50.0, "quantity": 2.0,
+                   "quantity_display": "2", "unit": "Kg"}],
+        "subtotal": 100.0, "discount_rate": 0, "discount_amt": 0.0, "tax_rate": 18.0, "tax_amt": 18.0,
+        "total": 118.0, "date": date, "due_date": "", "is_pending": False, "client_notes": "",
+    }
+    record.update(fields)
+    return main.with_date_ordinals(record)
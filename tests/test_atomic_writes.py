@@ -0,0 +1,99 @@
+import json
+import os
+
+import pytest
+
+import main
+
+
+def test_atomic_file_replaces_the_file_and_leaves_nothing_behind(tmp_path):
+    path = tmp_path / "profiles.json"
+    path.write_text("old")
+    with main.atomic_file(str(path), 'w', encoding='utf-8') as f:
+        f.write("new")
+    assert path.read_text() == "new"
+    assert os.listdir(tmp_path) == ["profiles.json"]
+
+
+def test_atomic_file_keeps_the_old_file_when_the_write_fails(tmp_path):
+    path = tmp_path / "profiles.json"
+    path.write_text("old")
+    with pytest.raises(RuntimeError):
+        with main.atomic_file(str(path), 'w', encoding='utf-8') as f:
+            f.write("half")
+            raise RuntimeError("disk full")
+    assert path.read_text() == "old"
+    assert os.listdir(tmp_path) == ["profiles.json"]
+
+
+def test_concurrent_writers_of_one_file_use_their_own_temp_files(tmp_path):
+    path = str(tmp_path / "profiles.json")
+    with main.atomic_file(path, 'w', encoding='utf-8') as first:
+        with main.atomic_file(path, 'w', encoding='utf-8') as second:
+            assert first.name != second.name
+            first.write("first")
+            second.write("second")
+        assert open(path).read() == "second"
+    assert open(path).read() == "first"
+    assert os.listdir(tmp_path) == ["profiles.json"]
+
+
+def test_recovery_finishes_a_rename_behind_a_marker(tmp_path):
+    (tmp_path / "profiles.json").write_text("old")
+    (tmp_path / "profiles.json.k3x9.tmp").write_text("new")
+    (tmp_path / "profiles.json.k3x9.tmp.pending").write_text("profiles.json")
+    main.recover_pending_writes(str(tmp_path))
+    assert (tmp_path / "profiles.json").read_text() == "new"
+    assert os.listdir(tmp_path) == ["profiles.json"]
+
+
+def test_recovery_understands_markers_written_before_temp_names_were_unique(tmp_path):
+    (tmp_path / "profiles.json").write_text("old")
+    (tmp_path / "profiles.json.tmp").write_text("new")
+    (tmp_path / "profiles.json.pending").write_text("profiles.json.tmp")
+    main.recover_pending_writes(str(tmp_path))
+    assert (tmp_path / "profiles.json").read_text() == "new"
+    assert os.listdir(tmp_path) == ["profiles.json"]
+
+
+def test_recovery_drops_an_unfinished_temp_file_and_keeps_the_old_file(tmp_path):
+    (tmp_path / "profiles.json").write_text("old")
+    (tmp_path / "profiles.json.k3x9.tmp").write_text("ha")
+    main.recover_pending_writes(str(tmp_path))
+    assert (tmp_path / "profiles.json").read_text() == "old"
+    assert os.listdir(tmp_path) == ["profiles.json"]
+
+
+def test_recovery_with_a_marker_whose_temp_file_is_gone_keeps_the_new_file(tmp_path):
+    # The crash came after the rename but before the marker was removed
+    (tmp_path / "profiles.json").write_text("new")
+    (tmp_path / "profiles.json.k3x9.tmp.pending").write_text("profiles.json")
+    main.recover_pending_writes(str(tmp_path))
+    assert (tmp_path / "profiles.json").read_text() == "new"
+    assert os.listdir(tmp_path) == ["profiles.json"]
+
+
+def test_recovery_walks_subfolders(tmp_path):
+    shards = tmp_path / "history"
+    shards.mkdir()
+    (shards / "biz_1.json").write_text("old")
+    (shards / "biz_1.json.123-456.tmp").write_text("new")
+    (shards / "biz_1.json.123-456.tmp.pending").write_text("biz_1.json")
+    main.recover_pending_writes(str(tmp_path))
+    assert (shards / "biz_1.json").read_text() == "new"
+    assert os.listdir(shards) == ["biz_1.json"]
+
+
+def test_corrupt_json_is_quarantined_and_the_default_returned(tmp_path):
+    path = tmp_path / "license.json"
+    path.write_text('{"key": ')
+    assert main.read_json_file(str(path), {}) == {}
+    assert not path.exists()
+    corrupt = [name for name in os.listdir(tmp_path) if name.startswith("license.json.corrupt-")]
+    assert len(corrupt) == 1
+
+
+def test_write_json_atomic_round_trips(tmp_path):
+    path = str(tmp_path / "clients.json")
+    main.write_json_atomic(path, {"biz_1": ["Acme"]}, indent=2)
+    assert json.load(open(path)) == {"biz_1": ["Acme"]}
@@ -0,0 +1,210 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+import main
+from conftest import make_invoice
+
+
+def legacy_invoice(number, due_date=""):
+    """An invoice as history.json held it before schema versioning"""
+    return {"id": number, "client": f"Client {number}", "total": 10.0, "tax_amt": 0, "discount_amt": 0,
+            "date": "05-06-2025", "due_date": due_date, "items": [{"desc": "Widget", "price": 10.0}]}
+
+
+def open_journal(folder, **kwargs):
+    return main.JournalHistoryStore(folder, **kwargs)
+
+
+def summaries_of(store, biz_id="biz_1"):
+    return [(summary["id"], summary["client"]) for summary in store.load_business(biz_id)]
+
+
+# --- Journal replay ---
+
+def test_journal_replays_creates_updates_and_deletes(db_folder):
+    store = open_journal(main.HISTORY_SHARD_FOLDER)
+    for number in range(1000, 1004):
+        store.insert("biz_1", make_invoice(number))
+    store.update("biz_1", make_invoice(1001, client="Renamed"))
+    store.delete("biz_1", "1002")
+    store.close()
+
+    store = open_journal(main.HISTORY_SHARD_FOLDER)
+    assert summaries_of(store) == [("1000", "Acme"), ("1001", "Renamed"), ("1003", "Acme")]
+    record = store.get_invoice("biz_1", store.load_business("biz_1").get("1001"))
+    assert record["client"] == "Renamed" and record["items"][0]["desc"] == "Widget"
+
+
+def test_journal_drops_a_half_written_last_line(db_folder):
+    store = open_journal(main.HISTORY_SHARD_FOLDER)
+    store.insert("biz_1", make_invoice(1000))
+    store.close()
+    with open(os.path.join(main.HISTORY_SHARD_FOLDER, "biz_1.journal"), 'ab') as f:
+        f.write(b'{"op": "create", "invoice": {"id": "10')
+
+    store = open_journal(main.HISTORY_SHARD_FOLDER)
+    assert summaries_of(store) == [("1000", "Acme")]
+    store.insert("biz_1", make_invoice(1001))
+    store.close()
+    assert summaries_of(open_journal(main.HISTORY_SHARD_FOLDER)) == [("1000", "Acme"), ("1001", "Acme")]
+
+
+def test_journal_replays_events_of_older_schema_versions(db_folder):
+    os.makedirs(main.HISTORY_SHARD_FOLDER)
+    with open(os.path.join(main.HISTORY_SHARD_FOLDER, "biz_1.journal"), 'w') as f:
+        f.write(json.dumps({"op": "create", "invoice": legacy_invoice(1000, due_date="PENDING")}) + "\n")
+    store = open_journal(main.HISTORY_SHARD_FOLDER)
+    summary = store.load_business("biz_1").get("1000")
+    assert summary["is_pending"] and summary["date_ord"] == main.date_ordinal("05-06-2025")
+    assert store.load_business("biz_1").stats.pending_count == 1
+
+
+# --- Journal compaction ---
+
+def test_compaction_folds_the_journal_into_the_snapshot(db_folder):
+    store = open_journal(main.HISTORY_SHARD_FOLDER)
+    store.load_business("biz_1")
+    for number in range(1000, 1010):
+        store.insert("biz_1", make_invoice(number))
+    store.delete("biz_1", "1004")
+    shard = store.shard("biz_1")
+    shard.compact()
+    assert not os.path.exists(shard.journal_path)
+    assert shard.read_header()["schema"] == main.HISTORY_SCHEMA_VERSION
+    # Saves after the compaction go to a fresh journal
+    store.insert("biz_1", make_invoice(1010))
+    expected = summaries_of(store)
+    store.close()
+
+    store = open_journal(main.HISTORY_SHARD_FOLDER)
+    assert summaries_of(store) == expected
+    assert [summary["id"] for summary in store.load_business("biz_1")][-2:] == ["1009", "1010"]
+    assert all(store.get_invoice("biz_1", summary)["id"] == summary["id"]
+               for summary in store.load_business("biz_1"))
+
+
+def test_a_folded_journal_left_by_a_crash_is_not_replayed_twice(db_folder):
+    store = open_journal(main.HISTORY_SHARD_FOLDER)
+    store.load_business("biz_1")
+    for number in range(1000, 1003):
+        store.insert("biz_1", make_invoice(number))
+    shard = store.shard("biz_1")
+    with open(shard.journal_path, 'rb') as f:
+        journal = f.read()
+    shard.compact()
+    store.close()
+    # The crash came after the new snapshot was swapped in but before the old journal was removed
+    folded_path = os.path.join(main.HISTORY_SHARD_FOLDER, shard.read_header()["folded"])
+    with open(folded_path, 'wb') as f:
+        f.write(journal)
+
+    store = open_journal(main.HISTORY_SHARD_FOLDER)
+    assert summaries_of(store) == [("1000", "Acme"), ("1001", "Acme"), ("1002", "Acme")]
+    assert not os.path.exists(folded_path)
+
+
+def test_loading_compacts_a_journal_past_the_threshold(db_folder):
+    store = open_journal(main.HISTORY_SHARD_FOLDER, compact_bytes=1)
+    for number in range(1000, 1005):
+        store.insert("biz_1", make_invoice(number))
+    store.close()
+
+    store = open_journal(main.HISTORY_SHARD_FOLDER, compact_bytes=1)
+    store.load_business("biz_1")
+    store.close()
+    assert not os.path.exists(store.shard("biz_1").journal_path)
+    assert len(open_journal(main.HISTORY_SHARD_FOLDER).load_business("biz_1")) == 5
+
+
+# --- Migration round trips ---
+
+def write_history_json(history):
+    with open(main.HISTORY_FILE, 'w') as f:
+        json.dump(history, f)
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "journal"])
+def test_history_json_migrates_into_either_backend(db_folder, backend):
+    write_history_json({"biz_1": [legacy_invoice(1000), legacy_invoice(1001, due_date="PENDING")],
+                        "biz_2": [legacy_invoice(2000)]})
+    with open(main.HISTORY_JOURNAL_FILE, 'w') as f:
+        f.write(json.dumps({"op": "delete", "biz_id": "biz_1", "id": 1000}) + "\n")
+        f.write(json.dumps({"op": "create", "biz_id": "biz_1", "invoice": legacy_invoice(1002)}) + "\n")
+    if backend == "sqlite":
+        store = main.SQLiteHistoryStore(main.HISTORY_DB_FILE, main.HISTORY_SHARD_FOLDER)
+    else:
+        store = open_journal(main.HISTORY_SHARD_FOLDER)
+    fed = []
+    assert store.needs_migration(main.HISTORY_FILE, main.HISTORY_JOURNAL_FILE)
+    store.migrate_from_json(main.HISTORY_FILE, main.HISTORY_JOURNAL_FILE,
+                            on_record=lambda biz_id, record: fed.append((biz_id, record["id"])))
+
+    assert fed == [("biz_1", "1001"), ("biz_2", "2000"), ("biz_1", "1002")]
+    assert [summary["id"] for summary in store.load_business("biz_1")] == ["1001", "1002"]
+    record = store.get_invoice("biz_1", store.load_business("biz_1").get("1001"))
+    assert record["is_pending"] and record["due_date"] == ""
+    assert record["items"][0]["price_per_unit"] == 10.0
+    assert os.path.exists(main.HISTORY_FILE + ".migrated") and not os.path.exists(main.HISTORY_FILE)
+    assert not store.needs_migration(main.HISTORY_FILE, main.HISTORY_JOURNAL_FILE)
+
+
+def test_journal_shards_migrate_into_sqlite(db_folder):
+    journal = open_journal(main.HISTORY_SHARD_FOLDER)
+    for number in range(1000, 1003):
+        journal.insert("biz_1", make_invoice(number))
+    journal.update("biz_1", make_invoice(1001, client="Renamed", is_pending=True))
+    journal.insert("biz_2", make_invoice(2000))
+    journal.close()
+
+    store = main.SQLiteHistoryStore(main.HISTORY_DB_FILE, main.HISTORY_SHARD_FOLDER)
+    assert store.needs_migration(main.HISTORY_FILE, main.HISTORY_JOURNAL_FILE)
+    store.migrate_from_json(main.HISTORY_FILE, main.HISTORY_JOURNAL_FILE)
+    assert summaries_of(store) == [("1000", "Acme"), ("1001", "Renamed"), ("1002", "Acme")]
+    assert summaries_of(store, "biz_2") == [("2000", "Acme")]
+    assert store.load_business("biz_1").stats.pending_count == 1
+    assert os.path.isdir(main.HISTORY_SHARD_FOLDER + ".migrated")
+    store.close()
+
+    store = main.SQLiteHistoryStore(main.HISTORY_DB_FILE, main.HISTORY_SHARD_FOLDER)
+    assert not store.needs_migration(main.HISTORY_FILE, main.HISTORY_JOURNAL_FILE)
+    assert len(store.load_business("biz_1")) == 3
+
+
+def test_sqlite_upgrades_an_older_schema_in_place(db_folder):
+    store = main.SQLiteHistoryStore(main.HISTORY_DB_FILE)
+    store.insert("biz_1", make_invoice(1000, due_date="PENDING", is_pending=None))
+    store.insert("biz_1", make_invoice(1001))
+    store.close()
+    # Roll the database back to schema 3, before the is_pending column was filled in
+    conn = sqlite3.connect(main.HISTORY_DB_FILE)
+    conn.execute("UPDATE invoices SET is_pending = NULL")
+    conn.execute("PRAGMA user_version = 3")
+    conn.commit()
+    conn.close()
+
+    store = main.SQLiteHistoryStore(main.HISTORY_DB_FILE)
+    history = store.load_business("biz_1")
+    assert [(summary["id"], summary["is_pending"], summary["due_date"]) for summary in history] == [
+        ("1000", True, ""), ("1001", False, "")]
+    assert store.conn.execute("PRAGMA user_version").fetchone()[0] == main.HISTORY_SCHEMA_VERSION
+    assert history.stats.pending_count == 1
+
+
+def test_a_list_snapshot_is_rewritten_with_a_schema_header(db_folder):
+    os.makedirs(main.HISTORY_SHARD_FOLDER)
+    with open(os.path.join(main.HISTORY_SHARD_FOLDER, "biz_1.json"), 'w') as f:
+        json.dump([legacy_invoice(1000), legacy_invoice(1001)], f)
+    store = open_journal(main.HISTORY_SHARD_FOLDER)
+    assert [summary["id"] for summary in store.load_business("biz_1")] == ["1000", "1001"]
+    assert store.shard("biz_1").snapshot_version() == main.HISTORY_SCHEMA_VERSION
+    record = store.get_invoice("biz_1", store.load_business("biz_1").get("1000"))
+    assert record["date_ord"] == main.date_ordinal("05-06-2025")
+
+
+def test_every_schema_version_has_a_migration_step():
+    assert sorted(main.HISTORY_MIGRATIONS) == list(range(1, main.HISTORY_SCHEMA_VERSION))
+    record = main.migrate_record(legacy_invoice(7, due_date="PENDING"), 1)
+    assert record["id"] == "7" and record["is_pending"] and record["due_date_ord"] is None
@@ -0,0 +1,35 @@
+import main
+from conftest import make_invoice
+
+
+def archive_with_two_years(folder):
+    archive = main.InvoiceArchive(folder, block_size=2)
+    archive.add("biz_1", "2023-24", [make_invoice(1000, date="10-05-2023"), make_invoice(1001, date="01-04-2023"),
+                                     make_invoice(1002, date="20-03-2024")])
+    archive.add("biz_1", "2024-25", [make_invoice(1003, date="15-04-2024"), make_invoice(1004, date="01-06-2024")])
+    return archive
+
+
+def ids(summaries):
+    return [summary["id"] for summary in summaries]
+
+
+def test_between_spans_financial_years_in_date_order(tmp_path):
+    archive = archive_with_two_years(str(tmp_path))
+    assert ids(archive.between("biz_1", main.date_ordinal("01-05-2023"), main.date_ordinal("30-04-2024"))) == [
+        "1000", "1002", "1003"]
+    assert ids(archive.between("biz_1", main.date_ordinal("01-04-2023"), main.date_ordinal("01-04-2023"))) == ["1001"]
+    assert archive.between("biz_1", main.date_ordinal("01-01-2030"), main.date_ordinal("31-12-2030")) == []
+    assert archive.between("biz_2", 0, main.date_ordinal("31-12-2030")) == []
+
+
+def test_between_bisects_the_dates_cached_with_each_index(tmp_path):
+    archive = archive_with_two_years(str(tmp_path))
+    archive.between("biz_1", 0, main.date_ordinal("31-12-2030"))
+    index = archive.indexes[archive.path("biz_1", "2023-24")]
+    assert index["date_ords"] == [main.date_ordinal(d) for d in ("01-04-2023", "10-05-2023", "20-03-2024")]
+    # A rewritten year is re-read, dates included
+    archive.add("biz_1", "2023-24", [make_invoice(1005, date="01-01-2024")])
+    assert ids(archive.between("biz_1", main.date_ordinal("01-12-2023"), main.date_ordinal("31-01-2024"))) == ["1005"]
+    assert ids(archive.get_invoice("biz_1", s) for s in archive.between("biz_1", 0, main.date_ordinal("31-12-2030"))) == [
+        "1001", "1000", "1005", "1002", "1003", "1004"]
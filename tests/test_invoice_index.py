@@ -0,0 +1,64 @@
+import pytest
+
+import main
+from conftest import make_invoice
+
+
+def summary(number, total=118.0, date="05-06-2025", **fields):
+    return main.invoice_summary(make_invoice(number, total=total, date=date, **fields))
+
+
+def test_upsert_replaces_a_re_saved_invoice_where_it_stands():
+    index = main.InvoiceIndex([summary(1000), summary(1001), summary(1002)])
+    index.upsert(summary(1001, client="Renamed", total=200.0))
+    assert [(s["id"], s["client"]) for s in index] == [("1000", "Acme"), ("1001", "Renamed"), ("1002", "Acme")]
+    assert len(index) == 3 and index.row_of("1001") == 1
+    assert index.stats.count == 3 and index.stats.gross == 43600
+
+
+def test_remove_tombstones_and_later_positions_shift_down():
+    index = main.InvoiceIndex([summary(number) for number in range(1000, 1005)])
+    assert index.remove("1001")["id"] == "1001"
+    assert index.remove("1001") is None
+    assert "1001" not in index and len(index) == 4
+    assert index.row_of("1003") == 2 and index[2]["id"] == "1003" and index[-1]["id"] == "1004"
+    with pytest.raises(IndexError):
+        index[4]
+    index.upsert(summary(1001))
+    assert index.row_of("1001") == 4
+    index.compact()
+    assert [s["id"] for s in index] == ["1000", "1002", "1003", "1004", "1001"]
+    assert all(index.row_of(s["id"]) == row for row, s in enumerate(index))
+
+
+def test_stats_follow_re_saves_and_deletes():
+    index = main.InvoiceIndex([summary(1000), summary(1001)])
+    index.upsert(summary(1001, is_pending=True))
+    assert (index.stats.pending_count, index.stats.pending) == (1, 11800)
+    index.upsert(summary(1001, is_pending=False))
+    assert index.stats.pending_count == 0
+    index.remove("1000")
+    assert (index.stats.count, index.stats.gross) == (1, 11800)
+
+
+def test_date_range_follows_a_changed_date():
+    index = main.InvoiceIndex([summary(1000, date="01-06-2025"), summary(1001, date="05-06-2025")])
+    index.upsert(summary(1000, date="10-07-2025"))
+    june = index.between(main.date_ordinal("01-06-2025"), main.date_ordinal("30-06-2025"))
+    assert [s["id"] for s in june] == ["1001"]
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "journal"])
+def test_re_saving_an_invoice_keeps_its_place_in_either_store(db_folder, backend):
+    if backend == "sqlite":
+        store = main.SQLiteHistoryStore(main.HISTORY_DB_FILE)
+    else:
+        store = main.JournalHistoryStore(main.HISTORY_SHARD_FOLDER)
+    for number in range(1000, 1003):
+        store.insert("biz_1", make_invoice(number))
+    store.update("biz_1", make_invoice(1001, client="Renamed", total=200.0))
+    history = store.load_business("biz_1")
+    assert [(s["id"], s["client"]) for s in history] == [("1000", "Acme"), ("1001", "Renamed"), ("1002", "Acme")]
+    assert history.stats.count == 3 and history.stats.gross == 43600
+    assert store.get_invoice("biz_1", history.get("1001"))["total"] == 200.0
+    store.close()
@@ -0,0 +1,98 @@
+import copy
+
+import main
+
+
+BASE = {"biz_1": {"name": "Shop", "address": "Old St", "email": "shop@example.com", "last_invoice_num": 5}}
+
+
+def edited(profiles, **fields):
+    profiles = copy.deepcopy(profiles)
+    profiles["biz_1"].update(fields)
+    return profiles
+
+
+def test_edits_to_different_fields_are_both_kept():
+    merged = main.merge_profiles(BASE, edited(BASE, name="Shop A"), edited(BASE, address="New St"))
+    assert merged["biz_1"]["name"] == "Shop A"
+    assert merged["biz_1"]["address"] == "New St"
+
+
+def test_our_edit_wins_a_conflict_on_the_same_field():
+    merged = main.merge_profiles(BASE, edited(BASE, name="Shop A"), edited(BASE, name="Shop B"))
+    assert merged["biz_1"]["name"] == "Shop A"
+
+
+def test_an_unedited_field_takes_their_value():
+    merged = main.merge_profiles(BASE, copy.deepcopy(BASE), edited(BASE, name="Shop B"))
+    assert merged["biz_1"]["name"] == "Shop B"
+
+
+def test_invoice_numbering_only_moves_forward():
+    merged = main.merge_profiles(BASE, edited(BASE, last_invoice_num=7), edited(BASE, last_invoice_num=9))
+    assert merged["biz_1"]["last_invoice_num"] == 9
+    merged = main.merge_profiles(BASE, edited(BASE, last_invoice_num=9), edited(BASE, last_invoice_num=7))
+    assert merged["biz_1"]["last_invoice_num"] == 9
+
+
+def test_businesses_added_on_either_side_are_kept():
+    ours = copy.deepcopy(BASE)
+    ours["biz_2"] = {"name": "Ours"}
+    theirs = copy.deepcopy(BASE)
+    theirs["biz_3"] = {"name": "Theirs"}
+    merged = main.merge_profiles(BASE, ours, theirs)
+    assert set(merged) == {"biz_1", "biz_2", "biz_3"}
+
+
+def test_an_unreadable_file_on_disk_keeps_our_profiles():
+    assert main.merge_profiles(BASE, edited(BASE, name="Shop A"), None)["biz_1"]["name"] == "Shop A"
+
+
+def test_settled_base_treats_what_we_wrote_as_common_ground():
+    ours = edited(BASE, name="Shop A")
+    written = main.merge_profiles(BASE, ours, edited(BASE, address="New St"))
+    settled = main.settled_profiles(BASE, ours, written)
+    # Our name is on disk now; their address is still news to our in-memory profiles
+    assert settled["biz_1"]["name"] == "Shop A"
+    assert settled["biz_1"]["address"] == "Old St"
+    # So a later edit of the name by another counter wins over our unchanged copy
+    merged = main.merge_profiles(settled, ours, edited(written, name="Shop B"))
+    assert merged["biz_1"]["name"] == "Shop B"
+    assert merged["biz_1"]["address"] == "New St"
+
+
+class Counter:
+    """One app instance's profile handling, without the window"""
+
+    def __init__(self):
+        self.app = main.InvoiceApp.__new__(main.InvoiceApp)
+        self.app.db_lock = main.FileLock(main.DB_LOCK_FILE)
+        self.app.profiles = self.app.load_profiles()
+
+    def edit(self, **fields):
+        self.app.profiles["biz_1"].update(fields)
+        self.app.save_profiles()
+        main.JSON_WRITER.flush()
+
+
+def test_a_counter_does_not_put_back_a_value_it_saved_earlier(db_folder):
+    main.JSON_WRITER.save(main.PROFILES_FILE, BASE, indent=4, defer=False)
+    a, b = Counter(), Counter()
+    a.edit(name="Shop A")
+    b.app.refresh_profiles()
+    b.edit(name="Shop B")
+    # A saves another field before its next poll; B's newer name must survive
+    a.edit(address="New St")
+    on_disk = main.read_json_file(main.PROFILES_FILE, {})
+    assert on_disk["biz_1"]["name"] == "Shop B"
+    assert on_disk["biz_1"]["address"] == "New St"
+    assert a.app.refresh_profiles() == {"biz_1"}
+    assert a.app.profiles["biz_1"]["name"] == "Shop B"
+
+
+def test_our_own_write_is_not_read_back_as_a_change(db_folder):
+    main.JSON_WRITER.save(main.PROFILES_FILE, BASE, indent=4, defer=False)
+    a = Counter()
+    a.edit(name="Shop A")
+    assert a.app.profiles_stamp == main.file_stamp(main.PROFILES_FILE)
+    assert a.app.refresh_profiles() == set()
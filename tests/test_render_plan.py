@@ -0,0 +1,72 @@
+import copy
+
+import main
+from conftest import make_invoice
+
+
+class Entry:
+    """Stands in for a CTkEntry of the business form"""
+
+    def __init__(self, text=""):
+        self.text = text
+
+    def get(self):
+        return self.text
+
+
+def make_app():
+    """An InvoiceApp with its profiles and PDF caches but no window"""
+    app = main.InvoiceApp.__new__(main.InvoiceApp)
+    app.db_lock = main.FileLock(main.DB_LOCK_FILE)
+    app.profiles = copy.deepcopy(main.DEFAULT_PROFILES)
+    app.profiles_base = copy.deepcopy(main.DEFAULT_PROFILES)
+    app.current_biz_id = "biz_1"
+    app.render_plans = {}
+    app.logo_cache = main.LogoCache(main.LOGO_CACHE_FOLDER)
+    app.pdf_fonts = main.FontRegistry(main.RESOURCE_DIR, main.FONT_CACHE_FOLDER)
+    app.refresh_theme = lambda: None
+    app.refresh_history_ui = lambda: None
+    return app
+
+
+def plan_for(app, biz_id):
+    return app.render_plan(main.invoice_pdf_data(make_invoice(1000), app.profiles[biz_id], biz_id))
+
+
+def test_switching_business_saves_the_form_and_the_next_plan_uses_it(db_folder):
+    app = make_app()
+    assert plan_for(app, "biz_1").from_info.startswith("Tech Solutions Inc.")
+    app.biz_name_entry = Entry("Renamed Co")
+    app.biz_addr_entry = Entry("1 New Road")
+    app.biz_email_entry = Entry("")
+    app.biz_phone_entry = Entry("")
+    app.biz_gst_entry = Entry("")
+    app.biz_watermark_entry = Entry("PAID")
+    app.switch_business("biz_2")
+    main.JSON_WRITER.flush()
+
+    plan = plan_for(app, "biz_1")
+    assert plan.from_info == "Renamed Co\n1 New Road"
+    assert plan.watermark == "PAID"
+
+
+def test_a_plan_is_rebuilt_when_its_profile_changes_behind_the_cache(db_folder):
+    app = make_app()
+    first = plan_for(app, "biz_1")
+    assert plan_for(app, "biz_1") is first
+    # No code path dropped the plan, yet the edit still shows up
+    app.profiles["biz_1"]["phone"] = "+91 98765 43210"
+    assert plan_for(app, "biz_1").from_info.endswith("+91 98765 43210")
+
+
+def test_a_statement_renders_with_the_plan_it_is_given(db_folder, tmp_path):
+    app = make_app()
+    profile = app.profiles["biz_1"]
+    plan = app.render_plan(main.profile_pdf_data(profile, "biz_1"))
+    cached = dict(app.render_plans)
+    invoices = (main.invoice_pdf_data(make_invoice(number), profile, "biz_1") for number in range(1000, 1003))
+    path = str(tmp_path / "statement.pdf")
+    assert app.make_pdf_statement(invoices, path, plan, 3) == 3
+    assert open(path, 'rb').read().startswith(b"%PDF")
+    # The worker thread never touches the plan cache
+    assert app.render_plans == cached